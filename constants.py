@@ -30,6 +30,7 @@ HEAD_HEIGHT = CHESS_GRID_SIZE // 2.5
 
 ENGINE_SUGGESTION_COLOR = (0, 0, 255)
 ENGINE_SUGGESTION_ALPHA = 100
+ENGINE_ALTERNATIVE_ALPHA = 50 # the other lines of a multi-pv search
 
 PREVIOUS_MOVE_COLOR = (50, 50, 100)
 PREVIOUS_MOVE_ALPHA = 128
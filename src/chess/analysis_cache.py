@@ -0,0 +1,147 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from array import array
+from src.chess.board import Board, encode_move, decode_move
+
+'''
+Persistent analysis cache: the deepest search result of every position the engine has searched, kept in SQLite
+across sessions (zobrist key -> depth, score, bound, principal variation).
+The engine looks up its position at the root: a result searched deep enough is played without searching,
+otherwise its principal variation is searched first. Results are written back by a background thread,
+so the search never waits for the disk.
+
+The keys depend on the board's zobrist keys (ZOBRIST_SEED), delete the cache if they change.
+'''
+
+ANALYSIS_CACHE_FILE = 'src/chess/analysis_cache.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS analysis (
+    key INTEGER PRIMARY KEY,
+    depth INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    bound INTEGER NOT NULL,
+    pv BLOB NOT NULL
+)
+'''
+
+# a deeper result replaces the stored one, a shallower one is ignored
+UPSERT = '''
+INSERT INTO analysis (key, depth, score, bound, pv) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET depth = excluded.depth, score = excluded.score, bound = excluded.bound, pv = excluded.pv
+WHERE excluded.depth >= analysis.depth
+'''
+
+WRITE_BATCH_SIZE = 64 # results per transaction of the writer thread
+
+def to_signed(key):
+    '''SQLite integers are signed 64 bit numbers.'''
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+class AnalysisCache:
+    def __init__(self, path=ANALYSIS_CACHE_FILE):
+        self.path = path
+        connection = sqlite3.connect(path, check_same_thread=False)
+        # readers don't block the writer thread and the other way around
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(SCHEMA)
+        connection.commit()
+        # the searches read with this connection, from whatever thread they run on
+        self.connection = connection
+        self.lock = threading.Lock()
+
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self.write_results, daemon=True)
+        self.writer.start()
+        # results still queued at exit are written
+        atexit.register(self.flush)
+
+    def get(self, key):
+        '''(depth, score, bound, encoded pv) of the position, or None.'''
+        with self.lock:
+            row = self.connection.execute('SELECT depth, score, bound, pv FROM analysis WHERE key = ?', (to_signed(key),)).fetchone()
+        if row is None:
+            return None
+        depth, score, bound, encoded_pv = row
+        pv = array('H')
+        pv.frombytes(encoded_pv)
+        return depth, score, bound, list(pv)
+
+    def lookup(self, board: Board):
+        '''(depth, score, bound, pv) of the board's position with the pv as the board's moves, or None.
+        The pv stops at the first move that is not legal (a different position with the same key).'''
+        entry = self.get(board.zobrist_key)
+        if entry is None:
+            return None
+        depth, score, bound, codes = entry
+        pv = []
+        for code in codes:
+            move = decode_move(board.generate_legal_moves(), code)
+            if move is None:
+                break
+            pv.append(move)
+            board.make_move(move)
+        for _ in pv:
+            board.undo_move()
+        if not pv:
+            return None
+        return depth, score, bound, pv
+
+    def put(self, key, depth, score, bound, pv):
+        '''Queue a search result for the writer thread.'''
+        encoded_pv = array('H', [encode_move(move) for move in pv]).tobytes()
+        self.pending.put((to_signed(key), depth, score, bound, encoded_pv))
+
+    def write_results(self):
+        connection = sqlite3.connect(self.path)
+        while True:
+            result = self.pending.get()
+            if result is None:
+                self.pending.task_done()
+                break
+            results = [result]
+            # everything queued meanwhile goes into the same transaction
+            while len(results) < WRITE_BATCH_SIZE:
+                try:
+                    result = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if result is None:
+                    # handled by the outer loop
+                    self.pending.put(None)
+                    self.pending.task_done()
+                    break
+                results.append(result)
+            with connection:
+                connection.executemany(UPSERT, results)
+            for _ in results:
+                self.pending.task_done()
+        connection.close()
+
+    def flush(self):
+        '''Wait until the queued results are written.'''
+        self.pending.join()
+
+    def close(self):
+        atexit.unregister(self.flush)
+        self.pending.put(None)
+        self.writer.join()
+        self.connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+def load_analysis_cache(path=ANALYSIS_CACHE_FILE):
+    '''The analysis cache, created if it does not exist, or None if it can't be opened.'''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        return None
+    try:
+        return AnalysisCache(path)
+    except sqlite3.Error as error:
+        print(f"Analysis cache {path} disabled: {error}")
+        return None
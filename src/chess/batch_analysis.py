@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.chess.board import Board
+from src.chess.engine import Engine, SearchLimits, is_mate_score, mate_in_moves
+from src.chess.notation import move_to_uci, san_to_move, uci_to_move
+from src.chess.search_info import print_search_info
+
+'''
+Batch analysis of a FEN or EPD file: the positions are searched in a process pool under per-position limits
+and the results are streamed to a JSONL file, one line per position as soon as it is analysed.
+The output file is the checkpoint: an interrupted run continues with the positions that are not in it yet.
+Run with: python -m src.chess.batch_analysis src/chess/puzzles.txt --nodes 20000
+
+Input lines are FENs or EPDs (4 fields followed by operations such as bm Qg7; id "name";).
+Empty lines and lines starting with # are skipped, except "### name" headers that name the section
+of the positions below them (as in puzzles.txt).
+'''
+
+DEFAULT_NODES = 20000
+
+def parse_epd_operations(text):
+    '''"bm Qg7 Rf8; id \"x\";" -> {'bm': 'Qg7 Rf8', 'id': 'x'}'''
+    operations = {}
+    for operation in text.split(';'):
+        operation = operation.strip()
+        if not operation:
+            continue
+        opcode, _, operand = operation.partition(' ')
+        operations[opcode] = operand.strip().strip('"')
+    return operations
+
+def parse_position(line):
+    '''(fen, EPD operations) of a FEN or EPD line.'''
+    fields = line.split()
+    # a FEN ends with the halfmove clock and the fullmove number
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+        return ' '.join(fields[:6]), parse_epd_operations(' '.join(fields[6:]))
+    operations = parse_epd_operations(' '.join(fields[4:]))
+    halfmove = operations.get('hmvc', '0')
+    fullmove = operations.get('fmvn', '1')
+    return ' '.join(fields[:4] + [halfmove, fullmove]), operations
+
+def read_positions(path):
+    '''Positions of a FEN/EPD file as dicts with their index (line order), fen, section, id and expected best moves.'''
+    positions = []
+    section = None
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('###'):
+                section = line.lstrip('#').strip()
+                continue
+            if not line or line.startswith('#'):
+                continue
+            fen, operations = parse_position(line)
+            positions.append({
+                'index': len(positions),
+                'fen': fen,
+                'section': section,
+                'id': operations.get('id'),
+                'bm': operations['bm'].split() if 'bm' in operations else None,
+            })
+    return positions
+
+
+# one engine per worker process, so its tables are allocated once
+engine = None
+
+def init_worker():
+    global engine
+    engine = Engine(Board(), use_opening_book=False)
+    engine.search_info.unsubscribe(print_search_info)
+
+def parse_move(board: Board, text):
+    return uci_to_move(board, text) or san_to_move(board, text)
+
+def analyse_position(position, limits: SearchLimits):
+    '''Search one position and return its result as a JSON serializable dict.'''
+    # every position starts with empty tables so the results don't depend on the order of the positions
+    engine.new_game(position['fen'])
+
+    # the engine prints statistics after every search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        info = engine.iterative_deepening(limits)
+
+    # scores are from white's point of view, a mate is in moves (negative if black mates)
+    result = {
+        'index': position['index'],
+        'fen': position['fen'],
+        'section': position['section'],
+        'id': position['id'],
+        'best_move': move_to_uci(info.best_move) if info.best_move is not None else None,
+        'score': round(info.score) if info.score is not None and not is_mate_score(info.score) else None,
+        'mate': mate_in_moves(info.score) if is_mate_score(info.score) else None,
+        'depth': info.depth,
+        'seldepth': info.seldepth,
+        'nodes': info.nodes,
+        'time_ms': info.time_ms,
+        'pv': [move_to_uci(move) for move in info.pv],
+    }
+    if position['bm'] is not None:
+        board = Board(position['fen'])
+        expected = [parse_move(board, text) for text in position['bm']]
+        result['bm'] = position['bm']
+        result['solved'] = info.best_move is not None and info.best_move in expected
+    return result
+
+
+def read_checkpoint(path):
+    '''Indices of the positions already in the output file. A line cut off by an interruption is removed.'''
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data and not data.endswith(b'\n'):
+        data = data[:data.rfind(b'\n') + 1]
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    done = set()
+    for line in data.decode().splitlines():
+        if line.strip():
+            done.add(json.loads(line)['index'])
+    return done
+
+def analyse_file(input_path, output_path, limits: SearchLimits, workers=None, resume=True):
+    '''Analyse every position of the input file that is not in the output file yet. Returns the number of new results.'''
+    positions = read_positions(input_path)
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+    done = read_checkpoint(output_path)
+    remaining = [position for position in positions if position['index'] not in done]
+    print(f"{len(positions)} positions, {len(done)} already analysed, {len(remaining)} to analyse with {limits}")
+
+    start_time = time.time()
+    analysed = 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    try:
+        with open(output_path, 'a') as output:
+            futures = [executor.submit(analyse_position, position, limits) for position in remaining]
+            for future in as_completed(futures):
+                result = future.result()
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                analysed += 1
+                print(f"{len(done) + analysed}/{len(positions)}: position {result['index']}, best move {result['best_move']}, "
+                      f"depth {result['depth']}, {result['nodes']} nodes, {result['time_ms']} ms")
+    except KeyboardInterrupt:
+        print(f"Interrupted, run again to continue from {output_path}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    duration = time.time() - start_time
+    print(f"{analysed} positions analysed in {duration:.1f} sec")
+    return analysed
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse every position of a FEN/EPD file')
+    parser.add_argument('input', help='FEN or EPD file')
+    parser.add_argument('--output', default=None, help='JSONL results (default: <input>.analysis.jsonl)')
+    parser.add_argument('--nodes', type=int, default=None, help='node limit per position')
+    parser.add_argument('--time', type=int, default=None, help='time limit per position in ms')
+    parser.add_argument('--depth', type=int, default=None, help='depth limit per position')
+    parser.add_argument('--workers', type=int, default=None, help='parallel searches (default: number of cores)')
+    parser.add_argument('--restart', action='store_true', help='ignore the results of a previous run')
+    args = parser.parse_args()
+
+    output_path = args.output if args.output is not None else os.path.splitext(args.input)[0] + '.analysis.jsonl'
+    nodes = args.nodes
+    if nodes is None and args.time is None and args.depth is None:
+        nodes = DEFAULT_NODES
+    limits = SearchLimits(time_ms=args.time, nodes=nodes, depth=args.depth)
+    analyse_file(args.input, output_path, limits, args.workers, resume=not args.restart)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import numpy as np
+from src.chess.PSQT import PSQT, PHASE_WEIGHTS, TOTAL_PHASE
+from src.chess.board import Board, Piece
+from src.chess import engine
+
+'''
+Vectorized static evaluation of many positions at once with NumPy.
+A BoardBatch holds N positions as an (N, 64) int8 array of the board's piece codes with the side to move and
+castling rights; evaluate_terms computes every term of Engine.evaluate for all of them without a Python loop
+over the positions. The scores are from white's point of view like the engine's (the side to move is kept
+with the positions but the evaluation does not depend on it).
+
+The board array is turned into one bitboard (np.uint64) per piece, so the pawn structure and mobility terms
+are a few operations per position: attacks of the sliding pieces are occluded fills along every direction.
+The bitboards of white and black are stacked in (2, N) arrays, so both sides take the same operations.
+The PSQT term is one table lookup per square. The batch is evaluated in chunks of CHUNK_SIZE positions,
+so that the arrays of a chunk stay in the CPU cache.
+
+Threefold repetition needs the game history and is not detected, and there are no lazy cutoffs,
+so the results equal Engine.evaluate with lazy_eval_margin=None on positions without repetitions.
+The numpy package is needed for batch evaluation (the engine itself does not use it).
+'''
+
+CHUNK_SIZE = 4096 # positions evaluated at once
+
+PIECE_TYPES = (Piece.pawn, Piece.knight, Piece.bishop, Piece.rook, Piece.queen, Piece.king)
+PIECE_CODES = Piece.black | Piece.king + 1
+
+# the opening and endgame PSQT values of a square are packed in one int32 (opening + endgame * 2^16),
+# so a single lookup and sum gives both; the sums of a position stay within 16 bits
+PSQT_FIELD = 1 << 16
+
+FILE_A = np.uint64(0x0101010101010101)
+NOT_FILE_A = ~FILE_A
+NOT_FILE_H = ~(FILE_A << np.uint64(7))
+
+# (shift, mask of the squares a shift can reach without wrapping around the board), a positive shift is towards h8
+NORTH = (8, None)
+SOUTH = (-8, None)
+EAST = (1, NOT_FILE_A)
+WEST = (-1, NOT_FILE_H)
+NORTH_EAST = (9, NOT_FILE_A)
+NORTH_WEST = (7, NOT_FILE_H)
+SOUTH_EAST = (-7, NOT_FILE_A)
+SOUTH_WEST = (-9, NOT_FILE_H)
+DIAGONAL_DIRECTIONS = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+ORTHOGONAL_DIRECTIONS = (NORTH, SOUTH, EAST, WEST)
+KING_STEPS = DIAGONAL_DIRECTIONS + ORTHOGONAL_DIRECTIONS
+
+NOT_FILE_AB = NOT_FILE_A & (NOT_FILE_A << np.uint64(1))
+NOT_FILE_GH = NOT_FILE_H & (NOT_FILE_H >> np.uint64(1))
+KNIGHT_STEPS = ((17, NOT_FILE_A), (15, NOT_FILE_H), (10, NOT_FILE_AB), (6, NOT_FILE_GH),
+                (-6, NOT_FILE_AB), (-10, NOT_FILE_GH), (-15, NOT_FILE_A), (-17, NOT_FILE_H))
+
+def create_psqt_table():
+    '''Packed (opening, endgame) PSQT values (piece values included) indexed by square * PIECE_CODES + piece code.'''
+    table = np.zeros((64, PIECE_CODES), dtype=np.int32)
+    for piece in range(PIECE_CODES):
+        if piece in PSQT['Opening']:
+            table[:, piece] = np.array(PSQT['Opening'][piece]) + np.array(PSQT['Endgame'][piece]) * PSQT_FIELD
+    return table.ravel()
+
+PSQT_TABLE = create_psqt_table()
+SQUARE_OFFSETS = np.arange(64, dtype=np.intp) * PIECE_CODES
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(bitboards):
+        return np.bitwise_count(bitboards)
+else:
+    # numpy < 2.0
+    BYTE_COUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+    def popcount(bitboards):
+        bitboards = np.ascontiguousarray(bitboards)
+        return BYTE_COUNTS[bitboards.view(np.uint8)].reshape(bitboards.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def shift(bitboards, direction):
+    amount, mask = direction
+    shifted = bitboards << np.uint64(amount) if amount > 0 else bitboards >> np.uint64(-amount)
+    return shifted if mask is None else shifted & mask
+
+
+class BoardBatch:
+    '''N positions as arrays.'''
+    def __init__(self, pieces, white_to_move, castling_rights):
+        self.pieces = np.asarray(pieces, dtype=np.int8) # (N, 64) piece codes of Board.board
+        self.white_to_move = np.asarray(white_to_move, dtype=bool) # (N,)
+        self.castling_rights = np.asarray(castling_rights, dtype=np.uint8) # (N,) Board.castling_rights bits
+
+    def __len__(self):
+        return len(self.pieces)
+
+    @staticmethod
+    def from_boards(boards):
+        return BoardBatch(
+            [board.board for board in boards],
+            [board.white_to_move for board in boards],
+            [board.castling_rights for board in boards])
+
+    @staticmethod
+    def from_fens(fens):
+        return BoardBatch.from_boards([Board(fen) for fen in fens])
+
+
+def create_bitboards(pieces):
+    '''{piece type: (2, N) uint64 bitboards of white and black}, built from the 5 bit planes of the piece codes.'''
+    planes = []
+    for bit in range(5):
+        # packbits sets a bit for every nonzero element, the 64 squares of a position make one bitboard
+        plane = np.packbits((pieces & (1 << bit)).ravel(), bitorder='little')
+        planes.append(plane.view(np.uint64))
+    type_bits = planes[:3]
+    white, black = planes[3:]
+    colors = np.stack((white, black))
+
+    bitboards = {}
+    for piece_type in PIECE_TYPES:
+        bitboard = white | black
+        for bit, plane in enumerate(type_bits):
+            bitboard = bitboard & (plane if piece_type >> bit & 1 else ~plane)
+        bitboards[piece_type] = bitboard & colors
+    return bitboards
+
+def evaluate_psqt(pieces, phase):
+    packed = np.take(PSQT_TABLE, pieces + SQUARE_OFFSETS).sum(axis=1, dtype=np.int32)
+    # the opening sum is the signed low half
+    opening = ((packed + PSQT_FIELD // 2) & (PSQT_FIELD - 1)) - PSQT_FIELD // 2
+    endgame = (packed - opening) >> 16
+    return opening * phase + endgame * (1 - phase)
+
+def evaluate_phase(bitboards):
+    '''(N,) game phase, 1 in the opening and 0 in the endgame.'''
+    phase = 0
+    for piece_type, bitboard in bitboards.items():
+        if PHASE_WEIGHTS[piece_type]:
+            phase = phase + popcount(bitboard).sum(axis=0, dtype=np.int64) * PHASE_WEIGHTS[piece_type]
+    return phase / TOTAL_PHASE
+
+def count_castling_rights(castling_rights):
+    white = ((castling_rights >> 3) & 1) + ((castling_rights >> 2) & 1)
+    black = ((castling_rights >> 1) & 1) + (castling_rights & 1)
+    return white.astype(np.int64) - black.astype(np.int64)
+
+def count_pawn_structure(pawns):
+    '''(doubled, isolated, chains) pawn counts of white minus those of black, as in engine.count_pawn_structure.'''
+    # the files with pawns as the bits of one byte
+    files = pawns | (pawns >> np.uint64(32))
+    files |= files >> np.uint64(16)
+    files |= files >> np.uint64(8)
+    files &= np.uint64(0xFF)
+    doubled = popcount(pawns).astype(np.int64) - popcount(files)
+
+    # a pawn is isolated if both neighbouring files have no pawns
+    isolated_files = files & ~((files << np.uint64(1)) | (files >> np.uint64(1)))
+    isolated = popcount(pawns & (isolated_files * FILE_A)).astype(np.int64)
+
+    # a pawn diagonally behind another. The engine compares square numbers, so a chain can wrap around the edge
+    # of the board, and a black pawn 7 or 9 squares below another is the same pair as a white pawn 7 or 9 above
+    chains = (popcount(pawns & (pawns >> np.uint64(7))) + popcount(pawns & (pawns >> np.uint64(9)))).astype(np.int64)
+    return doubled[0] - doubled[1], isolated[0] - isolated[1], chains[0] - chains[1]
+
+def attack_count_masks(steps):
+    '''{count: bitboard of the squares from which a piece with these steps attacks count squares}'''
+    masks = {}
+    for square in range(64):
+        bitboard = np.uint64(1) << np.uint64(square)
+        count = sum(1 for step in steps if shift(bitboard, step))
+        masks[count] = masks.get(count, np.uint64(0)) | bitboard
+    return masks
+
+def stack_colors(white_masks, black_masks):
+    '''{count: (2, 1) masks of white and black}, to be used on the (2, N) bitboards of both sides.'''
+    return {count: np.array([[white_masks.get(count, 0)], [black_masks.get(count, 0)]], dtype=np.uint64)
+            for count in set(white_masks) | set(black_masks)}
+
+# the attacks of pawns, knights and kings only depend on their squares
+STEP_ATTACK_MASKS = {
+    Piece.pawn: stack_colors(attack_count_masks((NORTH_EAST, NORTH_WEST)), attack_count_masks((SOUTH_EAST, SOUTH_WEST))),
+    Piece.knight: stack_colors(attack_count_masks(KNIGHT_STEPS), attack_count_masks(KNIGHT_STEPS)),
+    Piece.king: stack_colors(attack_count_masks(KING_STEPS), attack_count_masks(KING_STEPS)),
+}
+
+def sliding_directions(directions):
+    '''(shift amounts, masks, slider of every direction) of sliding directions that shift the same way,
+    the amounts and masks as (len, 1, 1) arrays that broadcast over (len, 2, N) bitboards.'''
+    amounts = np.array([abs(amount) for (amount, _), _ in directions], dtype=np.uint64).reshape(-1, 1, 1)
+    masks = np.array([~np.uint64(0) if mask is None else mask for (_, mask), _ in directions], dtype=np.uint64).reshape(-1, 1, 1)
+    return amounts, masks, [slider for _, slider in directions]
+
+# the sliding directions that shift towards h8 and those that shift towards a1, with the sliders moving along them
+UP_DIRECTIONS = sliding_directions(((NORTH, Piece.rook), (EAST, Piece.rook), (NORTH_EAST, Piece.bishop), (NORTH_WEST, Piece.bishop)))
+DOWN_DIRECTIONS = sliding_directions(((SOUTH, Piece.rook), (WEST, Piece.rook), (SOUTH_WEST, Piece.bishop), (SOUTH_EAST, Piece.bishop)))
+
+def count_sliding_attacks(sliders, empty, directions, shift_function):
+    '''(2, N) squares attacked along the directions by the sliders of white and black: occluded fills of all the
+    directions at once. The rays of one direction never overlap, so the number of squares is the number of attacks.'''
+    amounts, masks, direction_sliders = directions
+    generator = np.stack([sliders[slider] for slider in direction_sliders])
+    propagator = empty & masks
+    for distance in (1, 2, 4):
+        generator |= propagator & shift_function(generator, amounts * np.uint64(distance))
+        propagator &= shift_function(propagator, amounts * np.uint64(distance))
+    attacks = shift_function(generator, amounts) & masks
+    return popcount(attacks).sum(axis=0, dtype=np.int64)
+
+def count_attacks(bitboards):
+    '''(2, N) sums of the attack maps of white and black, as sum(board.generate_attack_map(color)).'''
+    occupied = bitboards[Piece.pawn]
+    for piece_type in PIECE_TYPES[1:]:
+        occupied = occupied | bitboards[piece_type]
+    empty = ~(occupied[0] | occupied[1])
+    # the queens move along the directions of both the bishops and the rooks
+    sliders = {
+        Piece.bishop: bitboards[Piece.bishop] | bitboards[Piece.queen],
+        Piece.rook: bitboards[Piece.rook] | bitboards[Piece.queen],
+    }
+
+    attacks = count_sliding_attacks(sliders, empty, UP_DIRECTIONS, np.left_shift)
+    attacks += count_sliding_attacks(sliders, empty, DOWN_DIRECTIONS, np.right_shift)
+    for piece_type, masks in STEP_ATTACK_MASKS.items():
+        for count, mask in masks.items():
+            attacks += popcount(bitboards[piece_type] & mask) * count
+    return attacks
+
+def count_mobility(bitboards):
+    '''(N,) sum of white's attack map minus black's, as in engine.count_mobility.'''
+    attacks = count_attacks(bitboards)
+    return attacks[0] - attacks[1]
+
+def is_insufficient_material(bitboards):
+    '''(N,) kings alone, or with a single bishop or knight.'''
+    minor = popcount(bitboards[Piece.knight] | bitboards[Piece.bishop]).sum(axis=0)
+    heavy = bitboards[Piece.pawn] | bitboards[Piece.rook] | bitboards[Piece.queen]
+    return (minor <= 1) & (heavy[0] == 0) & (heavy[1] == 0)
+
+def evaluate_chunk_terms(pieces, castling_rights, bitboards):
+    phase = evaluate_phase(bitboards)
+    doubled, isolated, chains = count_pawn_structure(bitboards[Piece.pawn])
+    return {
+        'phase': phase,
+        'psqt': evaluate_psqt(pieces, phase),
+        'king_safety': count_castling_rights(castling_rights) * engine.CASTLING_RIGHT_BONUS,
+        'mobility': count_mobility(bitboards) * engine.MOBILITY_WEIGHT,
+        'pawn_structure': (-doubled * engine.DOUBLED_PAWN_PENALTY - isolated * engine.ISOLATED_PAWN_PENALTY
+                           + chains * engine.PAWN_CHAIN_BONUS),
+    }
+
+def evaluate_chunks(batch: BoardBatch):
+    '''(start, stop, terms, bitboards) of every CHUNK_SIZE positions of the batch.'''
+    for start in range(0, len(batch), CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, len(batch))
+        pieces = batch.pieces[start:stop]
+        bitboards = create_bitboards(pieces)
+        yield start, stop, evaluate_chunk_terms(pieces, batch.castling_rights[start:stop], bitboards), bitboards
+
+def evaluate_terms(batch: BoardBatch):
+    '''Every term of Engine.evaluate as (N,) arrays, from white's point of view.'''
+    terms = {}
+    for start, stop, chunk_terms, _ in evaluate_chunks(batch):
+        for name, values in chunk_terms.items():
+            terms.setdefault(name, np.empty(len(batch)))[start:stop] = values
+    return terms
+
+def evaluate(batch: BoardBatch):
+    '''(N,) static evaluation of every position.'''
+    evaluation = np.empty(len(batch))
+    for start, stop, terms, bitboards in evaluate_chunks(batch):
+        chunk = terms['psqt'] + terms['king_safety'] + terms['mobility'] + terms['pawn_structure']
+        evaluation[start:stop] = np.where(is_insufficient_material(bitboards), 0, chunk)
+    return evaluation
@@ -148,11 +148,36 @@ for square in range(64):
         if 0 <= new_rank < 8 and 0 <= new_file < 8:
             king_moves[square].append(new_rank * 8 + new_file)
 
+# zobrist keys (fixed seed so that keys are the same in every run)
+ZOBRIST_SEED = 20240101
+zobrist_random = random.Random(ZOBRIST_SEED)
+
+zobrist_piece_keys = {}
+for piece in sorted(char_to_piece_map):
+    zobrist_piece_keys[piece] = [zobrist_random.getrandbits(64) for _ in range(64)]
+zobrist_castling_keys = [zobrist_random.getrandbits(64) for _ in range(16)]
+zobrist_en_passant_keys = [zobrist_random.getrandbits(64) for _ in range(64)]
+zobrist_en_passant_keys[0] = 0 # 0 means no en passant target square
+zobrist_black_to_move_key = zobrist_random.getrandbits(64)
+
 # moves will be represented as a tuple
 # (start, end, start_piece, captured_piece, promotion_piece, castling, en_passant)
 
 STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
+def encode_move(move):
+    '''Encodes a move in 16 bits: start (6 bits), end (6 bits) and promotion piece type (3 bits). 0 means no move.'''
+    if move is None:
+        return 0
+    return move[0] | move[1] << 6 | Piece.get_type(move[4]) << 12
+
+def decode_move(moves, code):
+    '''Returns the move in moves with the given 16 bit code, or None if there is no such move'''
+    for move in moves:
+        if move[0] | move[1] << 6 | Piece.get_type(move[4]) << 12 == code:
+            return move
+    return None
+
 class Board:
     def __init__(self, fen=STARTING_FEN):
         # TODO: see if using bitboards is faster
@@ -172,6 +197,8 @@ class Board:
 
         self.generated_moves = {}               # dictionary of generated moves for each board state
 
+        self.zobrist_key = 0                    # 64 bit zobrist hash, updated incrementally
+
         self.load_fen(fen)
 
         self.state_stack = []
@@ -184,20 +211,36 @@ class Board:
         # for now, use python's built-in hash function
         return (tuple(self.board), self.castling_rights, self.en_passant_target_square, self.white_to_move)
 
+    def compute_zobrist_key(self):
+        '''Computes the zobrist key of the board from scratch'''
+        key = 0
+        for square, piece in enumerate(self.board):
+            if piece:
+                key ^= zobrist_piece_keys[piece][square]
+        key ^= zobrist_castling_keys[self.castling_rights]
+        key ^= zobrist_en_passant_keys[self.en_passant_target_square]
+        if not self.white_to_move:
+            key ^= zobrist_black_to_move_key
+        return key
+
     def __copy__(self):
+        '''An independent copy: moves made on one board don't change the other.'''
         new_board = Board()
-        new_board.board = self.board
+        new_board.board = self.board.copy()
 
         new_board.white_king_square = self.white_king_square
         new_board.black_king_square = self.black_king_square
 
-        new_board.white_pieces = self.white_pieces
-        new_board.black_pieces = self.black_pieces
+        new_board.white_pieces = self.white_pieces.copy()
+        new_board.black_pieces = self.black_pieces.copy()
 
         new_board.white_to_move = self.white_to_move
         new_board.castling_rights = self.castling_rights
         new_board.en_passant_target_square = self.en_passant_target_square
-        new_board.undo_stack = self.undo_stack
+        new_board.undo_stack = self.undo_stack.copy()
+        # the positions of the game (for threefold repetitions), the stored lists are never changed
+        new_board.state_stack = self.state_stack.copy()
+        new_board.zobrist_key = self.zobrist_key
 
         return new_board
 
@@ -215,6 +258,9 @@ class Board:
     
     def set_piece(self, square, piece):
         '''Sets the piece on the square'''
+        if self.board[square]:
+            self.zobrist_key ^= zobrist_piece_keys[self.board[square]][square]
+        self.zobrist_key ^= zobrist_piece_keys[piece][square]
         self.board[square] = piece
         piece_color = Piece.get_color(piece)
         piece_type = Piece.get_type(piece)
@@ -230,6 +276,8 @@ class Board:
 
     def clear_piece(self, square, piece):
         '''Clears the piece on the square'''
+        if self.board[square]:
+            self.zobrist_key ^= zobrist_piece_keys[self.board[square]][square]
         self.board[square] = 0
         piece_color = Piece.get_color(piece)
 
@@ -240,6 +288,10 @@ class Board:
 
     def move_piece(self, start_square, end_square, piece):
         '''Moves the piece from start_square to end_square, optimized for performance'''
+        piece_keys = zobrist_piece_keys[piece]
+        if self.board[end_square]:
+            self.zobrist_key ^= zobrist_piece_keys[self.board[end_square]][end_square]
+        self.zobrist_key ^= piece_keys[start_square] ^ piece_keys[end_square]
         self.board[end_square] = piece
         self.board[start_square] = 0
 
@@ -321,6 +373,8 @@ class Board:
         # set the halfmove clock and fullmove number
         # nahhhhhh
 
+        self.zobrist_key = self.compute_zobrist_key()
+
     def create_fen(self, ignore_en_passant=False):
         '''Returns the FEN string representing the state of the board'''
 
@@ -439,12 +493,37 @@ class Board:
             self.move_piece(start_square, end_square, start_piece)
 
         # update states
+        previous_castling_rights = self.castling_rights
+        previous_en_passant_target_square = self.en_passant_target_square
         self.update_castling_rights(start_square, end_square, start_piece, captured_piece)
         self.update_en_passant_target(start_square, end_square, start_piece)
 
         # update turn
         self.white_to_move = not self.white_to_move
 
+        self.zobrist_key ^= (
+            zobrist_castling_keys[previous_castling_rights] ^ zobrist_castling_keys[self.castling_rights] ^
+            zobrist_en_passant_keys[previous_en_passant_target_square] ^ zobrist_en_passant_keys[self.en_passant_target_square] ^
+            zobrist_black_to_move_key
+        )
+
+    def make_null_move(self):
+        '''Passes the turn to the other side without moving a piece (used for null move pruning)'''
+        self.undo_stack.append((
+            None,
+            self.castling_rights,
+            self.en_passant_target_square
+        ))
+        self.zobrist_key ^= zobrist_en_passant_keys[self.en_passant_target_square] ^ zobrist_black_to_move_key
+        self.en_passant_target_square = 0
+        self.white_to_move = not self.white_to_move
+
+    def undo_null_move(self):
+        '''Undoes the last null move made on the board'''
+        _, self.castling_rights, self.en_passant_target_square = self.undo_stack.pop()
+        self.zobrist_key ^= zobrist_en_passant_keys[self.en_passant_target_square] ^ zobrist_black_to_move_key
+        self.white_to_move = not self.white_to_move
+
     def add_to_stack(self, move):
         '''Adds info needed to undo the move to the undo stack'''
         self.undo_stack.append((
@@ -551,6 +630,11 @@ class Board:
             self.undo_promotion(start_square, end_square, start_piece, promotion_piece)
 
         # restore board state
+        self.zobrist_key ^= (
+            zobrist_castling_keys[self.castling_rights] ^ zobrist_castling_keys[castling_rights] ^
+            zobrist_en_passant_keys[self.en_passant_target_square] ^ zobrist_en_passant_keys[en_passant_target_square] ^
+            zobrist_black_to_move_key
+        )
         self.castling_rights = castling_rights
         self.en_passant_target_square = en_passant_target_square
 
@@ -1127,6 +1211,13 @@ class Board:
 
 
 
+    def has_non_pawn_material(self, color):
+        '''Returns True if the given color has a piece other than pawns and the king, False otherwise'''
+        for square in (self.white_pieces if color else self.black_pieces):
+            if Piece.get_type(self.board[square]) not in (Piece.pawn, Piece.king):
+                return True
+        return False
+
     def is_checkmate(self):
         '''Returns True if the current player is in checkmate, False otherwise'''
         if self.is_check(self.white_to_move):
@@ -1150,19 +1241,13 @@ class Board:
     
     def is_insufficient_material(self):
         '''Returns True if the game is a draw due to insufficient material, False otherwise'''
-        return False
-        if len(self.white_pieces) == 1 and len(self.black_pieces) == 1:
-            return True
-        
-        if len(self.white_pieces) == 2 and len(self.black_pieces) == 1:
-            if any(Piece.get_type(piece) in [Piece.bishop, Piece.knight] for piece in self.white_pieces):
-                return True
-            
-        if len(self.white_pieces) == 1 and len(self.black_pieces) == 2:
-            if any(Piece.get_type(piece) in [Piece.bishop, Piece.knight] for piece in self.black_pieces):
-                return True
-            
-        return False
+        # king against king, or king and a single bishop or knight against king
+        if len(self.white_pieces) + len(self.black_pieces) > 3:
+            return False
+        for square in self.white_pieces | self.black_pieces:
+            if Piece.get_type(self.board[square]) in (Piece.pawn, Piece.rook, Piece.queen):
+                return False
+        return True
 
 
     def is_draw(self):
@@ -1,15 +1,64 @@
 # from src.chess.engine.PSQT import PSQT
 import random
+import threading
 import time
+from collections import OrderedDict
 from src.chess.PSQT import PSQT, PHASE_WEIGHTS, TOTAL_PHASE
-from src.chess.board import Board, Piece
+from src.chess.analysis_cache import load_analysis_cache
+from src.chess.board import Board, Piece, STARTING_FEN, encode_move, decode_move
+from src.chess.opening_book import load_opening_book
+from src.chess.search_info import SearchInfo, SearchInfoStream, print_search_info
+from src.chess.search_stats import SearchStats
+from src.chess.tablebase import load_tablebase, MAX_TABLEBASE_PIECES, TB_WIN_SCORE
 
 CHECK_SCORE = 1200
 HISTORY_SCORE = 2500
 VICTIM_SCORE_MULTIPLIER = 3
 
+# if material + PSQT is this far outside the alpha-beta window, the positional terms
+# (mobility, pawn structure) can't bring the score back inside it, so they are skipped
+LAZY_EVAL_MARGIN = 150
 
-OPENINGS_FILE = "src\chess\condensed_openings.json"
+# null move pruning: depth reduction of the null move search
+NULL_MOVE_REDUCTION = 2
+
+# late move reductions: quiet moves ordered at or after LMR_MIN_MOVES are searched
+# LMR_REDUCTION plies shallower when at least LMR_MIN_DEPTH plies remain
+LMR_REDUCTION = 1
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+
+# aspiration windows: half width of the first window around the previous score, growth factor on
+# fail-low/high and the width after which the search falls back to a full window
+ASPIRATION_WINDOW = 100
+ASPIRATION_WIDENING = 4
+ASPIRATION_MAX_WINDOW = 3200
+
+# maximum search depth in plies (size of the triangular PV table)
+MAX_PLY = 64
+
+# quiet moves that caused a beta cutoff, per ply (searched right after the TT and PV moves)
+# one slot: a second killer ahead of the history ordered moves searched more nodes than none at all
+KILLER_SLOTS = 1
+
+# the search limits (clock, node limit, stop requests) are only checked every this many nodes
+NODE_CHECK_INTERVAL = 128
+
+# results of the analysis cache at least this deep are played without searching (unless a deeper search was asked for)
+ANALYSIS_CACHE_MIN_DEPTH = 5
+
+# transposition table
+TT_CAPACITY = 2 ** 19   # number of entries
+TT_EXACT = 0            # score is exact
+TT_LOWER = 1            # score is a lower bound (fail high)
+TT_UPPER = 2            # score is an upper bound (fail low)
+
+# evaluation weights in centipawns per count (fitted by src.chess.texel_tuner)
+DOUBLED_PAWN_PENALTY = 12
+ISOLATED_PAWN_PENALTY = 11
+PAWN_CHAIN_BONUS = 9
+CASTLING_RIGHT_BONUS = 15
+MOBILITY_WEIGHT = 2 # per attacked square
 
 def calculate_phase(board):
     phase = 0
@@ -38,8 +87,8 @@ def evaluate_psqt(board):
 
     return score
 
-def evaluate_mobility(board: Board):
-    '''Evaluate the mobility of the pieces on the board.'''
+def count_mobility(board: Board):
+    '''Number of squares attacked by white minus the number attacked by black.'''
     # generate attack map for each side
 
     white_attack_map = board.generate_attack_map(True)
@@ -48,7 +97,11 @@ def evaluate_mobility(board: Board):
     white_mobility = sum(white_attack_map)
     black_mobility = sum(black_attack_map)
 
-    return (white_mobility - black_mobility) * 2
+    return white_mobility - black_mobility
+
+def evaluate_mobility(board: Board):
+    '''Evaluate the mobility of the pieces on the board.'''
+    return count_mobility(board) * MOBILITY_WEIGHT
 
 def find_doubled_pawns(pawns_on_files):
     '''Find the number of doubled pawns given the number of pawns on each file.'''
@@ -87,8 +140,8 @@ def find_pawn_chains(pawn_squares, direction):
 
     return pawn_chains
 
-def evaluate_pawn_structure(board: Board):
-    '''Evaluate the pawn structure of the board.'''
+def count_pawn_structure(board: Board):
+    '''(doubled, isolated, chains) pawn counts of white minus those of black.'''
     # doubled pawns [done]
     # isolated pawns [done]
     # pawn chains [done]
@@ -119,36 +172,45 @@ def evaluate_pawn_structure(board: Board):
     white_pawn_chains = find_pawn_chains(white_pawn_squares, 8)
     black_pawn_chains = find_pawn_chains(black_pawn_squares, -8)
 
+    return (white_doubled_pawns - black_doubled_pawns,
+            white_iso_pawns - black_iso_pawns,
+            white_pawn_chains - black_pawn_chains)
+
+def evaluate_pawn_structure(board: Board):
+    '''Evaluate the pawn structure of the board.'''
+    doubled_pawns, isolated_pawns, pawn_chains = count_pawn_structure(board)
+
     # more doubled pawns is bad
-    doubled_pawn_eval = (black_doubled_pawns - white_doubled_pawns) * 13
-    doubled_pawn_eval = (black_doubled_pawns - white_doubled_pawns) * 12
+    doubled_pawn_eval = -doubled_pawns * DOUBLED_PAWN_PENALTY
 
     # more isolated pawns is bad
-    isolated_pawn_eval = (black_iso_pawns - white_iso_pawns) * 11
+    isolated_pawn_eval = -isolated_pawns * ISOLATED_PAWN_PENALTY
 
     # more pawn chains is good
-    pawn_chain_eval = (white_pawn_chains - black_pawn_chains) * 9
+    pawn_chain_eval = pawn_chains * PAWN_CHAIN_BONUS
 
     return doubled_pawn_eval + isolated_pawn_eval + pawn_chain_eval
 
+def count_castling_rights(board: Board):
+    '''Castling rights of white minus those of black.'''
+    white_castling_rights = board.castling_rights & 0b1100
+    black_castling_rights = board.castling_rights & 0b0011
+    return bin(white_castling_rights).count("1") - bin(black_castling_rights).count("1")
+
 def evaluate_king_safety(board: Board):
     '''Evaluate the safety of the kings on the board.'''
     # castling rights [done]
     # pawn shield # TODO
     # open files # TODO
-    
-    white_castling_rights = board.castling_rights & 0b1100
-    black_castling_rights = board.castling_rights & 0b0011
 
     # count castling rights
-    white_castling_eval = bin(white_castling_rights).count("1") * 15
-    black_castling_eval = bin(black_castling_rights).count("1") * 15
+    castling_eval = count_castling_rights(board) * CASTLING_RIGHT_BONUS
 
     # pawn shield
 
     # open files
 
-    return white_castling_eval - black_castling_eval
+    return castling_eval
 
 
 
@@ -156,45 +218,231 @@ def evaluate_king_safety(board: Board):
 NEGATIVE_INFINITY = -9999999
 POSITIVE_INFINITY = 9999999
 
+# a mate found ply plies from the root scores POSITIVE_INFINITY - ply (NEGATIVE_INFINITY + ply if black mates),
+# so shorter mates score higher. Scores within MAX_MATE_PLIES of infinity are mates.
+MAX_MATE_PLIES = 1000
+MATE_THRESHOLD = POSITIVE_INFINITY - MAX_MATE_PLIES
+
+def is_mate_score(score):
+    return score is not None and abs(score) >= MATE_THRESHOLD
+
+def mate_in_moves(score):
+    '''Moves to mate of a mate score, negative if black mates.'''
+    moves = int(POSITIVE_INFINITY - abs(score) + 1) // 2 # shared transposition table scores are floats
+    return moves if score > 0 else -moves
+
+def tablebase_mate_score(score, ply):
+    '''The tablebase score (TB_WIN_SCORE - plies to mate) of a position ply plies from the root as a mate score.'''
+    if score == 0:
+        return 0
+    plies = ply + TB_WIN_SCORE - abs(score)
+    return POSITIVE_INFINITY - plies if score > 0 else NEGATIVE_INFINITY + plies
+
+def score_to_tt(score, ply):
+    '''Mate scores are stored in the transposition table as the distance from the node instead of from the root.'''
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+class SearchLimits:
+    '''Limits of a single search. A limit of None means unlimited.
+    A ponder search ignores the time limit until Engine.ponderhit() is called.'''
+    def __init__(self, time_ms: int = None, nodes: int = None, depth: int = None, ponder: bool = False):
+        self.time_ms = time_ms
+        self.nodes = nodes
+        self.depth = depth
+        self.ponder = ponder
+
+    def __repr__(self):
+        return f"SearchLimits(time_ms={self.time_ms}, nodes={self.nodes}, depth={self.depth}, ponder={self.ponder})"
+
+class TranspositionTable:
+    '''Zobrist key -> (depth, score, flag, encoded best move), the oldest entries are replaced first.'''
+    def __init__(self, capacity = TT_CAPACITY):
+        self.table = OrderedDict()
+        self.capacity = capacity
+
+    def get(self, key):
+        return self.table.get(key)
+
+    def put(self, key, value):
+        if key in self.table:
+            self.table.move_to_end(key)
+        elif len(self.table) >= self.capacity:
+            self.table.popitem(last=False)
+        self.table[key] = value
+
+    def clear(self):
+        self.table.clear()
+
+    def __len__(self):
+        return len(self.table)
+
+    def hashfull(self):
+        '''Permille of the table in use.'''
+        return len(self.table) * 1000 // self.capacity
+
 class Engine:
-    def __init__(self, board: Board, depth: int = 1, time_limit_ms: int = 25000):
+    def __init__(self, board: Board, depth: int = 1, time_limit_ms: int = 25000, lazy_eval_margin: int = LAZY_EVAL_MARGIN,
+                 null_move_pruning: bool = True, null_move_reduction: int = NULL_MOVE_REDUCTION,
+                 late_move_reduction: bool = True, lmr_reduction: int = LMR_REDUCTION,
+                 lmr_min_depth: int = LMR_MIN_DEPTH, lmr_min_moves: int = LMR_MIN_MOVES,
+                 use_opening_book: bool = True, use_tablebase: bool = True, multi_pv: int = 1,
+                 use_analysis_cache: bool = False):
         self.board = board.__copy__()
         self.depth = depth
         self.time_limit_ms = time_limit_ms
+        self.lazy_eval_margin = lazy_eval_margin # None disables lazy evaluation
 
-        self.history_table = {}
-        self.cached_generations = {}
-        self.transposition_table = {}
-        self.start_time = 0
+        self.null_move_pruning = null_move_pruning
+        self.null_move_reduction = null_move_reduction
 
-    #     self.load_openings()
+        self.late_move_reduction = late_move_reduction
+        self.lmr_reduction = lmr_reduction
+        self.lmr_min_depth = lmr_min_depth
+        self.lmr_min_moves = lmr_min_moves
 
-    # def load_openings(self):
-    #     with open(OPENINGS_FILE, "r") as file:
-    #         self.openings = json.load(file)
+        self.depth_reached = 0
+        self.seldepth = 0
+        self.reset_pv()
 
-    def update_board(self, board: Board):
-        '''Used to sync the engine's board with the actual board.'''
-        self.board.board = board.board.copy()
+        self.multi_pv = multi_pv # number of best root moves to search (each with its score and pv)
+        self.excluded_root_moves = [] # moves of the lines already found at this depth
+
+        # search progress, logged by default
+        self.search_info = SearchInfoStream()
+        self.search_info.subscribe(print_search_info)
+
+        self.limits = SearchLimits(time_ms=time_limit_ms)
+        self.nodes = 0
+        self.next_limit_check = NODE_CHECK_INTERVAL
+        self.stopped = False
+        self.stop_event = threading.Event() # set by stop() from another thread
+        self.shared_stop_event = None # optional event shared by several searches (never cleared by the engine)
+
+        self.stats = SearchStats() # statistics of the last search
+
+        self.history_table = {}
+        self.killer_moves = [[None] * KILLER_SLOTS for _ in range(MAX_PLY)]
+        self.cached_generations = {}
+        self.transposition_table = TranspositionTable()
+        self.start_time = 0 # start of the time limit (ponderhit restarts it)
+        self.search_start_time = 0 # start of the search, for the reported time and nps
 
-        self.board.white_king_square = board.white_king_square
-        self.board.black_king_square = board.black_king_square
+        self.pondering = False
+        self.ponder_move = None # expected reply to the best move of the last search
 
-        self.board.white_pieces = board.white_pieces.copy()
-        self.board.black_pieces = board.black_pieces.copy()
+        # the game of the engine's position (set_position), so the next position is synced with the moves played since
+        self.position_fen = self.board.create_fen()
+        self.position_moves = []
 
+        # None if disabled or not compiled (python -m src.chess.opening_book)
+        self.opening_book = load_opening_book() if use_opening_book else None
+        # None if disabled or not built (python -m src.chess.tablebase)
+        self.tablebase = load_tablebase() if use_tablebase else None
+        # None if disabled, results of earlier sessions (src.chess.analysis_cache)
+        self.analysis_cache = load_analysis_cache() if use_analysis_cache else None
 
-        self.board.white_to_move = board.white_to_move
-        self.board.castling_rights =  board.castling_rights
-        self.board.en_passant_target_square = board.en_passant_target_square
-        self.board.undo_stack = board.undo_stack.copy()
+    def update_board(self, board: Board):
+        '''Used to sync the engine's board with the actual board (a copy of the whole board, see set_position).'''
+        self.board = board.__copy__()
+        self.position_fen = self.board.create_fen()
+        self.position_moves = []
 
+    def new_game(self, fen=STARTING_FEN):
+        '''Start a new game: the transposition table, history and killer moves of the last game are cleared.'''
+        self.transposition_table.clear()
+        self.history_table = {}
+        self.killer_moves = [[None] * KILLER_SLOTS for _ in range(MAX_PLY)]
+        self.reset_pv()
+        self.ponder_move = None
+        self.board = Board(fen)
+        self.position_fen = fen
+        self.position_moves = []
+
+    def set_position(self, fen, moves=()):
+        '''Set the position of a game: the fen and the moves played from it.
+        If it is the engine's game with moves played (or taken back) since, only those moves are made (or undone),
+        so the board is not rebuilt. The search tables are kept either way (new_game clears them).'''
+        moves = list(moves)
+        if fen != self.position_fen:
+            self.board = Board(fen)
+            self.position_fen = fen
+            self.position_moves = []
+
+        common = 0
+        while common < min(len(moves), len(self.position_moves)) and moves[common] == self.position_moves[common]:
+            common += 1
+        while len(self.position_moves) > common:
+            self.undo_move()
+        for move in moves[common:]:
+            self.play_move(move)
+
+    def play_move(self, move):
+        '''Make a move of the game on the engine's board. The killer moves move up a ply,
+        so they stay at the same distance from the root of the next search.'''
+        self.board.make_move(move)
+        self.position_moves.append(move)
+        self.killer_moves = self.killer_moves[1:] + [[None] * KILLER_SLOTS]
+
+    def undo_move(self):
+        '''Take back the last move of the game.'''
+        self.board.undo_move()
+        self.position_moves.pop()
+        self.killer_moves = [[None] * KILLER_SLOTS] + self.killer_moves[:-1]
+
+    def is_repetition(self, move):
+        '''True if the position or the position after move occurred before in the game.'''
+        if self.board.board in self.board.state_stack:
+            return True
+        self.board.make_move(move)
+        repeated = self.board.board in self.board.state_stack
+        self.board.undo_move()
+        return repeated
 
     def set_time_limit(self, time_limit_ms: int):
         self.time_limit_ms = time_limit_ms
 
     def time_exceeded(self):
-        return (time.time() - self.start_time) * 1000 >= self.time_limit_ms
+        if self.pondering or self.limits.time_ms is None:
+            return False
+        return (time.time() - self.start_time) * 1000 >= self.limits.time_ms
+
+    def stop(self):
+        '''Ask a running search to stop. The search keeps the best move found so far.'''
+        self.stop_event.set()
+
+    def prepare_search(self):
+        '''Clear the last stop request before a search. Called on the caller's thread before the search thread
+        starts: a stop() sent before the search thread runs is not lost (the search never clears it).'''
+        self.stop_event.clear()
+
+    def ponderhit(self, time_limit_ms: int = None):
+        '''The opponent played the expected move: the ponder search continues as a normal search
+        and its time limit starts now.'''
+        if time_limit_ms is not None:
+            self.limits.time_ms = time_limit_ms
+        self.start_time = time.time()
+        self.pondering = False
+
+    def check_limits(self):
+        '''Set the stopped flag if a stop was requested or the time or node limit is reached.'''
+        self.next_limit_check = self.nodes + NODE_CHECK_INTERVAL
+        if self.stop_event.is_set() or self.time_exceeded():
+            self.stopped = True
+        elif self.shared_stop_event is not None and self.shared_stop_event.is_set():
+            self.stopped = True
+        elif self.limits.nodes is not None and self.nodes >= self.limits.nodes:
+            self.stopped = True
     
     def calculate_mvv_lva(self, move):
         '''Most valuable victim, least valuable attacker.'''
@@ -237,16 +485,23 @@ class Engine:
 
 
     def get_ordered_moves(self):
-        self.move_generations += 1
+        self.stats.move_generations += 1
+        start = time.perf_counter()
         moves = self.board.generate_legal_moves()
-
+        generated = time.perf_counter()
         ordered_moves = self.order_moves(moves)
+        self.stats.movegen_time += generated - start
+        self.stats.ordering_time += time.perf_counter() - generated
         return ordered_moves
 
-    def evaluate(self):
+    def evaluate(self, alpha=NEGATIVE_INFINITY, beta=POSITIVE_INFINITY):
         '''Evaluate the current board position. 
-        Return a score where positive is good for white and negative is good for black.'''
-        self.positions_evaluated += 1
+        Return a score where positive is good for white and negative is good for black.
+
+        The evaluation is staged: the cheap material + PSQT (and castling rights) terms are computed first,
+        and if that score is more than lazy_eval_margin outside of (alpha, beta) the expensive
+        mobility and pawn structure terms are skipped.'''
+        self.stats.positions_evaluated += 1
         # threefold repetition
         if self.board.is_threefold_repetition():
             return 0
@@ -259,20 +514,47 @@ class Engine:
         # material
         evaluation += evaluate_psqt(self.board.board)
 
+        # king safety
+        evaluation += evaluate_king_safety(self.board)
+
+        # lazy cutoff
+        if self.lazy_eval_margin is not None:
+            if evaluation - self.lazy_eval_margin >= beta or evaluation + self.lazy_eval_margin <= alpha:
+                self.stats.lazy_eval_cutoffs += 1
+                return evaluation
+
         # mobility
         evaluation += evaluate_mobility(self.board)
 
         # pawn structure
         evaluation += evaluate_pawn_structure(self.board)
 
-        # king safety
-        evaluation += evaluate_king_safety(self.board)
-
         # TODO: add more evaluation terms
         # Open file rooks and queens
 
         return evaluation
     
+    def lazy_eval_cutoff_rate(self):
+        '''Fraction of evaluations that returned early through the lazy eval margin.'''
+        return self.stats.lazy_eval_cutoff_rate
+
+    def store_killer_move(self, move, ply):
+        '''Remember a quiet move that caused a beta cutoff (captures and promotions are ordered first anyway).'''
+        if move[3] or move[4] or move[6]:
+            return
+        killers = self.killer_moves[ply]
+        if killers[0] != move:
+            killers.pop()
+            killers.insert(0, move)
+
+    def order_killer_moves(self, moves, ply):
+        '''Move the killer moves of the ply to the front.'''
+        for killer in reversed(self.killer_moves[ply]):
+            if killer is not None and killer in moves:
+                moves.remove(killer)
+                moves.insert(0, killer)
+        return moves
+
     def update_history_score(self, move, depth):
         if move not in self.history_table:
             self.history_table[move] = 0
@@ -285,12 +567,13 @@ class Engine:
             return self.quiescence_min(alpha, beta)
 
     def quiescence_max(self, alpha, beta):
+        self.stats.qnodes += 1
         moves = self.board.generate_legal_moves(capture_only=True)
         if len(moves) == 0: # no legal moves
             if self.board.is_check(True):
                 return NEGATIVE_INFINITY # if white is in check, black wins
             return 0 # stalemate
-        stand_pat = self.evaluate()
+        stand_pat = self.evaluate(alpha, beta)
         if stand_pat >= beta:
             return beta
         if stand_pat > alpha:
@@ -309,12 +592,13 @@ class Engine:
         return alpha
 
     def quiescence_min(self, alpha, beta):
+        self.stats.qnodes += 1
         moves = self.board.generate_legal_moves(capture_only=True)
         if len(moves) == 0: # no legal moves
             if self.board.is_check(False):
                 return POSITIVE_INFINITY # if black is in check, white wins
             return 0 # stalemate
-        stand_pat = self.evaluate()
+        stand_pat = self.evaluate(alpha, beta)
         if stand_pat <= alpha:
             return alpha
         if stand_pat < beta:
@@ -332,120 +616,467 @@ class Engine:
 
         return beta
 
-    def minimax(self, depth, alpha, beta):
-        if self.time_exceeded():
-            raise Exception("Time exceeded")
+    def can_null_move(self, depth, in_check):
+        '''Null move pruning is unsafe in check and in pawn-only endgames (zugzwang).'''
+        if not self.null_move_pruning or in_check:
+            return False
+        if depth <= self.null_move_reduction:
+            return False
+        return self.board.has_non_pawn_material(self.board.white_to_move)
+
+    def can_reduce(self, move, depth, move_index, in_check):
+        '''Late move reductions only apply to quiet moves that are ordered late and don't give check.
+        Must be called after the move has been made.'''
+        if not self.late_move_reduction or in_check:
+            return False
+        if depth < self.lmr_min_depth or move_index < self.lmr_min_moves:
+            return False
+        # captures and promotions
+        if move[3] or move[4]:
+            return False
+        # checking moves
+        return not self.board.is_check(self.board.white_to_move)
+
+    def reset_pv(self):
+        '''Clear the triangular PV table and the PV of the previous iteration.'''
+        self.pv_table = [[None] * MAX_PLY for _ in range(MAX_PLY)]
+        self.pv_length = [0] * MAX_PLY
+        self.previous_pv = []
+        self.follow_pv = False
+
+    def update_pv(self, ply, move):
+        '''Store move as the best move at ply, followed by the best line found below it.'''
+        self.pv_table[ply][ply] = move
+        child_length = max(self.pv_length[ply + 1], ply + 1)
+        for next_ply in range(ply + 1, child_length):
+            self.pv_table[ply][next_ply] = self.pv_table[ply + 1][next_ply]
+        self.pv_length[ply] = child_length
+
+    def get_principal_variation(self):
+        '''Return the principal variation of the last completed search.'''
+        return self.pv_table[0][:self.pv_length[0]]
+
+    def complete_pv(self, pv, depth):
+        '''A transposition table cutoff returns a score without the line below it, so the pv can stop early.
+        It is continued with the best moves stored in the table, up to depth moves (or the mate).'''
+        pv = list(pv)
+        for move in pv:
+            self.board.make_move(move)
+        while len(pv) < depth:
+            entry = self.transposition_table.get(self.board.zobrist_key)
+            move = decode_move(self.board.generate_legal_moves(), entry[3]) if entry is not None and entry[3] else None
+            if move is None:
+                break
+            self.board.make_move(move)
+            pv.append(move)
+        for _ in pv:
+            self.board.undo_move()
+        return pv
+
+    def order_pv_move(self, moves, ply):
+        '''Move the previous iteration's PV move to the front while still on the PV.'''
+        if not self.follow_pv:
+            return moves
+        if ply < len(self.previous_pv) and self.previous_pv[ply] in moves:
+            pv_move = self.previous_pv[ply]
+            moves.remove(pv_move)
+            moves.insert(0, pv_move)
+        else:
+            self.follow_pv = False
+        return moves
+
+    def minimax(self, depth, alpha, beta, ply, allow_null_move=True):
+        self.pv_length[ply] = ply
+        if ply > self.seldepth:
+            self.seldepth = ply
+
+        self.nodes += 1
+        if self.nodes >= self.next_limit_check:
+            self.check_limits()
+        if self.stopped:
+            return 0
 
         if self.board.is_threefold_repetition():
             return 0
 
+        # transposition table (no cutoffs on the principal variation so that it stays intact)
+        key = self.board.zobrist_key
+        tt_move = None
+        entry = self.transposition_table.get(key)
+        self.stats.tt_probes += 1
+        if entry is not None:
+            self.stats.tt_hits += 1
+            entry_depth, entry_score, entry_flag, tt_move = entry
+            entry_score = score_from_tt(entry_score, ply)
+            if entry_depth >= depth and not self.follow_pv:
+                if (entry_flag == TT_EXACT or
+                    (entry_flag == TT_LOWER and entry_score >= beta) or
+                    (entry_flag == TT_UPPER and entry_score <= alpha)):
+                    self.stats.tt_cutoffs += 1
+                    return entry_score
+
         moves = self.get_ordered_moves()
         if len(moves) == 0: # no legal moves
             if self.board.is_check(self.board.white_to_move):
-                return NEGATIVE_INFINITY if self.board.white_to_move else POSITIVE_INFINITY
+                return NEGATIVE_INFINITY + ply if self.board.white_to_move else POSITIVE_INFINITY - ply
             return 0 # stalemate
 
-        if depth == 0:
+        if depth == 0 or ply >= MAX_PLY - 1:
+            # exact score of small endgames
+            if self.tablebase is not None and len(self.board.white_pieces) + len(self.board.black_pieces) <= MAX_TABLEBASE_PIECES:
+                score = self.tablebase.probe(self.board)
+                if score is not None:
+                    return tablebase_mate_score(score, ply)
             # return self.quiescence_search(alpha, beta) # broken
-            return self.evaluate()
+            start = time.perf_counter()
+            evaluation = self.evaluate(alpha, beta)
+            self.stats.eval_time += time.perf_counter() - start
+            return evaluation
+
+        moves = self.order_killer_moves(moves, ply)
+        # the best move stored in the transposition table first, unless the PV move comes first
+        tt_move = decode_move(moves, tt_move) if tt_move else None
+        if tt_move is not None:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+        moves = self.order_pv_move(moves, ply)
+        original_alpha, original_beta = alpha, beta
+        best_move = None
+        # no null moves on the principal variation
+        allow_null_move = allow_null_move and not self.follow_pv
+
+        in_check = (self.null_move_pruning or self.late_move_reduction) and self.board.is_check(self.board.white_to_move)
 
         if self.board.white_to_move:
+            # null move pruning: if passing still fails high, the position is too good to be reached
+            if allow_null_move and beta < POSITIVE_INFINITY and self.can_null_move(depth, in_check):
+                self.board.make_null_move()
+                eval = self.minimax(depth - 1 - self.null_move_reduction, beta - 1, beta, ply + 1, False)
+                self.board.undo_null_move()
+                if self.stopped:
+                    return 0
+                if eval >= beta:
+                    return beta
+
             max_eval = NEGATIVE_INFINITY
-            for move in moves:
+            for move_index, move in enumerate(moves):
                 self.board.make_move(move)
-                eval = self.minimax(depth - 1, alpha, beta)
+                if self.can_reduce(move, depth, move_index, in_check):
+                    # reduced null window search, re-search at full depth on fail high
+                    eval = self.minimax(max(depth - 1 - self.lmr_reduction, 0), alpha, alpha + 1, ply + 1)
+                    if eval > alpha:
+                        eval = self.minimax(depth - 1, alpha, beta, ply + 1)
+                else:
+                    eval = self.minimax(depth - 1, alpha, beta, ply + 1)
                 self.board.undo_move()
-                max_eval = max(max_eval, eval)
-                alpha = max(alpha, eval)
+                if self.stopped:
+                    return 0
+                self.follow_pv = False
+                if eval > max_eval:
+                    max_eval = eval
+                    best_move = move
+                    self.update_pv(ply, move)
+                if eval > alpha:
+                    alpha = eval
                 if beta <= alpha:
                     self.update_history_score(move, depth)
+                    self.store_killer_move(move, ply)
+                    self.stats.beta_cutoffs += 1
+                    if move_index == 0:
+                        self.stats.first_move_cutoffs += 1
                     break
+
+            if max_eval >= original_beta:
+                flag = TT_LOWER
+            elif max_eval <= original_alpha:
+                flag = TT_UPPER
+            else:
+                flag = TT_EXACT
+            self.transposition_table.put(key, (depth, score_to_tt(max_eval, ply), flag, encode_move(best_move)))
             return max_eval
         else:
+            # null move pruning: if passing still fails low, the position is too good to be reached
+            if allow_null_move and alpha > NEGATIVE_INFINITY and self.can_null_move(depth, in_check):
+                self.board.make_null_move()
+                eval = self.minimax(depth - 1 - self.null_move_reduction, alpha, alpha + 1, ply + 1, False)
+                self.board.undo_null_move()
+                if self.stopped:
+                    return 0
+                if eval <= alpha:
+                    return alpha
+
             min_eval = POSITIVE_INFINITY
-            for move in moves:
+            for move_index, move in enumerate(moves):
                 self.board.make_move(move)
-                eval = self.minimax(depth - 1, alpha, beta)
+                if self.can_reduce(move, depth, move_index, in_check):
+                    # reduced null window search, re-search at full depth on fail low
+                    eval = self.minimax(max(depth - 1 - self.lmr_reduction, 0), beta - 1, beta, ply + 1)
+                    if eval < beta:
+                        eval = self.minimax(depth - 1, alpha, beta, ply + 1)
+                else:
+                    eval = self.minimax(depth - 1, alpha, beta, ply + 1)
                 self.board.undo_move()
-                min_eval = min(min_eval, eval)
-                beta = min(beta, eval)
+                if self.stopped:
+                    return 0
+                self.follow_pv = False
+                if eval < min_eval:
+                    min_eval = eval
+                    best_move = move
+                    self.update_pv(ply, move)
+                if eval < beta:
+                    beta = eval
                 if beta <= alpha:
                     self.update_history_score(move, depth)
+                    self.store_killer_move(move, ply)
+                    self.stats.beta_cutoffs += 1
+                    if move_index == 0:
+                        self.stats.first_move_cutoffs += 1
                     break
+
+            if min_eval <= original_alpha:
+                flag = TT_UPPER
+            elif min_eval >= original_beta:
+                flag = TT_LOWER
+            else:
+                flag = TT_EXACT
+            self.transposition_table.put(key, (depth, score_to_tt(min_eval, ply), flag, encode_move(best_move)))
             return min_eval
 
-    def find_best_move(self, depth):
+    def find_best_move(self, depth, alpha=NEGATIVE_INFINITY, beta=POSITIVE_INFINITY):
+        '''Search the root to the given depth inside the (alpha, beta) window.
+        A result <= alpha or >= beta is only a bound and the root must be searched again with a wider window.'''
         best_eval = NEGATIVE_INFINITY if self.board.white_to_move else POSITIVE_INFINITY
         moves = self.get_ordered_moves()
+        if self.excluded_root_moves:
+            moves = [move for move in moves if move not in self.excluded_root_moves]
+
+        self.pv_length[0] = 0
+        self.follow_pv = len(self.previous_pv) > 0
+        moves = self.order_pv_move(moves, 0)
 
-        best_move = random.choice(moves)
-        alpha = NEGATIVE_INFINITY
-        beta = POSITIVE_INFINITY
+        best_move = moves[0] if self.follow_pv else random.choice(moves)
+        self.root_moves_searched = 0
 
         for move in moves:
             self.board.make_move(move)
-            eval = self.minimax(depth - 1, alpha, beta)
+            eval = self.minimax(depth - 1, alpha, beta, 1)
             self.board.undo_move()
+            # the move that was being searched when the search stopped has no reliable score
+            if self.stopped:
+                break
+            self.root_moves_searched += 1
+            self.follow_pv = False
 
             if self.board.white_to_move:
                 if eval > best_eval:
                     best_eval = eval
                     best_move = move
-                alpha = max(alpha, eval)
+                    self.update_pv(0, move)
+                if eval > alpha:
+                    alpha = eval
             else:
                 if eval < best_eval:
                     best_eval = eval
                     best_move = move
-                beta = min(beta, eval)
+                    self.update_pv(0, move)
+                if eval < beta:
+                    beta = eval
 
-        return best_move, best_eval
+            # fail high / fail low, the aspiration window has to be widened
+            if beta <= alpha:
+                break
 
-    def iterative_deepening(self, result_container: list):
-        """Perform an iterative deepening search."""
-        # TODO: thinking during opponent's turn (necessary)
-        # TODO: transposition table (necessary)
-        # TODO: killer moves (necessary)
-        # TODO: parallel search (necessary)
+        return best_move, best_eval
 
-        # TODO: null move pruning (maybe)
-        # TODO: aspiration windows (maybe)
-        # TODO: late move reduction (maybe)
+    def aspiration_search(self, depth, previous_eval):
+        '''Search around the previous iteration's score, widening the window on fail-low/high.
+        If the search is stopped, the best move of the partly searched iteration is returned when it is
+        an exact score, otherwise (None, None).'''
+        delta = ASPIRATION_WINDOW
+        if previous_eval is None or depth <= 1 or is_mate_score(previous_eval):
+            alpha, beta = NEGATIVE_INFINITY, POSITIVE_INFINITY
+        else:
+            alpha, beta = previous_eval - delta, previous_eval + delta
+
+        while True:
+            best_move, best_eval = self.find_best_move(depth, alpha, beta)
+
+            if self.stopped:
+                if self.root_moves_searched and alpha < best_eval < beta:
+                    return best_move, best_eval
+                return None, None
+
+            if best_eval <= alpha and alpha > NEGATIVE_INFINITY: # fail low
+                delta *= ASPIRATION_WIDENING
+                alpha = previous_eval - delta if delta < ASPIRATION_MAX_WINDOW else NEGATIVE_INFINITY
+            elif best_eval >= beta and beta < POSITIVE_INFINITY: # fail high
+                delta *= ASPIRATION_WIDENING
+                beta = previous_eval + delta if delta < ASPIRATION_MAX_WINDOW else POSITIVE_INFINITY
+            else:
+                return best_move, best_eval
+
+    def create_search_info(self, depth, score, pv, final=False, multipv=1, lines=None):
+        duration = time.time() - self.search_start_time
+        if final:
+            self.stats.finish(self.nodes)
+        return SearchInfo(
+            depth=depth,
+            seldepth=self.seldepth,
+            score=score,
+            pv=pv,
+            nodes=self.nodes,
+            nps=int(self.nodes / max(duration, 1e-9)),
+            hashfull=self.transposition_table.hashfull(),
+            time_ms=int(duration * 1000),
+            final=final,
+            multipv=multipv,
+            lines=lines)
+
+    def iterative_deepening(self, limits: SearchLimits = None, start_depth: int = 1):
+        """Perform an iterative deepening search and return the final SearchInfo.
+        Progress is published on self.search_info after every depth, the last info has final=True.
+        Limits default to the engine's time limit. Stopping (limits reached or stop()) keeps the best move found so far.
+        A search after stop() needs prepare_search() first.
+        Lazy SMP helpers start at different depths so that they don't all search the same tree."""
         # TODO: futility pruning (maybe)
         
-        self.start_time = time.time()
-        self.positions_evaluated = 0
-        self.move_generations = 0
-        self.cache_retreivals = 0
+        self.start_time = self.search_start_time = time.time()
+        self.limits = limits if limits is not None else SearchLimits(time_ms=self.time_limit_ms)
+        self.pondering = self.limits.ponder
+        self.ponder_move = None
+        self.nodes = 0
+        self.next_limit_check = NODE_CHECK_INTERVAL
+        self.stopped = False
+
+        self.stats = SearchStats()
+        self.depth_reached = 0
+        self.seldepth = 0
+        self.reset_pv()
 
         moves = self.get_ordered_moves()
-        if len(moves) == 0:
-            return
-        if len(moves) == 1:
-            result_container.append((moves[0], None, True))
-            return
+        if len(moves) <= 1:
+            # nothing to search (the pv is empty if there are no legal moves)
+            info = self.create_search_info(0, None, moves, final=True)
+            self.pondering = False
+            self.search_info.publish(info)
+            return info
+
+        # book moves are played without searching
+        book_move = self.opening_book.choose_move(self.board) if self.opening_book is not None else None
+        if book_move is not None:
+            info = self.create_search_info(0, None, [book_move], final=True)
+            self.pondering = False
+            self.search_info.publish(info)
+            return info
+
+        # so are tablebase moves
+        tablebase_result = self.tablebase.best_move(self.board) if self.tablebase is not None else None
+        if tablebase_result is not None:
+            tablebase_move, tablebase_score = tablebase_result
+            # the score of the position after the move
+            tablebase_score = tablebase_mate_score(tablebase_score, 1)
+            info = self.create_search_info(0, tablebase_score, [tablebase_move], final=True)
+            self.pondering = False
+            self.search_info.publish(info)
+            return info
+
         best_move = moves[0]
         best_eval = None
-
-        depth = 1
-        while not self.time_exceeded():
-            try:
-                best_move, best_eval = self.find_best_move(depth)
-            except Exception as e:
-                print(e)
+        search_depth = 0
+        lines = [] # (eval, pv) of every line of the last searched depth, best first
+        line_count = min(self.multi_pv, len(moves))
+
+        # positions analysed deep enough before are played without searching,
+        # otherwise the search starts with the cached line
+        cached = self.analysis_cache.lookup(self.board) if self.analysis_cache is not None and line_count == 1 else None
+        if cached is not None:
+            cached_depth, cached_eval, cached_bound, cached_pv = cached
+            required_depth = self.limits.depth if self.limits.depth is not None else ANALYSIS_CACHE_MIN_DEPTH
+            # a ponder search keeps searching until ponderhit. The cache doesn't know the game's history,
+            # so a repetition of the game is searched to see the draw
+            if (cached_bound == TT_EXACT and cached_depth >= required_depth and not self.pondering
+                    and not self.is_repetition(cached_pv[0])):
+                self.depth_reached = cached_depth
+                self.ponder_move = cached_pv[1] if len(cached_pv) > 1 else None
+                info = self.create_search_info(cached_depth, cached_eval, cached_pv, final=True, lines=[(cached_eval, cached_pv)])
+                self.pondering = False
+                self.search_info.publish(info)
+                return info
+            lines = [(cached_eval, cached_pv)]
+            best_move = cached_pv[0]
+
+        max_depth = MAX_PLY - 1 if self.limits.depth is None else min(self.limits.depth, MAX_PLY - 1)
+        depth = start_depth
+        while depth <= max_depth:
+            depth_lines = self.search_lines(depth, lines, line_count)
+
+            if self.stopped:
+                # keep the lines of the partly finished iteration if the best line was found
+                if depth_lines:
+                    lines = depth_lines
+                    best_eval, self.previous_pv = lines[0]
+                    best_move = self.previous_pv[0]
+                    search_depth = depth
+                    self.stats.record_depth(depth, self.nodes, best_eval)
+                    self.publish_lines(depth, lines)
                 break
-            print(f"Depth: {depth}, Best move: {best_move}, Best eval: {best_eval}")
-            result_container.append((best_move, best_eval, False))
+
+            lines = depth_lines
+            best_eval, self.previous_pv = lines[0]
+            best_move = self.previous_pv[0]
+            self.depth_reached = search_depth = depth
+            completed_eval, completed_pv = best_eval, self.previous_pv
+            self.stats.record_depth(depth, self.nodes, best_eval)
+            self.publish_lines(depth, lines)
             depth += 1
-            if best_eval == POSITIVE_INFINITY or best_eval == NEGATIVE_INFINITY:
+            if is_mate_score(best_eval):
                 break
 
-            time_elapsed = (time.time() - self.start_time) * 1000
-            if time_elapsed * 2 >= self.time_limit_ms:
-                break
+            # the next iteration would most likely not finish in time
+            if self.limits.time_ms is not None and not self.pondering:
+                time_elapsed = (time.time() - self.start_time) * 1000
+                if time_elapsed * 2 >= self.limits.time_ms:
+                    break
 
-        print(f"Time taken: {(time.time() - self.start_time) * 1000:.2f} ms, Positions evaluated: {self.positions_evaluated}, Move generations: {self.move_generations}, Cache retrievals: {self.cache_retreivals}")
-        result_container.append((best_move, best_eval, True))
+        self.stats.finish(self.nodes)
+        print(self.stats.summary())
+
+        # completed depths are kept for later sessions (the root score of a completed depth is exact)
+        if self.analysis_cache is not None and self.depth_reached > 0 and line_count == 1:
+            self.analysis_cache.put(self.board.zobrist_key, self.depth_reached, completed_eval, TT_EXACT, completed_pv)
+
+        # the opponent's expected reply, pondered on while they think
+        pv = self.previous_pv if self.previous_pv and self.previous_pv[0] == best_move else [best_move]
+        self.ponder_move = pv[1] if len(pv) > 1 else None
+        self.pondering = False
+        info = self.create_search_info(search_depth, best_eval, pv, final=True, lines=lines)
+        self.search_info.publish(info)
+        return info
+
+    def search_lines(self, depth, previous_lines, line_count):
+        '''Search the best line_count root moves at the given depth and return their (eval, pv), best first.
+        Every line is searched with the moves of the better lines excluded. If the search is stopped,
+        only the lines finished so far are returned.'''
+        lines = []
+        self.excluded_root_moves = []
+        for line_index in range(line_count):
+            previous_eval = previous_lines[line_index][0] if line_index < len(previous_lines) else None
+            # each line follows its own pv of the previous depth
+            self.previous_pv = previous_lines[line_index][1] if line_index < len(previous_lines) else []
+            move, eval = self.aspiration_search(depth, previous_eval)
+            if self.stopped:
+                # a partly searched line is only a guess, it's kept only if it's the best line
+                if move is not None and not lines:
+                    lines.append((eval, self.complete_pv(self.get_principal_variation() or [move], depth)))
+                break
+            lines.append((eval, self.complete_pv(self.get_principal_variation() or [move], depth)))
+            self.excluded_root_moves.append(move)
+        self.excluded_root_moves = []
 
+        # a later line can score higher than an earlier one after a re-search
+        lines.sort(key=lambda line: line[0], reverse=self.board.white_to_move)
+        return lines
 
-# result_container = []
-# (best_move, best_eval, is_final)
\ No newline at end of file
+    def publish_lines(self, depth, lines):
+        for line_index, (eval, pv) in enumerate(lines):
+            self.search_info.publish(self.create_search_info(depth, eval, pv, multipv=line_index + 1))
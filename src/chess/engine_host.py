@@ -0,0 +1,152 @@
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+from src.chess.board import Board, STARTING_FEN
+from src.chess.engine import Engine, SearchLimits
+from src.chess.search_info import SearchInfo, SearchInfoStream
+
+'''
+Runs the engine in its own process so the search does not hold the GIL of the pygame process.
+
+The GUI talks to the host with small messages (tuples) over two queues.
+Commands (GUI -> host):
+    ('new_game', fen)               start a new game (the search tables of the last game are cleared)
+    ('position', fen, moves)        set the position: the start fen of the game and the moves played since,
+                                    only the moves played (or taken back) since the last position are made
+    ('go', limits)                  start a search with SearchLimits (ponder=True for a ponder search)
+    ('ponderhit', time_limit_ms)    the expected move was played, the ponder search continues as a normal search
+    ('stop',)                       stop the search, the best move so far is still reported
+    ('quit',)                       stop the search and exit
+Results (host -> GUI):
+    SearchInfo after every depth, the last one of a search has final=True (its best move is None if
+    there are no legal moves). EngineHost.poll publishes them on its own SearchInfoStream.
+
+The engine keeps its transposition table, history and killer moves between the moves of a game, and
+get_engine_host keeps the host process between games (starting a process and an engine takes a while).
+'''
+
+STOP_TIMEOUT = 5 # seconds to wait for the best move after a stop
+
+def engine_host(command_queue, result_queue, engine_settings):
+    '''Host process: handle commands until quit. The search runs on a thread so stop and ponderhit
+    are handled while it is searching.'''
+    engine = Engine(Board(), **engine_settings)
+    engine.search_info.subscribe(result_queue.put)
+    search_thread = None
+
+    while True:
+        command, *args = command_queue.get()
+
+        if command in ('new_game', 'position', 'go', 'stop', 'quit') and search_thread is not None:
+            engine.stop()
+            search_thread.join()
+            search_thread = None
+
+        if command == 'new_game':
+            fen, = args
+            engine.new_game(fen)
+        elif command == 'position':
+            fen, moves = args
+            engine.set_position(fen, moves)
+        elif command == 'go':
+            limits, = args
+            engine.prepare_search()
+            search_thread = threading.Thread(target=engine.iterative_deepening, args=(limits,), daemon=True)
+            search_thread.start()
+        elif command == 'ponderhit':
+            time_limit_ms, = args
+            engine.ponderhit(time_limit_ms)
+        elif command == 'quit':
+            break
+
+    # the process exits without running atexit handlers
+    if engine.analysis_cache is not None:
+        engine.analysis_cache.close()
+
+
+class EngineHost:
+    '''GUI side of the engine host process.'''
+    def __init__(self, **engine_settings):
+        # spawn: a forked child would inherit the pygame state of the GUI process
+        context = multiprocessing.get_context('spawn')
+        self.command_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.process = context.Process(target=engine_host, args=(self.command_queue, self.result_queue, engine_settings), daemon=True)
+        self.process.start()
+
+        self.searching = False
+        self.ponder_move = None # expected reply to the last best move
+        self.search_info = SearchInfoStream()
+
+    def new_game(self, fen=STARTING_FEN):
+        self.ponder_move = None
+        self.command_queue.put(('new_game', fen))
+
+    def set_position(self, fen, moves: list = ()):
+        '''The start position of the game and the moves played from it.'''
+        self.command_queue.put(('position', fen, list(moves)))
+
+    def go(self, limits: SearchLimits):
+        self.searching = True
+        self.command_queue.put(('go', limits))
+
+    def ponderhit(self, time_limit_ms: int = None):
+        self.command_queue.put(('ponderhit', time_limit_ms))
+
+    def poll(self):
+        '''Publish the search info sent by the host since the last call without blocking (called once per frame).'''
+        while True:
+            try:
+                info = self.result_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.receive_info(info)
+            self.search_info.publish(info)
+
+    def receive_info(self, info: SearchInfo):
+        if info.final:
+            self.searching = False
+            self.ponder_move = info.ponder_move
+
+    def stop(self):
+        '''Stop the search and discard its results, so they are not mistaken for the next search's.'''
+        if not self.searching:
+            return
+        self.command_queue.put(('stop',))
+        deadline = time.time() + STOP_TIMEOUT
+        while self.searching and time.time() < deadline:
+            try:
+                self.receive_info(self.result_queue.get(timeout=deadline - time.time()))
+            except queue.Empty:
+                break
+        self.searching = False
+
+    def close(self):
+        self.command_queue.put(('quit',))
+        self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+
+# the host kept between games (get_engine_host)
+shared_host = None
+shared_host_settings = None
+
+def get_engine_host(**engine_settings):
+    '''The shared engine host, started again only if the engine settings changed (or it died).
+    Call new_game before a game and unsubscribe from its search_info after it.'''
+    global shared_host, shared_host_settings
+    if shared_host is not None and (engine_settings != shared_host_settings or not shared_host.is_alive()):
+        atexit.unregister(shared_host.close)
+        shared_host.close()
+        shared_host = None
+    if shared_host is None:
+        shared_host = EngineHost(**engine_settings)
+        shared_host_settings = engine_settings
+        atexit.register(shared_host.close)
+    return shared_host
@@ -0,0 +1,326 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from src.chess.board import Board, STARTING_FEN, encode_move, decode_move
+from src.chess import pgn
+
+'''
+Game archive: an append-only binary file of games with a fixed-width side index.
+
+Archive: every game is a length prefix (uint32) followed by
+  header    date (uint32 YYYYMMDD, 0 if unknown), result (uint8), ply count, FEN length, tags length (uint16 each)
+  FEN       the start position, empty for the standard start position
+  tags      'name\tvalue\n' lines of the other PGN tags (UTF-8)
+  moves     one uint16 per ply (board.encode_move)
+Index (<archive>.idx): one record per game of offset (uint64), opening key (uint64), date (uint32), plies (uint16)
+and result (uint8). The opening key is the zobrist key after OPENING_PLIES plies (or of the last position of a
+shorter game), so games of the same opening can be found without reading the archive. A missing or outdated index
+is rebuilt from the archive.
+
+Games are read with a memory map and their moves stay encoded until a game is replayed,
+so thousands of games load in milliseconds.
+Convert with: python -m src.chess.game_archive import-pgn games.pgn, python -m src.chess.game_archive export-pgn games.pgn
+'''
+
+GAME_ARCHIVE_FILE = 'src/chess/debug_data/games.bin'
+MOVE_LISTS_DIR = 'src/chess/debug_data/move_lists'
+
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<IBHHH')
+INDEX_RECORD = struct.Struct('<QQIHB')
+
+OPENING_PLIES = 8
+
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2') # the result byte is the index of the PGN result
+
+class Game:
+    '''A game of the archive. moves holds the encoded moves, replay() decodes them.'''
+    def __init__(self, moves, result='*', date=0, tags=None, start_fen=STARTING_FEN, offset=None):
+        self.moves = moves # array('H') of board.encode_move codes
+        self.result = result
+        self.date = date # YYYYMMDD
+        self.tags = tags if tags is not None else {}
+        self.start_fen = start_fen
+        self.offset = offset # position in the archive
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __repr__(self):
+        return f"Game(plies={len(self.moves)}, result={self.result}, date={self.date}, tags={self.tags})"
+
+    @staticmethod
+    def from_moves(moves, result='*', date=0, tags=None, start_fen=STARTING_FEN):
+        '''Game of the board's move tuples.'''
+        return Game(array('H', [encode_move(move) for move in moves]), result, date, tags, start_fen)
+
+    def replay(self):
+        '''Yields (board, move) of every ply; the board is the position before the move and is reused.'''
+        board = Board(self.start_fen)
+        for code in self.moves:
+            move = decode_move(board.generate_legal_moves(), code)
+            if move is None:
+                raise ValueError(f"Illegal move {code} in {board.create_fen()}")
+            yield board, move
+            board.make_move(move)
+
+    def decoded_moves(self):
+        return [move for _, move in self.replay()]
+
+    def final_board(self):
+        board = Board(self.start_fen)
+        for code in self.moves:
+            board.make_move(decode_move(board.generate_legal_moves(), code))
+        return board
+
+    def opening_key(self):
+        board = Board(self.start_fen)
+        for code in self.moves[:OPENING_PLIES]:
+            board.make_move(decode_move(board.generate_legal_moves(), code))
+        return board.zobrist_key
+
+    def to_pgn(self):
+        tags = dict(self.tags)
+        if self.date:
+            tags['Date'] = f'{self.date // 10000:04d}.{self.date // 100 % 100:02d}.{self.date % 100:02d}'
+        return pgn.format_game(tags, self.decoded_moves(), self.result, self.start_fen)
+
+
+def parse_date(text):
+    '''YYYYMMDD of a PGN date (YYYY.MM.DD, unknown parts are ??), 0 if unknown.'''
+    parts = (text or '').split('.')
+    if len(parts) != 3 or not parts[0].isdigit():
+        return 0
+    year, month, day = (int(part) if part.isdigit() else 0 for part in parts)
+    return year * 10000 + month * 100 + day
+
+def today():
+    return int(time.strftime('%Y%m%d'))
+
+def encode_game(game: Game):
+    fen = b'' if game.start_fen == STARTING_FEN else game.start_fen.encode()
+    tags = ''.join(f'{name}\t{value}\n' for name, value in game.tags.items()).encode()
+    header = HEADER.pack(game.date, RESULTS.index(game.result), len(game.moves), len(fen), len(tags))
+    payload = header + fen + tags + game.moves.tobytes()
+    return LENGTH.pack(len(payload)) + payload
+
+def decode_game(data, offset):
+    '''(game, offset of the next game) of the game at offset.'''
+    length, = LENGTH.unpack_from(data, offset)
+    start = offset + LENGTH.size
+    date, result, plies, fen_length, tags_length = HEADER.unpack_from(data, start)
+    position = start + HEADER.size
+    fen = bytes(data[position:position + fen_length]).decode() or STARTING_FEN
+    position += fen_length
+    tags = {}
+    for line in bytes(data[position:position + tags_length]).decode().splitlines():
+        name, _, value = line.partition('\t')
+        tags[name] = value
+    position += tags_length
+    moves = array('H')
+    moves.frombytes(data[position:position + plies * 2])
+    return Game(moves, RESULTS[result], date, tags, fen, offset), start + length
+
+def index_path(path):
+    return path + '.idx'
+
+
+class GameArchive:
+    '''Appends games to an archive file and keeps its index up to date.'''
+    def __init__(self, path=GAME_ARCHIVE_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        end = update_index(path)
+        self.file = open(path, 'ab')
+        # a game that was cut off while it was written is overwritten
+        self.file.truncate(end)
+        self.index_file = open(index_path(path), 'ab')
+
+    def append(self, game: Game):
+        offset = self.file.tell()
+        self.file.write(encode_game(game))
+        self.file.flush()
+        self.index_file.write(INDEX_RECORD.pack(offset, game.opening_key(), game.date, len(game.moves), RESULTS.index(game.result)))
+        self.index_file.flush()
+        return offset
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def save_game(moves, result='*', tags=None, start_fen=STARTING_FEN, path=GAME_ARCHIVE_FILE):
+    '''Append a game of the board's move tuples to the archive (used by the game modes).'''
+    with GameArchive(path) as archive:
+        return archive.append(Game.from_moves(moves, result, today(), tags, start_fen))
+
+def save_new_game(saved_game, moves, result='*', tags=None, start_fen=STARTING_FEN, path=GAME_ARCHIVE_FILE):
+    '''save_game, unless the game was already saved as it is (e.g. with s before the game over screen).
+    saved_game is what the last call returned (None at first); returns the game that is saved now.'''
+    game = (start_fen, list(moves), result)
+    if game != saved_game:
+        save_game(moves, result, tags, start_fen, path)
+    return game
+
+def game_result(board, white_time, black_time):
+    '''PGN result of a game of the game modes, * if it is not over (a player whose clock ran out lost).'''
+    if board.is_checkmate():
+        return '0-1' if board.white_to_move else '1-0'
+    if board.is_draw():
+        return '1/2-1/2'
+    if white_time <= 0:
+        return '0-1'
+    if black_time <= 0:
+        return '1-0'
+    return '*'
+
+
+def iter_games(path=GAME_ARCHIVE_FILE, offsets=None, start=0):
+    '''Yields the games of an archive from offset start (or only the games at the given offsets) from a memory map.'''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if offsets is not None:
+            for offset in offsets:
+                yield decode_game(data, offset)[0]
+            return
+        offset = start
+        # a game that was cut off while it was written is ignored
+        while offset + LENGTH.size <= len(data) and offset + LENGTH.size + LENGTH.unpack_from(data, offset)[0] <= len(data):
+            game, offset = decode_game(data, offset)
+            yield game
+
+def read_games(path=GAME_ARCHIVE_FILE):
+    return list(iter_games(path))
+
+def read_index(path=GAME_ARCHIVE_FILE):
+    '''[(offset, opening key, date, plies, result index)] of every game of the archive.'''
+    update_index(path)
+    if not os.path.exists(index_path(path)):
+        return []
+    with open(index_path(path), 'rb') as file:
+        return list(INDEX_RECORD.iter_unpack(file.read()))
+
+def indexed_end(path, indexed):
+    '''Offset after the last of the indexed games, None if the archive doesn't have that game.'''
+    with open(index_path(path), 'rb') as file:
+        file.seek((indexed - 1) * INDEX_RECORD.size)
+        offset = INDEX_RECORD.unpack(file.read(INDEX_RECORD.size))[0]
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(LENGTH.size)
+    if len(data) < LENGTH.size:
+        return None
+    end = offset + LENGTH.size + LENGTH.unpack(data)[0]
+    return end if end <= os.path.getsize(path) else None
+
+def update_index(path=GAME_ARCHIVE_FILE):
+    '''Add the games after the last indexed game to the index, so only new games are read. The index is rebuilt
+    if there is none or if it has more games than the archive. Returns the size of the complete games of the archive.'''
+    if not os.path.exists(path):
+        return 0
+    indexed = os.path.getsize(index_path(path)) // INDEX_RECORD.size if os.path.exists(index_path(path)) else 0
+    start = indexed_end(path, indexed) if indexed else 0
+    if start is None:
+        indexed = start = 0
+    records = []
+    end = start
+    for game in iter_games(path, start=start):
+        records.append(INDEX_RECORD.pack(game.offset, game.opening_key(), game.date, len(game.moves), RESULTS.index(game.result)))
+        end = game.offset + len(encode_game(game))
+    if records or indexed == 0:
+        with open(index_path(path), 'r+b' if indexed else 'wb') as file:
+            file.seek(indexed * INDEX_RECORD.size)
+            file.write(b''.join(records))
+            file.truncate()
+    return end
+
+def find_games(path=GAME_ARCHIVE_FILE, date_from=None, date_to=None, result=None, opening_key=None):
+    '''Offsets of the games matching all the given filters, from the index.'''
+    result_index = RESULTS.index(result) if result is not None else None
+    offsets = []
+    for offset, key, date, plies, game_result in read_index(path):
+        if date_from is not None and date < date_from:
+            continue
+        if date_to is not None and date > date_to:
+            continue
+        if result_index is not None and game_result != result_index:
+            continue
+        if opening_key is not None and key != opening_key:
+            continue
+        offsets.append(offset)
+    return offsets
+
+
+def import_pgn(pgn_path, path=GAME_ARCHIVE_FILE):
+    '''Append the games of a PGN file to the archive, returns the number of games imported.'''
+    count = 0
+    with GameArchive(path) as archive:
+        for tags, san_moves, result in pgn.read_pgn_file(pgn_path):
+            moves, illegal = pgn.san_moves_to_moves(tags, san_moves)
+            if illegal is not None:
+                print(f"Illegal move {illegal} in game {tags}, the game is imported up to it")
+            date = parse_date(tags.pop('Date', ''))
+            start_fen = tags.pop('FEN', STARTING_FEN)
+            tags.pop('SetUp', None)
+            tags.pop('Result', None)
+            archive.append(Game.from_moves(moves, result if result in RESULTS else '*', date, tags, start_fen))
+            count += 1
+    return count
+
+def export_pgn(pgn_path, path=GAME_ARCHIVE_FILE):
+    '''Write every game of the archive to a PGN file, returns the number of games exported.'''
+    count = 0
+    with open(pgn_path, 'w') as file:
+        for game in iter_games(path):
+            file.write(game.to_pgn())
+            count += 1
+    return count
+
+def import_move_lists(directory=MOVE_LISTS_DIR, path=GAME_ARCHIVE_FILE):
+    '''Append the JSON move lists of the old export_move_list (games from the start position) to the archive.'''
+    count = 0
+    with GameArchive(path) as archive:
+        for file_path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(file_path, 'r') as file:
+                moves = [tuple(move) for move in json.load(file)]
+            date = int(time.strftime('%Y%m%d', time.localtime(os.path.getmtime(file_path))))
+            archive.append(Game.from_moves(moves, '*', date))
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert games between the game archive and PGN')
+    parser.add_argument('command', choices=['import-pgn', 'export-pgn', 'import-move-lists', 'list'])
+    parser.add_argument('file', nargs='?', help='PGN file, or the directory of the move lists')
+    parser.add_argument('--archive', default=GAME_ARCHIVE_FILE)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.command == 'import-pgn':
+        count = import_pgn(args.file, args.archive)
+    elif args.command == 'export-pgn':
+        count = export_pgn(args.file, args.archive)
+    elif args.command == 'import-move-lists':
+        count = import_move_lists(args.file or MOVE_LISTS_DIR, args.archive)
+    else:
+        games = read_games(args.archive)
+        for game in games:
+            print(game)
+        count = len(games)
+    print(f"{count} games in {time.time() - start_time:.3f} sec")
+
+if __name__ == "__main__":
+    main()
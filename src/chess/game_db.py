@@ -0,0 +1,236 @@
+import argparse
+import itertools
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from src.chess.board import Board, STARTING_FEN, encode_move, decode_move
+from src.chess.notation import san_to_move
+from src.chess import game_archive, pgn
+
+'''
+Game database: games in SQLite with an index of every position they reach (zobrist key -> game, ply),
+so "find all games reaching this position" is an index lookup instead of replaying every game.
+
+PGN files are imported in a streaming way: games are read in batches, the SAN moves of a batch are replayed
+in a process pool (the slow part) and every batch is inserted in one transaction, so the memory use does not
+depend on the size of the file. The moves are stored encoded (board.encode_move, 2 bytes per ply).
+Zobrist keys are unsigned 64 bit numbers and SQLite integers are signed, so keys are stored as signed integers.
+The keys depend on the board's zobrist keys (ZOBRIST_SEED), so the database has to be imported again if they change.
+
+Run with: python -m src.chess.game_db import games.pgn
+          python -m src.chess.game_db find --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+          python -m src.chess.game_db export games.pgn [--fen ...]
+'''
+
+GAME_DB_FILE = 'src/chess/debug_data/games.db'
+IMPORT_BATCH_SIZE = 500 # games per transaction
+IMPORT_CHUNK_SIZE = 25 # games per task of a worker
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    event TEXT, site TEXT, date TEXT, round TEXT, white TEXT, black TEXT,
+    result TEXT NOT NULL,
+    start_fen TEXT NOT NULL,
+    plies INTEGER NOT NULL,
+    moves BLOB NOT NULL,
+    tags TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    PRIMARY KEY (key, game_id, ply)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS games_players ON games (white, black);
+'''
+
+# columns of the games table filled from the seven tag roster, the other tags are kept in the tags column
+TAG_COLUMNS = {'Event': 'event', 'Site': 'site', 'Date': 'date', 'Round': 'round', 'White': 'white', 'Black': 'black'}
+
+def to_signed(key):
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+def replay_game(tags, san_moves, result):
+    '''(tags, result, start fen, encoded moves, zobrist keys of every position) of a PGN game.
+    A game with an illegal move is kept up to the move before it.'''
+    board = pgn.start_board(tags)
+    start_fen = board.create_fen()
+    moves = array('H')
+    keys = [board.zobrist_key]
+    for san in san_moves:
+        move = san_to_move(board, san)
+        if move is None:
+            break
+        moves.append(encode_move(move))
+        board.make_move(move)
+        keys.append(board.zobrist_key)
+    return tags, result, start_fen, moves.tobytes(), keys
+
+def replay_games(games):
+    return [replay_game(*game) for game in games]
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class GameDatabase:
+    def __init__(self, path=GAME_DB_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def insert_games(self, replayed_games):
+        '''Insert replayed games (see replay_game) in one transaction.'''
+        with self.connection:
+            for tags, result, start_fen, moves, keys in replayed_games:
+                columns = {column: tags.get(name) for name, column in TAG_COLUMNS.items()}
+                other_tags = ''.join(f'{name}\t{value}\n' for name, value in tags.items()
+                                     if name not in TAG_COLUMNS and name not in ('Result', 'FEN', 'SetUp'))
+                cursor = self.connection.execute(
+                    'INSERT INTO games (event, site, date, round, white, black, result, start_fen, plies, moves, tags) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (*columns.values(), result, start_fen, len(moves) // 2, moves, other_tags))
+                game_id = cursor.lastrowid
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO positions (key, game_id, ply) VALUES (?, ?, ?)',
+                    [(to_signed(key), game_id, ply) for ply, key in enumerate(keys)])
+
+    def import_games(self, games, workers=None, batch_size=IMPORT_BATCH_SIZE):
+        '''Import (tags, SAN moves, result) games, e.g. pgn.read_pgn_file(path). Returns the number of games.'''
+        count = 0
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for batch in chunks(games, batch_size):
+                for replayed in executor.map(replay_games, chunks(batch, IMPORT_CHUNK_SIZE)):
+                    self.insert_games(replayed)
+                count += len(batch)
+                print(f"{count} games imported ({count / (time.time() - start_time):.0f} games/sec)")
+        return count
+
+    def import_pgn(self, path, workers=None):
+        return self.import_games(pgn.read_pgn_file(path), workers)
+
+    def import_archive(self, path=game_archive.GAME_ARCHIVE_FILE):
+        '''Import the games of a game archive (their moves are already encoded, so no process pool is needed).'''
+        replayed = []
+        for game in game_archive.iter_games(path):
+            tags = dict(game.tags)
+            if game.date:
+                tags['Date'] = f'{game.date // 10000:04d}.{game.date // 100 % 100:02d}.{game.date % 100:02d}'
+            board = Board(game.start_fen)
+            keys = [board.zobrist_key]
+            for code in game.moves:
+                board.make_move(decode_move(board.generate_legal_moves(), code))
+                keys.append(board.zobrist_key)
+            replayed.append((tags, game.result, game.start_fen, game.moves.tobytes(), keys))
+        self.insert_games(replayed)
+        return len(replayed)
+
+    def count_games(self):
+        return self.connection.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+    def find_games(self, key, limit=None):
+        '''[(game id, ply)] of the games reaching the position with the zobrist key (the first ply it is reached).'''
+        query = 'SELECT game_id, MIN(ply) FROM positions WHERE key = ? GROUP BY game_id ORDER BY game_id'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        return self.connection.execute(query, (to_signed(key),)).fetchall()
+
+    def find_position(self, fen, limit=None):
+        return self.find_games(Board(fen).zobrist_key, limit)
+
+    def next_moves(self, key):
+        '''{encoded move: [games, white wins, draws, black wins]} of the moves played in the position.'''
+        statistics = {}
+        rows = self.connection.execute(
+            'SELECT games.moves, positions.ply, games.result FROM positions JOIN games ON games.id = positions.game_id '
+            'WHERE positions.key = ?', (to_signed(key),))
+        for moves, ply, result in rows:
+            if ply * 2 + 2 > len(moves):
+                continue # the game ended in the position
+            code = int.from_bytes(moves[ply * 2:ply * 2 + 2], 'little')
+            counts = statistics.setdefault(code, [0, 0, 0, 0])
+            counts[0] += 1
+            if result in pgn.PGN_RESULTS[:3]:
+                counts[(1, 3, 2)[pgn.PGN_RESULTS.index(result)]] += 1
+        return statistics
+
+    def get_game(self, game_id):
+        '''(tags, moves, result, start fen) of a game, the moves are the board's move tuples.'''
+        row = self.connection.execute(
+            'SELECT event, site, date, round, white, black, result, start_fen, moves, tags FROM games WHERE id = ?',
+            (game_id,)).fetchone()
+        if row is None:
+            return None
+        *columns, result, start_fen, encoded, other_tags = row
+        tags = {name: value for name, value in zip(TAG_COLUMNS, columns) if value is not None}
+        for line in other_tags.splitlines():
+            name, _, value = line.partition('\t')
+            tags[name] = value
+        codes = array('H')
+        codes.frombytes(encoded)
+        board = Board(start_fen)
+        moves = []
+        for code in codes:
+            move = decode_move(board.generate_legal_moves(), code)
+            moves.append(move)
+            board.make_move(move)
+        return tags, moves, result, start_fen
+
+    def export_pgn(self, path, game_ids=None):
+        '''Write the games (all of them if game_ids is None) to a PGN file. Returns the number of games.'''
+        if game_ids is None:
+            game_ids = [row[0] for row in self.connection.execute('SELECT id FROM games ORDER BY id')]
+        with open(path, 'w') as file:
+            for game_id in game_ids:
+                tags, moves, result, start_fen = self.get_game(game_id)
+                file.write(pgn.format_game(tags, moves, result, start_fen))
+        return len(game_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Game database with a position index')
+    parser.add_argument('command', choices=['import', 'import-archive', 'find', 'export'])
+    parser.add_argument('file', nargs='?', help='PGN file to import or export to')
+    parser.add_argument('--database', default=GAME_DB_FILE)
+    parser.add_argument('--fen', default=STARTING_FEN, help='position to find (find, export)')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='processes replaying the imported games')
+    args = parser.parse_args()
+
+    with GameDatabase(args.database) as database:
+        start_time = time.time()
+        if args.command == 'import':
+            count = database.import_pgn(args.file, args.workers)
+            print(f"{count} games imported in {time.time() - start_time:.1f} sec, {database.count_games()} games in {args.database}")
+        elif args.command == 'import-archive':
+            count = database.import_archive(args.file or game_archive.GAME_ARCHIVE_FILE)
+            print(f"{count} games imported, {database.count_games()} games in {args.database}")
+        elif args.command == 'find':
+            games = database.find_position(args.fen, args.limit)
+            print(f"{len(games)} games reach the position ({(time.time() - start_time) * 1000:.1f} ms)")
+            for game_id, ply in games:
+                tags, moves, result, start_fen = database.get_game(game_id)
+                print(f"{game_id}: {tags.get('White', '?')} - {tags.get('Black', '?')} {result}, {tags.get('Date', '?')}, ply {ply}")
+        else:
+            game_ids = None
+            if args.fen != STARTING_FEN:
+                game_ids = [game_id for game_id, ply in database.find_position(args.fen, args.limit)]
+            count = database.export_pgn(args.file, game_ids)
+            print(f"{count} games written to {args.file}")
+
+if __name__ == "__main__":
+    main()
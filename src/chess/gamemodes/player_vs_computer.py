@@ -1,11 +1,12 @@
 from src.chess.board import Board, Piece
-from src.chess.engine import Engine
+from src.chess.game_archive import save_new_game, game_result
+from src.chess.engine import SearchLimits
+from src.chess.engine_host import get_engine_host
 from tkinter import simpledialog
 from constants import *
 from time import time
 import tkinter as tk
 from utils import *
-import threading
 import pygame
 import json
 
@@ -135,6 +136,8 @@ class PlayerVsComputer:
         self.screen = screen
 
         self.board = Board()
+        self.start_fen = self.board.create_fen() # start position of the saved game
+        self.saved_game = None # the last game written to the archive, so it is not written twice
         
         self.selected_square = None
 
@@ -143,6 +146,10 @@ class PlayerVsComputer:
         self.engine_depth = self.load_engine_depth()
         self.sfx = self.load_sfx()
         self.human_player = self.load_human_player()
+        settings = self.load_settings()
+        self.ponder = settings.get('ponder', False) # the engine thinks on the human player's turn
+        self.multi_pv = settings.get('multi_pv', 1) # lines the engine searches (and shows)
+        self.analysis_cache = settings.get('analysis_cache', False) # the engine keeps its analysis between sessions
         self.start_time_per_side = self.load_start_time_per_side()
         self.increment = self.load_increment()
 
@@ -153,16 +160,26 @@ class PlayerVsComputer:
         self.preview_annotation_start_square = None
         self.preview_annotation_end_square = None
 
-        # initialize the engine
+        # the engine runs in its own process (so the search does not slow down the game loop),
+        # which is kept for the next game unless the settings change
         self.allocated_engine_time = self.start_time_per_side*1000//50 + self.increment*900
-        self.engine = Engine(
-            self.board, 
-            self.engine_depth, 
-            time_limit_ms=self.allocated_engine_time)
-        self.engine_move_container = []
-        self.engine_status = 'idle'
+        self.engine = get_engine_host(
+            depth=self.engine_depth, 
+            time_limit_ms=self.allocated_engine_time,
+            multi_pv=self.multi_pv,
+            use_analysis_cache=self.analysis_cache)
+        self.engine.new_game(self.start_fen)
+        self.engine_status = 'idle' # idle, thinking or pondering
+        self.engine_suggested_move = None # best move of the latest finished depth
+        self.engine_final_move = None # set once the search has finished
+        self.engine_alternative_moves = {} # multipv number -> first move of the other lines of the latest depth
+        self.ponder_move = None # the human player's move the engine is pondering on
 
         self.eval_bar = EvalBar()
+
+        # the eval bar and the suggested move arrow follow the engine's search info
+        self.engine.search_info.subscribe(self.update_eval_bar)
+        self.engine.search_info.subscribe(self.update_engine_suggestion)
         
         self.move_list = []
 
@@ -208,6 +225,11 @@ class PlayerVsComputer:
         
         return settings['human_player']
 
+    def load_settings(self):
+        '''Load settings.json'''
+        with open('src/chess/settings.json', 'r') as file:
+            return json.load(file)
+
     def load_piece_images(self):
         '''
         Load the piece images
@@ -494,8 +516,8 @@ class PlayerVsComputer:
 
         pygame.display.flip()
 
-        # save the game to a json file
-        # self.export_move_list()
+        # save the game to the game archive
+        self.save_game()
 
         # wait for the user to click
         while True:
@@ -544,7 +566,7 @@ class PlayerVsComputer:
 
                 # make the move
                 self.board.make_move(move)
-                self.engine.update_board(self.board)
+                self.sync_engine(move)
                 self.move_list.append(move)
 
                 # switch the turn
@@ -654,25 +676,67 @@ class PlayerVsComputer:
         x, y = square_to_pixel(start)
         draw_transparent_rect(self.screen, (x, y, CHESS_GRID_SIZE, CHESS_GRID_SIZE), PREVIOUS_MOVE_COLOR, PREVIOUS_MOVE_ALPHA)
 
-    def export_move_list(self):
-        '''Export the move list to a json file'''
+    def save_game(self):
+        '''Append the game to the game archive, unless it was already saved as it is'''
+        tags = {
+            'Event': 'Player vs Computer',
+            'White': 'Player' if self.human_player else 'Engine',
+            'Black': 'Engine' if self.human_player else 'Player',
+        }
+        result = game_result(self.board, self.chess_clock.white_time, self.chess_clock.black_time)
+        self.saved_game = save_new_game(self.saved_game, self.move_list, result, tags, self.start_fen)
+
+    def get_engine_time_limit(self):
+        '''Get the time limit of the engine for its next move'''
+        if self.human_player:
+            return min(self.chess_clock.black_time*1000//4, self.allocated_engine_time)
+        else:
+            return min(self.chess_clock.white_time*1000//4, self.allocated_engine_time)
+
+    def reset_engine_results(self):
+        self.engine_suggested_move = None
+        self.engine_final_move = None
+        self.engine_alternative_moves = {}
 
-        # create a folder to store the move lists if it does not exist
-        file_name = f'src/chess/debug_data/move_lists/{len(self.move_list)}_ID{self.board.hash_board()}.json'
-        with open(file_name, 'w') as file:
-            json.dump(self.move_list, file)
-    
     def request_engine_move(self):
         '''Request a move from the engine'''
+        self.reset_engine_results()
+        # the engine only makes the moves played since its last position
+        self.engine.set_position(self.start_fen, self.move_list)
+        self.engine.go(SearchLimits(time_ms=self.get_engine_time_limit()))
+
+    def request_engine_ponder(self):
+        '''Let the engine search the expected reply of the human player while the human player is thinking'''
+        ponder_move = self.engine.ponder_move
+        if ponder_move is None or ponder_move not in self.board.generate_legal_moves():
+            return
 
-        # set the time limit of the engine
-        if self.human_player:
-            self.engine.set_time_limit(min(self.chess_clock.black_time*1000//4, self.allocated_engine_time))
-        else:
-            self.engine.set_time_limit(min(self.chess_clock.white_time*1000//4, self.allocated_engine_time))
+        self.reset_engine_results()
+        self.ponder_move = ponder_move
+        self.engine.set_position(self.start_fen, self.move_list + [ponder_move])
+        # a ponder search has no time limit until the ponder hit
+        self.engine.go(SearchLimits(time_ms=self.get_engine_time_limit(), ponder=True))
+        self.engine_status = 'pondering'
+
+    def stop_engine(self):
+        '''Stop the engine search (if any) and wait for the engine to acknowledge it'''
+        self.engine.stop()
+        self.reset_engine_results()
+        self.engine_status = 'idle'
+        self.ponder_move = None
+
+    def sync_engine(self, move):
+        '''Sync the engine after the human player's move'''
+        if self.engine_status == 'pondering':
+            # ponder hit: the running search continues on the engine's clock with its tables and depth
+            if move == self.ponder_move:
+                self.engine.ponderhit(self.get_engine_time_limit())
+                self.engine_status = 'thinking'
+                self.ponder_move = None
+                return
 
-        self.engine_move_container = []
-        threading.Thread(target=self.engine.iterative_deepening, args=(self.engine_move_container,)).start()
+            # ponder miss: restart from the actual position
+            self.stop_engine()
 
     def draw_latest_engine_move(self):
         '''Draw the latest move of the engine'''
@@ -681,12 +745,8 @@ class PlayerVsComputer:
         if self.turn == self.human_player:
             return
 
-        # if the engine has not made a move, return
-        if len(self.engine_move_container) == 0:
-            return
-        
-        # if the engine is still thinking, return
-        move = self.engine_move_container[-1][0]
+        # if the engine has not finished a depth yet, return
+        move = self.engine_suggested_move
         if move is None:
             return
         
@@ -697,6 +757,11 @@ class PlayerVsComputer:
         # draw an arrow from the start square to the end square
         self.draw_arrow(start, end, ENGINE_SUGGESTION_COLOR, ENGINE_SUGGESTION_ALPHA)
 
+        # the other lines of a multi-pv search are drawn fainter
+        for alternative_move in self.engine_alternative_moves.values():
+            if alternative_move != move:
+                self.draw_arrow(alternative_move[0], alternative_move[1], ENGINE_SUGGESTION_COLOR, ENGINE_ALTERNATIVE_ALPHA)
+
     def draw_algebraic_notation(self):
         '''
         Draw the algebraic notation of the board
@@ -768,10 +833,13 @@ class PlayerVsComputer:
         if fen is None:
             return
         
+        self.stop_engine()
         try:
             # the FEN is then set to the board
             self.board.load_fen(fen)
-            self.engine.update_board(self.board)
+            # the saved game starts from the new position
+            self.start_fen = self.board.create_fen()
+            self.move_list = []
         except:
             pass
 
@@ -806,18 +874,18 @@ class PlayerVsComputer:
                 # if u is pressed, undo the last move and play the move sound effect
                 if event.key == pygame.K_u:
                     if self.turn == self.human_player and len(self.move_list) > 1:
+                        self.stop_engine()
                         self.sfx['move'].play()
                         self.board.undo_move()
                         self.board.undo_move()
-                        self.engine.update_board(self.board)
                         if len(self.move_list) > 1:
                             self.move_list.pop()
                             self.move_list.pop()
                         self.selected_square = None
 
-                # if the s key is pressed, export the move list to a json file
+                # if the s key is pressed, save the game to the game archive
                 if event.key == pygame.K_s:
-                    self.export_move_list()
+                    self.save_game()
                 # if the f key is pressed, create a popup to edit the fen string
                 if event.key == pygame.K_f:
                     self.edit_fen()
@@ -827,39 +895,52 @@ class PlayerVsComputer:
                     self.chess_clock.black_time += 30
         return False
     
+    def update_engine_suggestion(self, info):
+        '''Search info subscriber: remember the engine's best move (and the other lines' moves)'''
+        if info.multipv > 1:
+            if info.best_move is not None:
+                self.engine_alternative_moves[info.multipv] = info.best_move
+            return
+        if info.best_move is not None:
+            self.engine_suggested_move = info.best_move
+        if info.final:
+            self.engine_final_move = info.best_move
+
     def handle_engine(self):
-        # TODO: add a feature to have the engine think on the human player's turn
+        # publishes the search info received since the last frame
+        self.engine.poll()
+
         if self.engine_status == 'idle':
             if self.turn != self.human_player: # if it is the engine's turn
                 self.engine_status = 'thinking'
                 self.request_engine_move()
 
         elif self.engine_status == 'thinking':
-            if len(self.engine_move_container) > self.previous_depth:
-                self.previous_depth = len(self.engine_move_container)
-                move_confirmation = self.engine_move_container[-1][2]
-
-                # if the engine has made a move, make the move
-                if move_confirmation:
-                    move = self.engine_move_container[-1][0]
-                    self.board.make_move(move)
-                    self.engine.update_board(self.board)
-                    self.move_list.append(move)
-                    self.sfx['move'].play()
-                    self.turn = not self.turn
-                    self.chess_clock.switch_turn()
-                    self.engine_status = 'idle'
-                    self.previous_depth = 0
-
-    def update_eval_bar(self):
-        '''Update the eval bar'''
+            # if the engine has made a move, make the move
+            if self.engine_final_move is not None:
+                move = self.engine_final_move
+                self.board.make_move(move)
+                self.move_list.append(move)
+                self.sfx['move'].play()
+                self.turn = not self.turn
+                self.chess_clock.switch_turn()
+                self.engine_status = 'idle'
+                self.reset_engine_results()
+
+                # think on the human player's turn
+                if self.ponder and not self.board.is_game_over():
+                    self.request_engine_ponder()
+
+    def update_eval_bar(self, info):
+        '''Search info subscriber: update the eval bar'''
         if self.turn == self.human_player:
             return
         
-        if len(self.engine_move_container) == 0:
+        # only the best line is the engine's evaluation
+        if info.multipv > 1:
             return
-        
-        eval = self.engine_move_container[-1][1]
+
+        eval = info.score
         if eval is None:
             return
 
@@ -876,11 +957,19 @@ class PlayerVsComputer:
             return True
 
     def main_loop(self):
+        menu = self.game_loop()
+        # a ponder search would otherwise keep running in the background
+        self.stop_engine()
+        # the engine host is kept for the next game
+        self.engine.search_info.unsubscribe(self.update_eval_bar)
+        self.engine.search_info.unsubscribe(self.update_engine_suggestion)
+        return menu
+
+    def game_loop(self):
         running = True
 
         self.lmx, self.lmy = pygame.mouse.get_pos()
         self.rmx, self.rmy = pygame.mouse.get_pos()
-        self.previous_depth = 0 # the depth of the engine in the previous frame
         while running:
             menu_change = self.handle_events()
             if menu_change:
@@ -898,7 +987,6 @@ class PlayerVsComputer:
             self.handle_move()
             self.handle_piece_selection()
 
-            self.update_eval_bar()
             self.handle_engine()
 
             self.draw_game()
@@ -1,4 +1,5 @@
 from src.chess.board import Board, Piece
+from src.chess.game_archive import save_new_game, game_result
 from tkinter import simpledialog
 from constants import *
 from time import time
@@ -111,6 +112,8 @@ class PlayerVsPlayer:
         self.screen = screen
 
         self.board = Board()
+        self.start_fen = self.board.create_fen() # start position of the saved game
+        self.saved_game = None # the last game written to the archive, so it is not written twice
         
         self.selected_square = None
 
@@ -439,8 +442,8 @@ class PlayerVsPlayer:
 
         pygame.display.flip()
 
-        # save the game to a json file
-        # self.export_move_list()
+        # save the game to the game archive
+        self.save_game()
 
         # wait for the user to click
         while True:
@@ -597,13 +600,15 @@ class PlayerVsPlayer:
         x, y = square_to_pixel(start)
         draw_transparent_rect(self.screen, (x, y, CHESS_GRID_SIZE, CHESS_GRID_SIZE), PREVIOUS_MOVE_COLOR, PREVIOUS_MOVE_ALPHA)
 
-    def export_move_list(self):
-        '''Export the move list to a json file'''
-
-        # create a folder to store the move lists if it does not exist
-        file_name = f'src/chess/debug_data/move_lists/{len(self.move_list)}_ID{self.board.hash_board()}.json'
-        with open(file_name, 'w') as file:
-            json.dump(self.move_list, file)
+    def save_game(self):
+        '''Append the game to the game archive, unless it was already saved as it is'''
+        tags = {
+            'Event': 'Player vs Player',
+            'White': 'Player',
+            'Black': 'Player',
+        }
+        result = game_result(self.board, self.chess_clock.white_time, self.chess_clock.black_time)
+        self.saved_game = save_new_game(self.saved_game, self.move_list, result, tags, self.start_fen)
 
     def draw_algebraic_notation(self):
         '''
@@ -675,6 +680,9 @@ class PlayerVsPlayer:
         try:
             # the FEN is then set to the board
             self.board.load_fen(fen)
+            # the saved game starts from the new position
+            self.start_fen = self.board.create_fen()
+            self.move_list = []
         except:
             pass
 
@@ -716,9 +724,9 @@ class PlayerVsPlayer:
                             self.move_list.pop()
                         self.selected_square = None
 
-                # if the s key is pressed, export the move list to a json file
+                # if the s key is pressed, save the game to the game archive
                 if event.key == pygame.K_s:
-                    self.export_move_list()
+                    self.save_game()
                 # if the f key is pressed, create a popup to edit the fen string
                 if event.key == pygame.K_f:
                     self.edit_fen()
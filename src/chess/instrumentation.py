@@ -0,0 +1,230 @@
+import argparse
+import functools
+import json
+import os
+import statistics
+import sys
+import time
+from src.chess.board import Board
+from src.chess.engine import Engine, SearchLimits
+from src.chess.search_info import print_search_info
+
+'''
+Opt-in instrumentation of the engine's hot functions: while enabled, every call of generate_legal_moves,
+make_move, undo_move, evaluate and order_moves is counted and timed, and the call times are kept in a histogram
+with power of two buckets (nanoseconds). The functions are wrapped on the classes only while instrumentation is
+enabled, so it costs nothing when disabled (unlike cProfile, which slows down every call of the search).
+Times are inclusive: a wrapped function called by another wrapped function counts for both.
+
+The workload runs several times and every function is reported with the run of its median mean call time
+(a single run varies by more than the threshold). A report can be saved as a baseline and later reports compared
+with it: a function whose median mean call time grew by more than the threshold is a regression and the
+benchmark run fails (exit code 1).
+Run with: python -m src.chess.instrumentation --save-baseline, then python -m src.chess.instrumentation [--repeat 5]
+'''
+
+BASELINE_FILE = 'instrumentation_baseline.json'
+REGRESSION_THRESHOLD = 10 # percent of the baseline's median mean call time
+REPEATS = 5 # runs of the workload
+
+# (class, method) of the instrumented functions
+TARGETS = [
+    (Board, 'generate_legal_moves'),
+    (Board, 'make_move'),
+    (Board, 'undo_move'),
+    (Engine, 'evaluate'),
+    (Engine, 'order_moves'),
+]
+
+HISTOGRAM_BUCKETS = 40 # bucket i counts the calls taking [2^(i-1), 2^i) ns
+
+# workload of the benchmark run
+PERFT_DEPTH = 3
+SEARCH_DEPTH = 4
+SEARCH_POSITIONS = [
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    'r2q1rk1/ppp2ppp/2np1n2/2b1p1B1/2B1P1b1/2NP1N2/PPP2PPP/R2Q1RK1 w - - 0 8',
+    '8/2p3N1/6p1/5PB1/pp2Rn2/7k/P1p2K1P/3r4 w - - 1 0',
+]
+
+class FunctionStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_ns = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, duration_ns):
+        self.calls += 1
+        self.total_ns += duration_ns
+        self.histogram[min(duration_ns.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.calls if self.calls else 0
+
+    def percentile_ns(self, fraction):
+        '''Upper bound of the bucket holding the given fraction of the calls.'''
+        target = fraction * self.calls
+        count = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            count += bucket_count
+            if count >= target and count:
+                return 1 << bucket
+        return 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total_ns / 1e6, 3),
+            'mean_ns': round(self.mean_ns, 1),
+            'p50_ns': self.percentile_ns(0.5),
+            'p90_ns': self.percentile_ns(0.9),
+            'p99_ns': self.percentile_ns(0.99),
+            'histogram': self.histogram,
+        }
+
+def timed(function, stats: FunctionStats):
+    perf_counter_ns = time.perf_counter_ns
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        result = function(*args, **kwargs)
+        stats.add(perf_counter_ns() - start)
+        return result
+    return wrapper
+
+
+class Instrumentation:
+    '''Wraps the TARGETS while enabled (use as a context manager). stats maps 'Class.method' to FunctionStats.'''
+    def __init__(self, targets=TARGETS):
+        self.targets = targets
+        self.stats = {}
+        self.originals = []
+
+    def enable(self):
+        if self.originals:
+            return
+        for owner, name in self.targets:
+            original = owner.__dict__[name]
+            stats = self.stats.setdefault(f'{owner.__name__}.{name}', FunctionStats(f'{owner.__name__}.{name}'))
+            self.originals.append((owner, name, original))
+            setattr(owner, name, timed(original, stats))
+
+    def disable(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def report(self):
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+def profile(workload, repeats=REPEATS):
+    '''Report of the workload (a function without arguments) instrumented in repeats runs, see combine_reports.'''
+    reports = []
+    for _ in range(repeats):
+        with Instrumentation() as instrumentation:
+            workload()
+        reports.append(instrumentation.report())
+    return combine_reports(reports)
+
+def combine_reports(reports):
+    '''Every function's stats of the run with its median mean call time, with the mean call times of all runs
+    and their spread (in percent of the median).'''
+    combined = {}
+    for name in reports[0]:
+        runs = sorted((report[name] for report in reports if name in report), key=lambda stats: stats['mean_ns'])
+        median = statistics.median_low([stats['mean_ns'] for stats in runs])
+        stats = combined[name] = dict(next(stats for stats in runs if stats['mean_ns'] == median))
+        stats['runs_mean_ns'] = [stats['mean_ns'] for stats in runs]
+        stats['spread'] = round((runs[-1]['mean_ns'] - runs[0]['mean_ns']) / median * 100, 2) if median else 0
+    return combined
+
+def print_report(report):
+    print(f"{'function':<28} {'calls':>10} {'total ms':>10} {'mean ns':>10} {'p50 ns':>9} {'p90 ns':>9} {'p99 ns':>9} {'spread':>7}")
+    for name, stats in report.items():
+        print(f"{name:<28} {stats['calls']:>10} {stats['total_ms']:>10.1f} {stats['mean_ns']:>10.0f} "
+              f"{stats['p50_ns']:>9} {stats['p90_ns']:>9} {stats['p99_ns']:>9} {stats.get('spread', 0):>6.1f}%")
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    '''Print the change of every function's (median) mean call time, returns the names of the regressions.'''
+    regressions = []
+    for name, stats in report.items():
+        if name not in baseline or not baseline[name]['mean_ns']:
+            continue
+        change = (stats['mean_ns'] / baseline[name]['mean_ns'] - 1) * 100
+        regression = change > threshold
+        if regression:
+            regressions.append(name)
+        print(f"{name:<28} mean {baseline[name]['mean_ns']:>8.0f} -> {stats['mean_ns']:>8.0f} ns ({change:+.1f}%, "
+              f"spread {baseline[name].get('spread', 0):.1f}% / {stats.get('spread', 0):.1f}%){' REGRESSION' if regression else ''}")
+    return regressions
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def save_baseline(reports, path=BASELINE_FILE):
+    '''reports: {workload name: report}, the other workloads of the file are kept.'''
+    baselines = load_baseline(path)
+    baselines.update(reports)
+    with open(path, 'w') as file:
+        json.dump(baselines, file, indent=1)
+
+
+def add_arguments(parser):
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='regression threshold in percent')
+    parser.add_argument('--repeat', type=int, default=REPEATS, help='runs of the workload')
+
+def finish(workload, report, args):
+    '''Print the report and compare it with the baseline (or save it). Returns the exit code of the run.'''
+    print_report(report)
+    if args.save_baseline:
+        save_baseline({workload: report}, args.baseline)
+        print(f"Baseline '{workload}' saved to {args.baseline}")
+        return 0
+    baseline = load_baseline(args.baseline).get(workload)
+    if baseline is None:
+        print(f"No baseline '{workload}' in {args.baseline} (run with --save-baseline)")
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def run_workload():
+    '''Perft of the start position and fixed depth searches.'''
+    # imported here, the perft module imports this one for --instrument
+    from src.chess_tests.perft import count_positions
+    count_positions(Board(), PERFT_DEPTH, check=False)
+    engine = Engine(Board(), use_opening_book=False, use_tablebase=False)
+    engine.search_info.unsubscribe(print_search_info)
+    for fen in SEARCH_POSITIONS:
+        engine.new_game(fen)
+        engine.iterative_deepening(SearchLimits(depth=SEARCH_DEPTH))
+
+def main():
+    parser = argparse.ArgumentParser(description='Call counts and times of the engine hot path, compared with a baseline')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    report = profile(run_workload, args.repeat)
+    print(f"Workload ran {args.repeat} times in {time.time() - start_time:.1f} sec")
+    sys.exit(finish('engine', report, args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import multiprocessing
+import queue
+import struct
+import threading
+from multiprocessing import shared_memory
+from src.chess.board import Board, STARTING_FEN
+from src.chess.engine import Engine, SearchLimits, TT_CAPACITY
+from src.chess.search_info import SearchInfo, SearchInfoStream, print_search_info
+
+'''
+Lazy SMP: several worker processes run the normal Engine search on the same position and share
+one transposition table in shared memory. The workers start at different depths, so they fill the
+table with different parts of the tree and speed each other up. The main process keeps the result
+of the deepest completed iteration.
+
+Processes are used instead of threads because the search is pure python and holds the GIL.
+'''
+
+ENTRY_SIZE = 16 # bytes, two 64 bit words per entry
+
+RESULT_POLL_INTERVAL = 0.05 # seconds between checks of the stop flag while waiting for results
+
+HASHFULL_SAMPLE = 1000 # entries checked to estimate how full the table is
+
+class SharedTranspositionTable:
+    '''Transposition table in shared memory with the same interface as engine.TranspositionTable.
+
+    Each entry is two 64 bit words: data and key ^ data. A reader only accepts an entry if the two words
+    xor to its key, so an entry torn by two processes writing at the same time is just a miss and
+    no locks are needed.
+
+    data layout: score (32 bit float) | depth (8 bits) | flag (2 bits) | encoded best move (16 bits)
+    '''
+    def __init__(self, capacity = TT_CAPACITY, name = None):
+        self.capacity = capacity
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=name is None, size=capacity * ENTRY_SIZE)
+        self.words = self.shared_memory.buf.cast('Q')
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def get(self, key):
+        index = (key % self.capacity) * 2
+        data = self.words[index]
+        if data ^ self.words[index + 1] != key:
+            return None
+
+        score = struct.unpack('<f', struct.pack('<I', data & 0xFFFFFFFF))[0]
+        depth = (data >> 32) & 0xFF
+        flag = (data >> 40) & 0b11
+        move = (data >> 42) & 0xFFFF
+        return depth, score, flag, move
+
+    def put(self, key, value):
+        depth, score, flag, move = value
+        score_bits = struct.unpack('<I', struct.pack('<f', score))[0]
+        data = score_bits | min(depth, 255) << 32 | flag << 40 | move << 42
+
+        index = (key % self.capacity) * 2
+        self.words[index] = data
+        self.words[index + 1] = key ^ data
+
+    def clear(self):
+        self.shared_memory.buf[:] = bytes(self.capacity * ENTRY_SIZE)
+
+    def __len__(self):
+        return sum(1 for index in range(0, self.capacity * 2, 2) if self.words[index] or self.words[index + 1])
+
+    def hashfull(self):
+        '''Permille of the table in use, estimated from the first entries (counting all of them is slow).'''
+        sample = min(HASHFULL_SAMPLE, self.capacity)
+        used = sum(1 for index in range(0, sample * 2, 2) if self.words[index] or self.words[index + 1])
+        return used * 1000 // sample
+
+    def close(self):
+        self.words.release()
+        self.shared_memory.close()
+
+    def unlink(self):
+        self.shared_memory.unlink()
+
+
+def search_worker(worker_id, tt_name, tt_capacity, engine_settings, job_queue, result_queue, stop_event):
+    '''Worker process: run a search for every job until None is received.'''
+    transposition_table = SharedTranspositionTable(tt_capacity, name=tt_name)
+    engine = Engine(Board(), **engine_settings)
+    engine.transposition_table = transposition_table
+    engine.shared_stop_event = stop_event
+    # forward the search info to the main process instead of logging it, with the last completed depth:
+    # the info of a stopped iteration has the depth it was searching
+    engine.search_info.unsubscribe(print_search_info)
+    engine.search_info.subscribe(lambda info: result_queue.put((worker_id, info, engine.depth_reached)))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        # the game's moves are replayed so the worker sees repetitions (only the new moves if it's the same game)
+        fen, moves, limits, start_depth = job
+        engine.set_position(fen, moves)
+        engine.iterative_deepening(limits, start_depth)
+
+    transposition_table.close()
+
+
+class LazySMPSearch:
+    '''Parallel search with the same interface as Engine (new_game, set_position, update_board, set_time_limit, prepare_search,
+    iterative_deepening, stop, ponderhit, search_info).'''
+    def __init__(self, board: Board, threads: int = None, time_limit_ms: int = 25000, tt_capacity: int = TT_CAPACITY, **engine_settings):
+        self.board = board.__copy__()
+        self.position_fen = self.board.create_fen()
+        self.position_moves = []
+        self.threads = threads if threads is not None else multiprocessing.cpu_count()
+        self.time_limit_ms = time_limit_ms
+
+        self.transposition_table = SharedTranspositionTable(tt_capacity)
+        self.stop_event = multiprocessing.Event()
+        self.result_queue = multiprocessing.Queue()
+
+        self.job_queues = []
+        self.workers = []
+        for worker_id in range(self.threads):
+            job_queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=search_worker,
+                args=(worker_id, self.transposition_table.name, tt_capacity, engine_settings, job_queue, self.result_queue, self.stop_event),
+                daemon=True)
+            worker.start()
+            self.job_queues.append(job_queue)
+            self.workers.append(worker)
+
+        self.depth_reached = 0
+        self.limits = SearchLimits(time_ms=time_limit_ms)
+        self.ponderhit_timer = None
+        self.search_info = SearchInfoStream()
+        self.search_info.subscribe(print_search_info)
+
+    def new_game(self, fen=STARTING_FEN):
+        '''Start a new game: the shared transposition table is cleared.'''
+        self.transposition_table.clear()
+        self.set_position(fen)
+
+    def set_position(self, fen, moves=()):
+        '''Set the position of a game: the fen and the moves played from it (the workers replay them, see Engine.set_position).'''
+        self.board = Board(fen)
+        self.position_fen = fen
+        self.position_moves = list(moves)
+        for move in self.position_moves:
+            self.board.make_move(move)
+
+    def update_board(self, board: Board):
+        '''Used to sync the search's board with the actual board, the moves of its game are kept for repetitions.'''
+        start = board.__copy__()
+        while start.undo_stack:
+            start.undo_move()
+        self.set_position(start.create_fen(), [move for move, _, _ in board.undo_stack])
+
+    def set_time_limit(self, time_limit_ms: int):
+        self.time_limit_ms = time_limit_ms
+
+    def stop(self):
+        '''Ask all workers to stop, the best result so far is kept.'''
+        self.stop_event.set()
+
+    def prepare_search(self):
+        '''Clear the stop of the last search (see Engine.prepare_search), the first worker to finish sets it.'''
+        self.stop_event.clear()
+
+    def ponderhit(self, time_limit_ms: int = None):
+        '''The expected move was played. The workers keep pondering (no time limit), so the search is
+        stopped from here once the time limit has passed.'''
+        time_limit_ms = time_limit_ms if time_limit_ms is not None else self.limits.time_ms
+        if time_limit_ms is None:
+            return
+        self.ponderhit_timer = threading.Timer(time_limit_ms / 1000, self.stop_event.set)
+        self.ponderhit_timer.daemon = True
+        self.ponderhit_timer.start()
+
+    def iterative_deepening(self, limits: SearchLimits = None):
+        '''Search the position on all workers, publish the deepest result so far and return the final SearchInfo.'''
+        limits = limits if limits is not None else SearchLimits(time_ms=self.time_limit_ms)
+        self.limits = limits
+        for worker_id, job_queue in enumerate(self.job_queues):
+            # half of the workers start one ply deeper
+            job_queue.put((self.position_fen, self.position_moves, limits, 1 + worker_id % 2))
+
+        best_info = None # of the deepest completed iteration
+        partial_info = None # of the deepest stopped iteration, used if no worker completed a depth
+        nodes = {} # per worker
+        finished_workers = set()
+        while len(finished_workers) < self.threads:
+            try:
+                worker_id, info, depth_reached = self.result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                # a worker that died (killed, out of memory) never sends its final info
+                for worker_id, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        finished_workers.add(worker_id)
+                continue
+
+            nodes[worker_id] = info.nodes
+            if info.final:
+                finished_workers.add(worker_id)
+                # the first worker to finish (limits, mate found, depth limit) ends the search for all
+                self.stop_event.set()
+
+            if info.best_move is None:
+                continue
+            if info.depth > depth_reached:
+                if partial_info is None or info.depth > partial_info.depth:
+                    partial_info = info
+            elif best_info is None or info.depth > best_info.depth:
+                best_info = info
+                if not info.final:
+                    self.search_info.publish(self.combine_info(info, nodes))
+
+        self.depth_reached = best_info.depth if best_info is not None else 0
+        if best_info is None:
+            best_info = partial_info if partial_info is not None else SearchInfo()
+        final_info = self.combine_info(best_info, nodes)
+        final_info.final = True
+        if self.ponderhit_timer is not None:
+            self.ponderhit_timer.cancel()
+            self.ponderhit_timer = None
+        self.search_info.publish(final_info)
+        return final_info
+
+    def combine_info(self, info: SearchInfo, nodes: dict):
+        '''The info of one worker with the node count and speed of all workers.'''
+        total_nodes = sum(nodes.values())
+        return SearchInfo(
+            depth=info.depth,
+            seldepth=info.seldepth,
+            score=info.score,
+            pv=info.pv,
+            nodes=total_nodes,
+            nps=total_nodes * 1000 // max(info.time_ms, 1),
+            hashfull=self.transposition_table.hashfull(),
+            time_ms=info.time_ms)
+
+    def close(self):
+        '''Shut down the worker processes and free the shared transposition table.'''
+        for job_queue in self.job_queues:
+            job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.transposition_table.close()
+        self.transposition_table.unlink()
@@ -83,6 +83,7 @@ class ChessSettingsMenu:
         # read settings.json
         with open('src\chess\settings.json', 'r') as file:
             settings = json.load(file)
+        self.settings = settings
 
         self.sliders_data = {
             'difficulty': {
@@ -210,6 +211,10 @@ class ChessSettingsMenu:
             'time_increment': self.sliders[9].get_value(),
             'human_player': True # TODO: add a setting for this
         }
+        # the settings without a slider keep their values
+        for name in ('ponder', 'multi_pv', 'analysis_cache'):
+            if name in self.settings:
+                settings[name] = self.settings[name]
 
         with open('src\chess\settings.json', 'w') as file:
             json.dump(settings, file)
@@ -0,0 +1,117 @@
+from src.chess.board import Board, Piece
+
+'''
+Conversions between the engine's squares and moves and text notation.
+Squares are numbered 0 (a1) to 63 (h8), moves are the board's 7-tuples.
+'''
+
+FILES = 'abcdefgh'
+
+PROMOTION_CHARS = {
+    Piece.knight: 'n',
+    Piece.bishop: 'b',
+    Piece.rook: 'r',
+    Piece.queen: 'q',
+}
+
+def square_to_name(square):
+    '''0 -> 'a1', 63 -> 'h8' '''
+    return FILES[square % 8] + str(square // 8 + 1)
+
+def name_to_square(name):
+    ''''a1' -> 0, 'h8' -> 63'''
+    return FILES.index(name[0]) + 8 * (int(name[1]) - 1)
+
+def move_to_uci(move):
+    '''Long algebraic notation used by UCI, e.g. e2e4, e1g1 (castling) or e7e8q. None -> 0000 (null move)'''
+    if move is None:
+        return '0000'
+    start, end, start_piece, captured_piece, promotion_piece, castling, en_passant = move
+    promotion = PROMOTION_CHARS[Piece.get_type(promotion_piece)] if promotion_piece else ''
+    return square_to_name(start) + square_to_name(end) + promotion
+
+def uci_to_move(board: Board, text):
+    '''Returns the legal move of the board written in UCI notation, or None if there is no such move'''
+    text = text.strip().lower()
+    for move in board.generate_legal_moves():
+        if move_to_uci(move) == text:
+            return move
+    return None
+
+SAN_PIECES = {
+    'N': Piece.knight,
+    'B': Piece.bishop,
+    'R': Piece.rook,
+    'Q': Piece.queen,
+    'K': Piece.king,
+}
+
+def san_to_move(board: Board, san):
+    '''Returns the legal move of the board written in standard algebraic notation (e.g. Nf3, exd5, O-O, e8=Q+),
+    or None if there is no such move'''
+    san = san.strip().rstrip('+#!?')
+    moves = board.generate_legal_moves()
+
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        long_castle = len(san) == 5
+        for move in moves:
+            start, end = move[0], move[1]
+            if move[5] and (end < start) == long_castle:
+                return move
+        return None
+
+    promotion_type = 0
+    if '=' in san:
+        san, promotion = san.split('=')
+        promotion_type = SAN_PIECES[promotion[0].upper()]
+
+    piece_type = SAN_PIECES.get(san[0], Piece.pawn)
+    if piece_type != Piece.pawn:
+        san = san[1:]
+    san = san.replace('x', '').replace('-', '')
+    end = name_to_square(san[-2:])
+    disambiguation = san[:-2] # file, rank or both
+
+    for move in moves:
+        start, move_end, start_piece, captured_piece, promotion_piece, castling, en_passant = move
+        if move_end != end or Piece.get_type(start_piece) != piece_type:
+            continue
+        if Piece.get_type(promotion_piece) != promotion_type:
+            continue
+        start_name = square_to_name(start)
+        if all(char in start_name for char in disambiguation):
+            return move
+    return None
+
+def move_to_san(board: Board, move):
+    '''Standard algebraic notation of a legal move of the board, e.g. Nbd7, exd5, O-O-O, e8=Q+ or Qh4#'''
+    start, end, start_piece, captured_piece, promotion_piece, castling, en_passant = move
+    piece_type = Piece.get_type(start_piece)
+
+    if castling:
+        san = 'O-O-O' if end < start else 'O-O'
+    elif piece_type == Piece.pawn:
+        san = FILES[start % 8] + 'x' if captured_piece or en_passant else ''
+        san += square_to_name(end)
+        if promotion_piece:
+            san += '=' + PROMOTION_CHARS[Piece.get_type(promotion_piece)].upper()
+    else:
+        san = Piece.get_char_from_piece(Piece.white | piece_type).upper()
+        # other pieces of the same type that can move to the same square
+        others = [other[0] for other in board.generate_legal_moves()
+                  if other[1] == end and other[2] == start_piece and other[0] != start]
+        if others:
+            start_name = square_to_name(start)
+            if all(other % 8 != start % 8 for other in others):
+                san += start_name[0]
+            elif all(other // 8 != start // 8 for other in others):
+                san += start_name[1]
+            else:
+                san += start_name
+        san += ('x' if captured_piece else '') + square_to_name(end)
+
+    board.make_move(move)
+    if board.is_check(board.white_to_move):
+        san += '#' if not board.has_legal_moves() else '+'
+    board.undo_move()
+    return san
@@ -0,0 +1,167 @@
+import json
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+from src.chess.board import Board, encode_move, decode_move
+from src.chess.notation import san_to_move, uci_to_move
+
+'''
+Opening book: a sorted binary file of (zobrist key, encoded move, weight) records.
+The engine looks up its position with a binary search on the memory-mapped file instead of searching.
+
+The book is compiled from a JSON file ({name: "e2e4 e7e5 ..."} lines in UCI notation) or a PGN file:
+    python -m src.chess.opening_book src/chess/openings.json
+The keys depend on the board's zobrist keys (ZOBRIST_SEED), so the book has to be compiled again if they change.
+'''
+
+OPENINGS_FILE = 'src/chess/openings.json'
+OPENING_BOOK_FILE = 'src/chess/opening_book.bin'
+
+RECORD = struct.Struct('<QHH') # zobrist key, encoded move, weight
+MAX_BOOK_PLY = 12 # positions deeper than this are not added to the book
+MAX_WEIGHT = 0xFFFF
+
+PGN_RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+def read_json_lines(path):
+    '''Opening lines of a JSON file as lists of UCI moves.'''
+    with open(path, 'r') as file:
+        openings = json.load(file)
+    lines = openings.values() if isinstance(openings, dict) else openings
+    return [('uci', line.split()) for line in lines]
+
+def read_pgn_lines(path):
+    '''Opening lines of a PGN file as lists of SAN moves (tags, comments, variations and results are skipped).'''
+    lines = []
+    movetext = []
+    with open(path, 'r') as file:
+        for row in file:
+            row = row.strip()
+            if row.startswith('['):
+                if movetext:
+                    lines.append(('san', movetext))
+                    movetext = []
+                continue
+            movetext.extend(row.split())
+    if movetext:
+        lines.append(('san', movetext))
+
+    cleaned = []
+    for notation, tokens in lines:
+        moves = []
+        depth = 0 # inside comments or variations
+        for token in tokens:
+            depth += token.count('(') + token.count('{')
+            # move numbers can be written together with the move (1.e4) or alone (1. e4, 1...)
+            token = re.sub(r'^\d+\.+', '', token)
+            if depth == 0 and token and token not in PGN_RESULTS:
+                moves.append(token)
+            depth -= token.count(')') + token.count('}')
+        cleaned.append((notation, moves))
+    return cleaned
+
+def compile_book(lines, max_ply=MAX_BOOK_PLY):
+    '''Returns the sorted book records of the opening lines: a move's weight is the number of lines playing it.'''
+    weights = {}
+    for notation, moves in lines:
+        board = Board()
+        for text in moves[:max_ply]:
+            move = uci_to_move(board, text) if notation == 'uci' else san_to_move(board, text)
+            if move is None:
+                print(f"Illegal move {text} in line {' '.join(moves)}")
+                break
+            record = (board.zobrist_key, encode_move(move))
+            weights[record] = min(weights.get(record, 0) + 1, MAX_WEIGHT)
+            board.make_move(move)
+
+    return sorted((key, move, weight) for (key, move), weight in weights.items())
+
+def write_book(records, path=OPENING_BOOK_FILE):
+    with open(path, 'wb') as file:
+        for record in records:
+            file.write(RECORD.pack(*record))
+
+
+class OpeningBook:
+    '''Read-only, memory-mapped opening book.'''
+    def __init__(self, path=OPENING_BOOK_FILE):
+        self.file = open(path, 'rb')
+        self.size = os.path.getsize(path) // RECORD.size
+        # an empty file can't be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def key_at(self, index):
+        return RECORD.unpack_from(self.data, index * RECORD.size)[0]
+
+    def lower_bound(self, key):
+        '''Index of the first record with a key >= key.'''
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_entries(self, key):
+        '''(encoded move, weight) of every book move of the position.'''
+        entries = []
+        index = self.lower_bound(key)
+        while index < self.size:
+            entry_key, move, weight = RECORD.unpack_from(self.data, index * RECORD.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+            index += 1
+        return entries
+
+    def get_moves(self, board: Board):
+        '''(move, weight) of the legal book moves of the board.'''
+        entries = self.get_entries(board.zobrist_key)
+        if not entries:
+            return []
+        legal_moves = board.generate_legal_moves()
+        moves = []
+        for code, weight in entries:
+            # a key collision could point to a move that is not legal here
+            move = decode_move(legal_moves, code)
+            if move is not None:
+                moves.append((move, weight))
+        return moves
+
+    def choose_move(self, board: Board):
+        '''A book move picked at random by weight, or None if the position is not in the book.'''
+        moves = self.get_moves(board)
+        if not moves:
+            return None
+        return random.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+
+def load_opening_book(path=OPENING_BOOK_FILE):
+    '''The opening book, or None if it has not been compiled.'''
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else OPENINGS_FILE
+    destination = sys.argv[2] if len(sys.argv) > 2 else OPENING_BOOK_FILE
+    lines = read_pgn_lines(source) if source.endswith('.pgn') else read_json_lines(source)
+    records = compile_book(lines)
+    write_book(records, destination)
+    print(f"{len(lines)} lines, {len(records)} positions and moves written to {destination}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import re
+from src.chess.board import Board, STARTING_FEN
+from src.chess.notation import move_to_san, san_to_move
+
+'''
+Reading and writing games in PGN (portable game notation).
+A game is its tags ({name: value}), its moves in SAN and its result. Games are read one at a time from a file,
+so large collections can be streamed. Comments, variations and numeric annotation glyphs are skipped.
+'''
+
+PGN_RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# the seven tag roster comes first in this order, other tags follow
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, variations and glyphs are removed before the moves are split
+COMMENT_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*')
+GLYPH_PATTERN = re.compile(r'\$\d+')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+')
+LINE_WIDTH = 80
+
+def remove_variations(movetext):
+    '''Movetext without the (nested) variations in parentheses.'''
+    depth = 0
+    kept = []
+    for char in movetext:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            kept.append(char)
+    return ''.join(kept)
+
+def parse_movetext(movetext):
+    '''(SAN moves, result) of the movetext of a game.'''
+    movetext = remove_variations(COMMENT_PATTERN.sub(' ', movetext))
+    movetext = GLYPH_PATTERN.sub(' ', movetext)
+    moves = []
+    result = '*'
+    for token in movetext.split():
+        # move numbers can be written together with the move (1.e4) or alone (1. e4, 1...)
+        token = MOVE_NUMBER_PATTERN.sub('', token)
+        if token in PGN_RESULTS:
+            result = token
+        elif token and token != 'e.p.':
+            moves.append(token)
+    return moves, result
+
+def unescape_tag(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+def finish_game(tags, movetext):
+    moves, result = parse_movetext(''.join(movetext))
+    # a game without a result in its movetext keeps the result of its tags
+    return tags, moves, tags.get('Result', result) if result == '*' else result
+
+def read_games(file):
+    '''Yields (tags, SAN moves, result) of every game of an open PGN file, one game at a time.'''
+    tags = {}
+    movetext = []
+    for line in file:
+        stripped = line.strip()
+        if stripped.startswith('%'):
+            continue # escaped line
+        if stripped.startswith('['):
+            # a tag after movetext starts the next game
+            if any(text.strip() for text in movetext):
+                yield finish_game(tags, movetext)
+                tags = {}
+                movetext = []
+            match = TAG_PATTERN.match(stripped)
+            if match:
+                tags[match.group(1)] = unescape_tag(match.group(2))
+            continue
+        movetext.append(line)
+    if tags or any(text.strip() for text in movetext):
+        yield finish_game(tags, movetext)
+
+def read_pgn_file(path):
+    '''Yields (tags, SAN moves, result) of every game of a PGN file.'''
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        yield from read_games(file)
+
+def start_board(tags):
+    '''Board of the start position of a game (the FEN tag, or the standard start position).'''
+    return Board(tags.get('FEN', STARTING_FEN))
+
+def san_moves_to_moves(tags, san_moves):
+    '''The board's moves of the SAN moves of a game. Stops at the first illegal move and returns
+    (moves, illegal SAN or None).'''
+    board = start_board(tags)
+    moves = []
+    for san in san_moves:
+        move = san_to_move(board, san)
+        if move is None:
+            return moves, san
+        moves.append(move)
+        board.make_move(move)
+    return moves, None
+
+def escape_tag(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+def format_game(tags, moves, result='*', start_fen=STARTING_FEN):
+    '''PGN text of a game of the board's moves played from start_fen.'''
+    tags = dict(tags)
+    tags['Result'] = result
+    if start_fen != STARTING_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = start_fen
+    lines = []
+    for name in SEVEN_TAG_ROSTER:
+        lines.append(f'[{name} "{escape_tag(tags.get(name, "?"))}"]')
+    for name, value in tags.items():
+        if name not in SEVEN_TAG_ROSTER:
+            lines.append(f'[{name} "{escape_tag(value)}"]')
+    lines.append('')
+
+    board = Board(start_fen)
+    fullmove = int(start_fen.split()[5]) if len(start_fen.split()) > 5 else 1
+    tokens = []
+    for index, move in enumerate(moves):
+        if board.white_to_move:
+            tokens.append(f'{fullmove}.')
+        elif index == 0:
+            tokens.append(f'{fullmove}...')
+        tokens.append(move_to_san(board, move))
+        board.make_move(move)
+        if board.white_to_move:
+            fullmove += 1
+    tokens.append(result)
+
+    # movetext lines are wrapped
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,76 @@
+import threading
+
+'''
+Search progress is published as SearchInfo objects on a SearchInfoStream. Subscribers (eval bar, engine
+suggestion arrow, logging, the engine host and lazy SMP workers) are called with every info instead of
+polling a shared list.
+'''
+
+class SearchInfo:
+    '''Progress of a search after a finished (or stopped) depth. The last info of a search has final=True.
+    A multi-PV search publishes one info per line (multipv 1 is the best line); the final info has all
+    lines of the last depth as (score, pv) tuples.'''
+    def __init__(self, depth: int = 0, seldepth: int = 0, score: float = None, pv: list = None,
+                 nodes: int = 0, nps: int = 0, hashfull: int = 0, time_ms: int = 0, final: bool = False,
+                 multipv: int = 1, lines: list = None):
+        self.depth = depth
+        self.seldepth = seldepth
+        self.score = score # None if the move was not searched (only one legal move)
+        self.pv = pv if pv is not None else []
+        self.nodes = nodes
+        self.nps = nps
+        self.hashfull = hashfull # permille of the transposition table in use
+        self.time_ms = time_ms
+        self.final = final
+        self.multipv = multipv
+        self.lines = lines if lines is not None else []
+
+    @property
+    def best_move(self):
+        '''None if there are no legal moves.'''
+        return self.pv[0] if self.pv else None
+
+    @property
+    def ponder_move(self):
+        '''Expected reply to the best move.'''
+        return self.pv[1] if len(self.pv) > 1 else None
+
+    def __repr__(self):
+        return (f"SearchInfo(depth={self.depth}, seldepth={self.seldepth}, score={self.score}, pv={self.pv}, "
+                f"nodes={self.nodes}, nps={self.nps}, hashfull={self.hashfull}, time_ms={self.time_ms}, final={self.final}, "
+                f"multipv={self.multipv}, lines={self.lines})")
+
+
+class SearchInfoStream:
+    '''Thread-safe publisher of SearchInfo. A subscriber is any callable taking a SearchInfo,
+    e.g. a function, a bound method or the put method of a (multiprocessing) queue.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def publish(self, info: SearchInfo):
+        with self.lock:
+            subscribers = self.subscribers.copy()
+        # called outside of the lock so a subscriber can (un)subscribe
+        for callback in subscribers:
+            callback(info)
+
+
+def print_search_info(info: SearchInfo):
+    '''Logging subscriber.'''
+    if info.final:
+        print(f"Best move: {info.best_move}, Eval: {info.score}, Depth: {info.depth}")
+    else:
+        line = f" (line {info.multipv})" if info.multipv > 1 else ""
+        print(f"Depth: {info.depth}{line} (seldepth {info.seldepth}), Best move: {info.best_move}, Best eval: {info.score}, "
+              f"PV: {info.pv}, Nodes: {info.nodes} ({info.nps} nps), Hash: {info.hashfull / 10:.1f}%")
@@ -0,0 +1,158 @@
+import csv
+import json
+import os
+import time
+
+'''
+Statistics of a single search (Engine.stats), for comparing profiling runs:
+node counts, transposition table use, move ordering quality (beta cutoffs on the first move),
+the effective branching factor and where the time went (per depth and move generation, ordering and evaluation).
+A search can be exported as one JSON line or as CSV rows (one per depth), both append to their file
+so the runs of a profile end up side by side.
+'''
+
+# columns of the CSV export: the search totals are repeated on every depth row
+CSV_FIELDS = ['label', 'timestamp', 'depth', 'depth_nodes', 'depth_time_ms', 'depth_branching_factor', 'score',
+              'nodes', 'qnodes', 'nps', 'time_ms', 'tt_probes', 'tt_hits', 'tt_cutoffs', 'tt_hit_rate',
+              'beta_cutoffs', 'first_move_cutoffs', 'first_move_cutoff_rate', 'effective_branching_factor',
+              'positions_evaluated', 'lazy_eval_cutoffs', 'move_generations',
+              'movegen_time_ms', 'ordering_time_ms', 'eval_time_ms']
+
+class SearchStats:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.time_ms = 0 # set by finish()
+        self.nodes = 0 # minimax nodes, set by finish()
+        self.qnodes = 0 # quiescence nodes
+
+        # transposition table: lookups, lookups that found an entry and entries that ended the search of a node
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+
+        # a good move ordering has most beta cutoffs on the first move searched
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+
+        self.positions_evaluated = 0
+        self.lazy_eval_cutoffs = 0
+        self.move_generations = 0
+
+        # time split (seconds)
+        self.movegen_time = 0.0 # generate_legal_moves
+        self.ordering_time = 0.0 # order_moves
+        self.eval_time = 0.0 # evaluate
+
+        self.depths = [] # {depth, nodes, time_ms, score} of every finished (or stopped) iteration
+        self.last_depth_nodes = 0
+        self.last_depth_time = self.start_time
+
+    def record_depth(self, depth, nodes, score):
+        '''An iteration finished: nodes is the node count of the whole search so far.'''
+        now = time.perf_counter()
+        self.depths.append({
+            'depth': depth,
+            'nodes': nodes - self.last_depth_nodes,
+            'time_ms': round((now - self.last_depth_time) * 1000, 3),
+            'score': score,
+        })
+        self.last_depth_nodes = nodes
+        self.last_depth_time = now
+
+    def finish(self, nodes):
+        self.nodes = nodes
+        self.time_ms = round((time.perf_counter() - self.start_time) * 1000, 3)
+
+    @property
+    def nps(self):
+        return int(self.nodes * 1000 / max(self.time_ms, 1e-6))
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0
+
+    @property
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0
+
+    @property
+    def lazy_eval_cutoff_rate(self):
+        return self.lazy_eval_cutoffs / self.positions_evaluated if self.positions_evaluated else 0
+
+    def depth_branching_factors(self):
+        '''Nodes of every iteration divided by the nodes of the one before (None for the first).'''
+        factors = []
+        for index, depth in enumerate(self.depths):
+            previous = self.depths[index - 1]['nodes'] if index else 0
+            factors.append(round(depth['nodes'] / previous, 3) if previous else None)
+        return factors
+
+    @property
+    def effective_branching_factor(self):
+        '''Growth of the iteration node counts over the search (geometric mean of the branching factors).'''
+        factors = [factor for factor in self.depth_branching_factors() if factor]
+        if not factors:
+            return None
+        product = 1.0
+        for factor in factors:
+            product *= factor
+        return round(product ** (1 / len(factors)), 3)
+
+    def to_dict(self, label=None):
+        return {
+            'label': label,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'nodes': self.nodes,
+            'qnodes': self.qnodes,
+            'nps': self.nps,
+            'time_ms': self.time_ms,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_cutoffs': self.tt_cutoffs,
+            'tt_hit_rate': round(self.tt_hit_rate, 4),
+            'beta_cutoffs': self.beta_cutoffs,
+            'first_move_cutoffs': self.first_move_cutoffs,
+            'first_move_cutoff_rate': round(self.first_move_cutoff_rate, 4),
+            'effective_branching_factor': self.effective_branching_factor,
+            'positions_evaluated': self.positions_evaluated,
+            'lazy_eval_cutoffs': self.lazy_eval_cutoffs,
+            'move_generations': self.move_generations,
+            'movegen_time_ms': round(self.movegen_time * 1000, 3),
+            'ordering_time_ms': round(self.ordering_time * 1000, 3),
+            'eval_time_ms': round(self.eval_time * 1000, 3),
+            'depths': self.depths,
+        }
+
+    def export_json(self, path, label=None):
+        '''Append the search as one JSON line.'''
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.to_dict(label)) + '\n')
+
+    def export_csv(self, path, label=None):
+        '''Append one row per depth (the header is written to a new file).'''
+        totals = self.to_dict(label)
+        totals.pop('depths')
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'a', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+            if write_header:
+                writer.writeheader()
+            for depth, factor in zip(self.depths, self.depth_branching_factors()):
+                writer.writerow({
+                    **totals,
+                    'depth': depth['depth'],
+                    'depth_nodes': depth['nodes'],
+                    'depth_time_ms': depth['time_ms'],
+                    'depth_branching_factor': factor,
+                    'score': depth['score'],
+                })
+
+    def summary(self):
+        return (f"Time taken: {self.time_ms:.2f} ms, Nodes: {self.nodes} ({self.nps} nps), Quiescence nodes: {self.qnodes}, "
+                f"Positions evaluated: {self.positions_evaluated}, Move generations: {self.move_generations}\n"
+                f"TT probes: {self.tt_probes}, hits: {self.tt_hits} ({self.tt_hit_rate * 100:.1f}%), cutoffs: {self.tt_cutoffs}, "
+                f"Beta cutoffs on the first move: {self.first_move_cutoff_rate * 100:.1f}% of {self.beta_cutoffs}, "
+                f"EBF: {self.effective_branching_factor}\n"
+                f"Lazy eval cutoffs: {self.lazy_eval_cutoffs} ({self.lazy_eval_cutoff_rate * 100:.1f}% of evaluations), "
+                f"Time in move generation: {self.movegen_time * 1000:.1f} ms, ordering: {self.ordering_time * 1000:.1f} ms, "
+                f"evaluation: {self.eval_time * 1000:.1f} ms")
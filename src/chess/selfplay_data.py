@@ -0,0 +1,286 @@
+import argparse
+import contextlib
+import glob
+import mmap
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.chess.board import Board, Piece, encode_move, decode_move
+from src.chess.engine import Engine, SearchLimits, is_mate_score
+from src.chess.search_info import print_search_info
+
+'''
+Self-play training data: node limited engine games are played in a process pool and every position is written
+with its search score and the result of its game to shards of fixed-width 16 byte records (memory-mappable).
+
+Record: kind (1 byte), flags (1 byte), score (int16), move (uint16), ply (uint16), zobrist key (uint64).
+  KEYFRAME  a position given in full by the two BOARD records that follow it (first position of a game and
+            every KEYFRAME_INTERVAL plies, so a game can be decoded from any keyframe)
+  MOVE      the position after the move of the previous position record (positions are deltas within a game)
+  BOARD     30 bytes of a keyframe's board: occupancy bitboard, piece codes of the occupied squares (4 bits each),
+            castling rights and side to move, en passant square
+flags: game result from white's point of view (0 loss, 1 draw, 2 win) and SAMPLE_FLAG. A position is a sample
+unless its zobrist key was already sampled (deduplication over all shards of the directory) or it was not searched.
+score: search score in centipawns from white's point of view, mates are +-MATE_SCORE.
+move: the move played (board.encode_move).
+
+Run with: python -m src.chess.selfplay_data --games 1000 --nodes 2000
+'''
+
+SELFPLAY_DIR = 'src/chess/selfplay_data'
+SHARD_PATTERN = 'selfplay-{:05d}.bin'
+SHARD_RECORDS = 1 << 20 # records per shard (16 MB)
+
+RECORD = struct.Struct('<BBhHHQ')
+BOARD_RECORD = struct.Struct('<B15s')
+BOARD_DATA = struct.Struct('<Q16sBB4s') # occupancy, piece nibbles, castling | side to move, en passant square, spare
+
+KEYFRAME = 1
+MOVE = 2
+BOARD = 3
+
+RESULT_MASK = 0b11
+SAMPLE_FLAG = 0b100
+RESULT_LOSS = 0
+RESULT_DRAW = 1
+RESULT_WIN = 2
+
+MATE_SCORE = 32000
+KEYFRAME_INTERVAL = 32
+
+DEFAULT_NODES = 2000
+RANDOM_OPENING_PLIES = 8 # random moves at the start of every game, so that the games differ
+MAX_GAME_PLIES = 300 # the board has no 50 move rule, longer games are adjudicated as draws
+
+# 4 bit codes of the pieces in a keyframe
+PIECE_NIBBLES = [0] + [color | piece_type for color in (Piece.white, Piece.black) for piece_type in range(Piece.pawn, Piece.king + 1)]
+
+def encode_board(board: Board):
+    '''The two BOARD records of a keyframe.'''
+    occupancy = 0
+    nibbles = []
+    for square, piece in enumerate(board.board):
+        if piece:
+            occupancy |= 1 << square
+            nibbles.append(PIECE_NIBBLES.index(piece))
+    nibbles += [0] * (32 - len(nibbles))
+    packed = bytes(nibbles[index] | nibbles[index + 1] << 4 for index in range(0, 32, 2))
+    state = board.castling_rights | (board.white_to_move << 4)
+    data = BOARD_DATA.pack(occupancy, packed, state, board.en_passant_target_square, b'')
+    return BOARD_RECORD.pack(BOARD, data[:15]) + BOARD_RECORD.pack(BOARD, data[15:])
+
+def decode_board(data):
+    '''Board of the 32 bytes of two BOARD records.'''
+    occupancy, packed, state, en_passant, _ = BOARD_DATA.unpack(data[1:16] + data[17:32])
+    nibbles = []
+    for byte in packed:
+        nibbles += [byte & 0xF, byte >> 4]
+
+    board = Board()
+    board.board = [0] * 64
+    board.white_pieces = set()
+    board.black_pieces = set()
+    index = 0
+    for square in range(64):
+        if occupancy >> square & 1:
+            piece = PIECE_NIBBLES[nibbles[index]]
+            index += 1
+            board.board[square] = piece
+            if Piece.get_color(piece) == Piece.white:
+                board.white_pieces.add(square)
+            else:
+                board.black_pieces.add(square)
+            if piece == Piece.white | Piece.king:
+                board.white_king_square = square
+            elif piece == Piece.black | Piece.king:
+                board.black_king_square = square
+    board.castling_rights = state & 0xF
+    board.white_to_move = bool(state >> 4 & 1)
+    board.en_passant_target_square = en_passant
+    board.zobrist_key = board.compute_zobrist_key()
+    return board
+
+def clamp_score(score):
+    if score is None:
+        return 0
+    if is_mate_score(score):
+        return MATE_SCORE if score > 0 else -MATE_SCORE
+    return max(-MATE_SCORE + 1, min(MATE_SCORE - 1, round(score)))
+
+
+# one engine per worker process
+engine = None
+
+def init_worker():
+    global engine
+    engine = Engine(Board(), use_opening_book=False)
+    engine.search_info.unsubscribe(print_search_info)
+
+def play_game(seed, limits: SearchLimits):
+    '''Play one self-play game. Returns (fen of the first position, [(move, score, key, searched)], result).'''
+    rng = random.Random(seed)
+    board = Board()
+    for _ in range(RANDOM_OPENING_PLIES):
+        moves = board.generate_legal_moves()
+        if not moves:
+            break
+        board.make_move(rng.choice(moves))
+    # the game starts after the random moves (they are not samples)
+    board = Board(board.create_fen())
+    start_fen = board.create_fen()
+
+    engine.new_game(start_fen)
+    positions = []
+    # the engine prints statistics after every search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while not board.is_game_over() and len(positions) < MAX_GAME_PLIES:
+            key = board.zobrist_key
+            info = engine.iterative_deepening(limits)
+            if info.best_move is None:
+                break
+            positions.append((info.best_move, info.score, key, info.score is not None))
+            board.make_move(info.best_move)
+            # the engine keeps its tables and follows the game (its board has the game history for repetitions)
+            engine.play_move(info.best_move)
+
+    if board.is_checkmate():
+        result = RESULT_LOSS if board.white_to_move else RESULT_WIN
+    else:
+        result = RESULT_DRAW
+    return start_fen, positions, result
+
+
+def encode_game(start_fen, positions, result, seen_keys):
+    '''Records of a game. The keys of the new samples are added to seen_keys.'''
+    board = Board(start_fen)
+    records = []
+    for ply, (move, score, key, searched) in enumerate(positions):
+        flags = result
+        if searched and key not in seen_keys:
+            flags |= SAMPLE_FLAG
+            seen_keys.add(key)
+        kind = KEYFRAME if ply % KEYFRAME_INTERVAL == 0 else MOVE
+        records.append(RECORD.pack(kind, flags, clamp_score(score), encode_move(move), ply, key))
+        if kind == KEYFRAME:
+            records.append(encode_board(board))
+        board.make_move(move)
+    return b''.join(records)
+
+class ShardWriter:
+    '''Appends games to the shards of a directory, a new shard is started once a shard has max_records records.
+    A game is never split across shards.'''
+    def __init__(self, directory=SELFPLAY_DIR, max_records=SHARD_RECORDS):
+        self.directory = directory
+        self.max_records = max_records
+        os.makedirs(directory, exist_ok=True)
+        shards = shard_paths(directory)
+        self.shard_index = len(shards) - 1 if shards else 0
+        self.file = None
+        self.open_shard()
+
+    def open_shard(self):
+        self.path = os.path.join(self.directory, SHARD_PATTERN.format(self.shard_index))
+        self.file = open(self.path, 'ab')
+        self.records = self.file.tell() // RECORD.size
+
+    def write_game(self, data):
+        if self.records >= self.max_records:
+            self.file.close()
+            self.shard_index += 1
+            self.open_shard()
+        self.file.write(data)
+        self.file.flush()
+        self.records += len(data) // RECORD.size
+
+    def close(self):
+        self.file.close()
+
+def shard_paths(directory=SELFPLAY_DIR):
+    return sorted(glob.glob(os.path.join(directory, SHARD_PATTERN.replace('{:05d}', '*'))))
+
+
+def iter_records(path):
+    '''(kind, flags, score, move, ply, key, index) of every position record of a shard, read from a memory map.'''
+    with open(path, 'rb') as file:
+        if os.path.getsize(path) == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = 0
+            count = len(data) // RECORD.size
+            while index < count:
+                kind, flags, score, move, ply, key = RECORD.unpack_from(data, index * RECORD.size)
+                yield kind, flags, score, move, ply, key, index
+                index += 3 if kind == KEYFRAME else 1
+
+def read_sample_keys(directory=SELFPLAY_DIR):
+    '''Zobrist keys of the samples already written (for deduplication when generating more data).'''
+    keys = set()
+    for path in shard_paths(directory):
+        for kind, flags, score, move, ply, key, index in iter_records(path):
+            if flags & SAMPLE_FLAG:
+                keys.add(key)
+    return keys
+
+def iter_samples(path):
+    '''(board, score, result) of every sample of a shard; the boards are rebuilt from the keyframes and moves.
+    result is 1, 0.5 or 0 from white's point of view. The board is reused, copy it to keep it.'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    board = None
+    index = 0
+    count = len(data) // RECORD.size
+    while index < count:
+        kind, flags, score, move, ply, key = RECORD.unpack_from(data, index * RECORD.size)
+        if kind == KEYFRAME:
+            board = decode_board(data[(index + 1) * RECORD.size:(index + 3) * RECORD.size])
+            index += 3
+        else:
+            index += 1
+        if flags & SAMPLE_FLAG:
+            yield board, score, (flags & RESULT_MASK) / 2
+        # the next position record is the position after this move
+        board.make_move(decode_move(board.generate_legal_moves(), move))
+        # the move cache grows with every position
+        board.generated_moves.clear()
+
+def generate(games, limits: SearchLimits, directory=SELFPLAY_DIR, workers=None, seed=None, max_records=SHARD_RECORDS):
+    seen_keys = read_sample_keys(directory)
+    writer = ShardWriter(directory, max_records)
+    seed = seed if seed is not None else random.randrange(1 << 32)
+    print(f"{games} games with {limits}, {len(seen_keys)} samples already in {directory}")
+
+    start_time = time.time()
+    samples = positions = 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    try:
+        futures = [executor.submit(play_game, seed + game, limits) for game in range(games)]
+        for game, future in enumerate(as_completed(futures), start=1):
+            start_fen, game_positions, result = future.result()
+            known = len(seen_keys)
+            writer.write_game(encode_game(start_fen, game_positions, result, seen_keys))
+            samples += len(seen_keys) - known
+            positions += len(game_positions)
+            print(f"game {game}/{games}: {len(game_positions)} plies, result {result / 2}, "
+                  f"{samples}/{positions} positions sampled, shard {writer.path}")
+    except KeyboardInterrupt:
+        print("Interrupted, the finished games are saved")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    print(f"{samples} samples in {time.time() - start_time:.1f} sec")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate training data by self-play')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='node limit per move')
+    parser.add_argument('--output', default=SELFPLAY_DIR, help='directory of the shards')
+    parser.add_argument('--shard-records', type=int, default=SHARD_RECORDS, help='records per shard')
+    parser.add_argument('--workers', type=int, default=None, help='parallel games (default: number of cores)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    generate(args.games, SearchLimits(nodes=args.nodes), args.output, args.workers, args.seed, args.shard_records)
+
+if __name__ == "__main__":
+    main()
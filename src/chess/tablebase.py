@@ -0,0 +1,312 @@
+import mmap
+import os
+import sys
+import time
+from array import array
+from src.chess.board import Board, Piece
+
+'''
+Endgame tablebases for a king and up to two pieces against a lone king, built by retrograde analysis.
+
+A table stores one byte per position: 0 for a draw (or an illegal position), otherwise the distance
+to mate in plies + 1. Positions are indexed by side to move and the squares of the white king, the black
+king and the white pieces, so the strong side is always white in the table; positions where black
+is the strong side are probed with the board mirrored.
+
+Build the tables with: python -m src.chess.tablebase [KQK KRK KPK KBNK]
+KQK, KRK and KPK take under a minute each. KBNK has 64 times more positions, it takes about an hour
+and several GB of memory for the move lists.
+The tables are memory-mapped when probed and are not part of the repository.
+'''
+
+TABLEBASE_DIR = 'src/chess/tablebases'
+
+# white pieces of every table (besides the kings), in index order
+TABLES = {
+    'KQK': (Piece.queen,),
+    'KRK': (Piece.rook,),
+    'KPK': (Piece.pawn,),
+    'KBNK': (Piece.bishop, Piece.knight),
+}
+BUILD_ORDER = ('KQK', 'KRK', 'KPK', 'KBNK') # KPK needs KQK and KRK for promotions
+
+MAX_TABLEBASE_PIECES = 4 # kings included
+
+# score of a won tablebase position, minus the distance to mate so shorter mates are preferred
+TB_WIN_SCORE = 20000
+
+PIECE_CHARS = {
+    Piece.pawn: 'P',
+    Piece.knight: 'N',
+    Piece.bishop: 'B',
+    Piece.rook: 'R',
+    Piece.queen: 'Q',
+}
+
+UNRESOLVED = 0xFFFF # counter of a black position that can escape to a draw
+
+def table_size(pieces):
+    return 2 * 64 ** (2 + len(pieces))
+
+def position_index(white_to_move, white_king, black_king, squares):
+    index = 0 if white_to_move else 1
+    index = index * 64 + white_king
+    index = index * 64 + black_king
+    for square in squares:
+        index = index * 64 + square
+    return index
+
+def decode_index(index, piece_count):
+    squares = []
+    for _ in range(piece_count):
+        index, square = divmod(index, 64)
+        squares.append(square)
+    index, black_king = divmod(index, 64)
+    index, white_king = divmod(index, 64)
+    return index == 0, white_king, black_king, squares[::-1]
+
+def piece_squares(board: Board, pieces, white=True):
+    '''Squares of the pieces of one side in table order.'''
+    own_pieces = board.white_pieces if white else board.black_pieces
+    squares = []
+    for piece_type in pieces:
+        for square in own_pieces:
+            if Piece.get_type(board.board[square]) == piece_type and square not in squares:
+                squares.append(square)
+                break
+    return squares
+
+def board_index(board: Board, pieces):
+    return position_index(board.white_to_move, board.white_king_square, board.black_king_square, piece_squares(board, pieces))
+
+def set_position(board: Board, white_to_move, white_king, black_king, pieces, squares):
+    '''Set up the board without parsing a FEN (much faster when building tables).'''
+    board.board = [0] * 64
+    board.board[white_king] = Piece.white | Piece.king
+    board.board[black_king] = Piece.black | Piece.king
+    for piece_type, square in zip(pieces, squares):
+        board.board[square] = Piece.white | piece_type
+    board.white_king_square = white_king
+    board.black_king_square = black_king
+    board.white_pieces = {white_king, *squares}
+    board.black_pieces = {black_king}
+    board.white_to_move = white_to_move
+    board.castling_rights = 0
+    board.en_passant_target_square = 0
+    board.zobrist_key = board.compute_zobrist_key()
+    # the move cache would grow with every position
+    board.generated_moves.clear()
+
+def is_valid_position(board: Board, white_king, black_king, pieces, squares):
+    occupied = {white_king, black_king, *squares}
+    if len(occupied) != 2 + len(squares):
+        return False
+    if abs(white_king % 8 - black_king % 8) <= 1 and abs(white_king // 8 - black_king // 8) <= 1:
+        return False
+    for piece_type, square in zip(pieces, squares):
+        if piece_type == Piece.pawn and square // 8 in (0, 7):
+            return False
+    # the side that just moved can't be in check
+    return not board.is_check(not board.white_to_move)
+
+
+def build_table(name, tables):
+    '''Build one table. tables has the already built tables for promotions.'''
+    pieces = TABLES[name]
+    size = table_size(pieces)
+    board = Board()
+
+    # forward pass: successors of every position
+    edge_from = array('I')
+    edge_to = array('I')
+    counters = array('H', bytes(2 * (size // 2))) # unresolved moves of the black positions
+    seeds = {} # ply -> positions known to be decided at that distance to mate
+    start_time = time.time()
+
+    for index in range(size):
+        if index % 1000000 == 0:
+            print(f"{name}: {index}/{size} positions, {time.time() - start_time:.0f} sec")
+        white_to_move, white_king, black_king, squares = decode_index(index, len(pieces))
+        if len({white_king, black_king, *squares}) != 2 + len(squares):
+            continue
+        set_position(board, white_to_move, white_king, black_king, pieces, squares)
+        if not is_valid_position(board, white_king, black_king, pieces, squares):
+            continue
+
+        moves = board.generate_legal_moves()
+        if white_to_move:
+            for move in moves:
+                promotion_piece = move[4]
+                board.make_move(move)
+                if promotion_piece:
+                    # promotions leave the table, the result is in the table of the new piece
+                    promotion_name = 'K' + PIECE_CHARS[Piece.get_type(promotion_piece)] + 'K'
+                    if promotion_name in tables:
+                        value = tables[promotion_name][board_index(board, TABLES[promotion_name])]
+                        if value:
+                            seeds.setdefault(value, []).append(index)
+                else:
+                    edge_from.append(index)
+                    edge_to.append(board_index(board, pieces))
+                board.undo_move()
+        else:
+            if not moves:
+                if board.is_check(False):
+                    seeds.setdefault(0, []).append(index) # checkmate
+                continue # stalemate is a draw
+
+            counter = len(moves)
+            for move in moves:
+                if move[3]:
+                    # capturing a piece leads to a drawn ending
+                    counter = UNRESOLVED
+                    continue
+                board.make_move(move)
+                edge_from.append(index)
+                edge_to.append(board_index(board, pieces))
+                board.undo_move()
+            counters[index - size // 2] = counter
+
+    # predecessors of every position (compressed rows)
+    offsets = array('I', bytes(4 * (size + 1)))
+    for to in edge_to:
+        offsets[to + 1] += 1
+    for index in range(size):
+        offsets[index + 1] += offsets[index]
+    predecessors = array('I', bytes(4 * len(edge_to)))
+    fill = offsets[:-1]
+    for source, to in zip(edge_from, edge_to):
+        predecessors[fill[to]] = source
+        fill[to] += 1
+    del edge_from, edge_to, fill
+
+    # retrograde pass, in order of distance to mate
+    values = bytearray(size)
+    ply = 0
+    while seeds:
+        positions = seeds.pop(ply, [])
+        for index in positions:
+            if values[index]:
+                continue # already decided at a shorter distance
+            values[index] = ply + 1
+
+            for predecessor in predecessors[offsets[index]:offsets[index + 1]]:
+                if values[predecessor]:
+                    continue
+                if index >= size // 2:
+                    # black is mated in ply: white mates in ply + 1 from the predecessor
+                    seeds.setdefault(ply + 1, []).append(predecessor)
+                else:
+                    # black loses when every move loses, the last one found is the longest
+                    counter_index = predecessor - size // 2
+                    if counters[counter_index] != UNRESOLVED:
+                        counters[counter_index] -= 1
+                        if counters[counter_index] == 0:
+                            seeds.setdefault(ply + 1, []).append(predecessor)
+        ply += 1
+
+    print(f"{name}: {sum(1 for value in values if value)} won positions, longest mate {ply - 1} plies, {time.time() - start_time:.0f} sec")
+    return values
+
+def build_tables(names=BUILD_ORDER, directory=TABLEBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name in BUILD_ORDER:
+        path = os.path.join(directory, f'{name}.tb')
+        if name not in names:
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    tables[name] = file.read()
+            continue
+        tables[name] = build_table(name, tables)
+        with open(path, 'wb') as file:
+            file.write(tables[name])
+
+
+class Tablebase:
+    '''Memory-mapped tables of the tablebase directory.'''
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.files = []
+        self.tables = {} # name -> mmap
+        for name in TABLES:
+            path = os.path.join(directory, f'{name}.tb')
+            if os.path.exists(path) and os.path.getsize(path) == table_size(TABLES[name]):
+                file = open(path, 'rb')
+                self.files.append(file)
+                self.tables[name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def probe(self, board: Board):
+        '''Exact score (from white's point of view) of the position, or None if it is not in the tablebase.'''
+        white_count = len(board.white_pieces)
+        black_count = len(board.black_pieces)
+        if white_count + black_count > MAX_TABLEBASE_PIECES:
+            return None
+        if white_count == 1 and black_count == 1:
+            return 0
+
+        # the strong side is white in the tables
+        strong_is_white = black_count == 1
+        if not strong_is_white and white_count != 1:
+            return None
+        strong_pieces = board.white_pieces if strong_is_white else board.black_pieces
+        strong_types = sorted((Piece.get_type(board.board[square]) for square in strong_pieces if Piece.get_type(board.board[square]) != Piece.king), reverse=True)
+        name = 'K' + ''.join(PIECE_CHARS[piece_type] for piece_type in strong_types) + 'K'
+        if name not in self.tables:
+            # a lone minor piece can't mate
+            return 0 if name in ('KBK', 'KNK') else None
+
+        pieces = TABLES[name]
+        if strong_is_white:
+            index = position_index(board.white_to_move, board.white_king_square, board.black_king_square, piece_squares(board, pieces, True))
+        else:
+            # mirror the ranks and swap the colours
+            squares = [square ^ 56 for square in piece_squares(board, pieces, False)]
+            index = position_index(not board.white_to_move, board.black_king_square ^ 56, board.white_king_square ^ 56, squares)
+
+        value = self.tables[name][index]
+        if value == 0:
+            return 0
+        score = TB_WIN_SCORE - (value - 1)
+        return score if strong_is_white else -score
+
+    def best_move(self, board: Board):
+        '''(move, score) of the best move by the tablebase, or None if the position is not in the tablebase.'''
+        if self.probe(board) is None:
+            return None
+        best_move, best_score = None, None
+        for move in board.generate_legal_moves():
+            board.make_move(move)
+            score = self.probe(board)
+            board.undo_move()
+            if score is None:
+                return None
+            # the fastest win, or the longest defence
+            if best_score is None or (score > best_score if board.white_to_move else score < best_score):
+                best_move, best_score = move, score
+        if best_move is None:
+            return None
+        return best_move, best_score
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for file in self.files:
+            file.close()
+
+
+def load_tablebase(directory=TABLEBASE_DIR):
+    '''The tablebase, or None if no table has been built.'''
+    tablebase = Tablebase(directory)
+    if len(tablebase) == 0:
+        return None
+    return tablebase
+
+def main():
+    names = sys.argv[1:] if len(sys.argv) > 1 else BUILD_ORDER
+    build_tables(names)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.chess.PSQT import PHASE_WEIGHTS, TOTAL_PHASE
+from src.chess.PSQT_2D import PSQT_2D
+from src.chess.batch_analysis import parse_position
+from src.chess.board import Board, Piece
+from src.chess import engine, selfplay_data
+
+'''
+Texel tuning of the evaluation: the PSQT values and the evaluation weights of engine.py are fitted to game results.
+Every position is turned into a sparse feature vector (the PSQT entries of its pieces, weighted by the game phase,
+and the pawn structure, castling rights and mobility counts), the features are stored in NumPy arrays and
+the mean squared error between the game result and sigmoid(eval) is minimized with full batch gradient descent.
+
+The input has one position per line followed by the result of its game from white's point of view:
+1-0, 0-1, 1/2-1/2 or 1, 0.5, 0 (also as an EPD c9 operation or in brackets). Quiet positions work best.
+A self-play shard (.bin) of src.chess.selfplay_data is read as well.
+Run with: python -m src.chess.texel_tuner positions.epd --output src/chess/PSQT_2D.py
+The tuned evaluation weights are printed, they are copied into engine.py by hand.
+The numpy package is needed to run the tuner (the engine itself does not use it).
+'''
+
+PSQT_2D_TUNED_FILE = 'src/chess/PSQT_2D_tuned.py'
+
+PIECE_TYPES = (Piece.pawn, Piece.knight, Piece.bishop, Piece.rook, Piece.queen, Piece.king)
+PSQT_SIZE = len(PIECE_TYPES) * 64 # one table of every phase
+MAX_PIECES = 32
+
+# the weights of engine.py fitted besides the PSQT, in the order of the scalar features
+WEIGHT_NAMES = ('DOUBLED_PAWN_PENALTY', 'ISOLATED_PAWN_PENALTY', 'PAWN_CHAIN_BONUS', 'CASTLING_RIGHT_BONUS', 'MOBILITY_WEIGHT')
+# the penalties are subtracted by the evaluation
+WEIGHT_SIGNS = np.array([-1, -1, 1, 1, 1], dtype=np.float64)
+
+RESULT_PATTERN = re.compile(r'1/2-1/2|1-0|0-1|[01]\.\d+|\b[01]\b')
+RESULTS = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+# gradient descent (Adam)
+EPOCHS = 300
+LEARNING_RATE = 1.0 # centipawns
+BETA1 = 0.9
+BETA2 = 0.999
+EPSILON = 1e-8
+
+def parse_labelled_position(line):
+    '''(fen, result) of a line, or None if it has no result.'''
+    fields = line.split()
+    position_fields = 6 if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else 4
+    match = RESULT_PATTERN.search(' '.join(fields[position_fields:]))
+    if match is None:
+        return None
+    result = RESULTS.get(match.group(0))
+    return parse_position(line)[0], result if result is not None else float(match.group(0))
+
+def read_labelled_positions(path):
+    if path.endswith('.bin'):
+        # a self-play shard (python -m src.chess.selfplay_data)
+        return [(board.create_fen(), result) for board, score, result in selfplay_data.iter_samples(path)]
+    positions = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            labelled = parse_labelled_position(line)
+            if labelled is not None:
+                positions.append(labelled)
+    return positions
+
+
+def psqt_index(piece, square):
+    '''Index of the white PSQT entry of the piece (and sign of its contribution).
+    The 2D tables start at the 8th rank; black pieces use the white table mirrored and negated.'''
+    table = PIECE_TYPES.index(Piece.get_type(piece)) * 64
+    if Piece.get_color(piece) == Piece.white:
+        return table + (square ^ 56), 1
+    return table + square, -1
+
+def extract_features(fen):
+    '''Features of a position: (phase, PSQT indices, PSQT signs, scalar counts, material), or None if it is a draw by material.'''
+    board = Board(fen)
+    if board.is_insufficient_material():
+        return None
+
+    indices = []
+    signs = []
+    material = 0
+    phase = 0
+    for square, piece in enumerate(board.board):
+        if piece == 0:
+            continue
+        index, sign = psqt_index(piece, square)
+        indices.append(index)
+        signs.append(sign)
+        material += sign * Piece.get_value(Piece.get_type(piece))
+        phase += PHASE_WEIGHTS[piece & 7]
+
+    counts = (*engine.count_pawn_structure(board), engine.count_castling_rights(board), engine.count_mobility(board))
+    return phase / TOTAL_PHASE, indices, signs, counts, material
+
+class FeatureSet:
+    '''Features of N positions as NumPy arrays.'''
+    def __init__(self, phases, indices, signs, counts, material, results):
+        self.phases = phases # (N,) float, 1 in the opening and 0 in the endgame
+        self.indices = indices # (N, MAX_PIECES) PSQT indices of the pieces, padded with 0
+        self.signs = signs # (N, MAX_PIECES) +1 for white pieces, -1 for black pieces, 0 for padding
+        self.counts = counts # (N, len(WEIGHT_NAMES)) scalar features
+        self.material = material # (N,) piece values (not tuned)
+        self.results = results # (N,) game results from white's point of view
+
+    def __len__(self):
+        return len(self.results)
+
+    def save(self, path):
+        np.savez_compressed(path, phases=self.phases, indices=self.indices, signs=self.signs,
+                            counts=self.counts, material=self.material, results=self.results)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        return FeatureSet(data['phases'], data['indices'], data['signs'], data['counts'], data['material'], data['results'])
+
+def build_feature_set(positions, workers=None):
+    '''Extract the features of (fen, result) positions in a process pool.'''
+    fens = [fen for fen, _ in positions]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        features = list(executor.map(extract_features, fens, chunksize=256))
+
+    rows = [(feature, result) for feature, (_, result) in zip(features, positions) if feature is not None]
+    count = len(rows)
+    phases = np.zeros(count, dtype=np.float64)
+    indices = np.zeros((count, MAX_PIECES), dtype=np.int16)
+    signs = np.zeros((count, MAX_PIECES), dtype=np.int8)
+    counts = np.zeros((count, len(WEIGHT_NAMES)), dtype=np.float64)
+    material = np.zeros(count, dtype=np.float64)
+    results = np.zeros(count, dtype=np.float64)
+    for row, ((phase, piece_indices, piece_signs, scalar_counts, position_material), result) in enumerate(rows):
+        phases[row] = phase
+        indices[row, :len(piece_indices)] = piece_indices
+        signs[row, :len(piece_signs)] = piece_signs
+        counts[row] = scalar_counts
+        material[row] = position_material
+        results[row] = result
+    return FeatureSet(phases, indices, signs, counts, material, results)
+
+
+def initial_weights():
+    '''(opening PSQT, endgame PSQT, scalar weights) of the current evaluation.'''
+    tables = []
+    for phase in ('Opening', 'Endgame'):
+        table = np.zeros(PSQT_SIZE, dtype=np.float64)
+        for type_index, piece_type in enumerate(PIECE_TYPES):
+            table[type_index * 64:(type_index + 1) * 64] = np.array(PSQT_2D[phase][Piece.white | piece_type]).ravel()
+        tables.append(table)
+    scalars = np.array([getattr(engine, name) for name in WEIGHT_NAMES], dtype=np.float64)
+    return tables[0], tables[1], scalars
+
+def evaluate_batch(features: FeatureSet, opening, endgame, scalars):
+    '''Static evaluation (white's point of view) of every position, equal to Engine.evaluate without lazy cutoffs.'''
+    phases = features.phases[:, None]
+    psqt = features.signs * (opening[features.indices] * phases + endgame[features.indices] * (1 - phases))
+    return features.material + psqt.sum(axis=1) + features.counts @ (scalars * WEIGHT_SIGNS)
+
+def sigmoid(evaluations, k):
+    '''Expected result of an evaluation.'''
+    return 1 / (1 + np.power(10.0, -k * evaluations / 400))
+
+def mean_squared_error(features: FeatureSet, evaluations, k):
+    return float(np.mean((features.results - sigmoid(evaluations, k)) ** 2))
+
+def fit_k(features: FeatureSet, evaluations):
+    '''Scaling constant of the sigmoid that best fits the current evaluation (golden section search).'''
+    low, high = 0.01, 5.0
+    ratio = (5 ** 0.5 - 1) / 2
+    for _ in range(40):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if mean_squared_error(features, evaluations, a) < mean_squared_error(features, evaluations, b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2
+
+def gradients(features: FeatureSet, opening, endgame, scalars, k):
+    '''Gradients of the mean squared error with respect to the weights.'''
+    evaluations = evaluate_batch(features, opening, endgame, scalars)
+    expected = sigmoid(evaluations, k)
+    # derivative of the error with respect to every position's evaluation
+    error = -2 * (features.results - expected) * expected * (1 - expected) * k * np.log(10) / 400 / len(features)
+
+    weighted = features.signs * error[:, None]
+    phases = features.phases[:, None]
+    flat_indices = features.indices.ravel()
+    opening_gradient = np.bincount(flat_indices, weights=(weighted * phases).ravel(), minlength=PSQT_SIZE)
+    endgame_gradient = np.bincount(flat_indices, weights=(weighted * (1 - phases)).ravel(), minlength=PSQT_SIZE)
+    scalar_gradient = (features.counts * WEIGHT_SIGNS).T @ error
+    return opening_gradient, endgame_gradient, scalar_gradient
+
+def tune(features: FeatureSet, epochs=EPOCHS, learning_rate=LEARNING_RATE):
+    '''Fit the weights to the results with Adam. Returns (opening PSQT, endgame PSQT, scalar weights, k).'''
+    weights = list(initial_weights())
+    k = fit_k(features, evaluate_batch(features, *weights))
+    print(f"k = {k:.3f}, initial error: {mean_squared_error(features, evaluate_batch(features, *weights), k):.6f}")
+
+    moments = [np.zeros_like(weight) for weight in weights]
+    velocities = [np.zeros_like(weight) for weight in weights]
+    start_time = time.time()
+    for epoch in range(1, epochs + 1):
+        for index, gradient in enumerate(gradients(features, *weights, k)):
+            moments[index] = BETA1 * moments[index] + (1 - BETA1) * gradient
+            velocities[index] = BETA2 * velocities[index] + (1 - BETA2) * gradient ** 2
+            moment = moments[index] / (1 - BETA1 ** epoch)
+            velocity = velocities[index] / (1 - BETA2 ** epoch)
+            weights[index] -= learning_rate * moment / (np.sqrt(velocity) + EPSILON)
+
+        if epoch % 25 == 0 or epoch == epochs:
+            error = mean_squared_error(features, evaluate_batch(features, *weights), k)
+            print(f"epoch {epoch}: error {error:.6f}, {time.time() - start_time:.1f} sec")
+    return weights[0], weights[1], weights[2], k
+
+
+def format_table(values):
+    rows = []
+    for rank in range(8):
+        rows.append('            [' + ', '.join(f'{round(value):4d}' for value in values[rank * 8:(rank + 1) * 8]) + ']')
+    return ',\n'.join(rows)
+
+def write_psqt_2d(opening, endgame, path=PSQT_2D_TUNED_FILE):
+    '''Write the tables as a module in the format of PSQT_2D.py.'''
+    piece_names = {Piece.pawn: 'pawn', Piece.knight: 'knight', Piece.bishop: 'bishop', Piece.rook: 'rook', Piece.queen: 'queen', Piece.king: 'king'}
+    phases = []
+    for phase, table in (('Opening', opening), ('Endgame', endgame)):
+        pieces = []
+        for type_index, piece_type in enumerate(PIECE_TYPES):
+            values = table[type_index * 64:(type_index + 1) * 64]
+            pieces.append(f'        Piece.white | Piece.{piece_names[piece_type]}: [\n{format_table(values)}\n        ]')
+        phases.append(f'    "{phase}": {{\n' + ',\n'.join(pieces) + '\n    }')
+
+    with open(path, 'w') as file:
+        file.write(f'''from src.chess.board import Piece
+# from board import Piece
+
+\'\'\'
+PSQTS are piece-square tables. They are used to evaluate the position of a piece on the board.
+Each piece has a different table for the opening and endgame phases of the game.
+These values were fitted to game results by src.chess.texel_tuner.
+The values are positive for white pieces and negative for black pieces.
+\'\'\'
+
+PSQT_2D = {{
+{','.join(phases)}
+}}
+
+# add black pieces
+for phase in PSQT_2D: # Opening, Endgame
+    for piece in list(PSQT_2D[phase].keys()):
+        table = PSQT_2D[phase][piece]
+
+        black_table = []
+        for rank in table[::-1]:
+            black_rank = [-score for score in rank]
+            black_table.append(black_rank)
+
+        piece_type = Piece.get_type(piece)
+        PSQT_2D[phase][piece_type | Piece.black] = black_table
+''')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the PSQT and the evaluation weights to game results')
+    parser.add_argument('input', help='positions with game results (FEN or EPD lines)')
+    parser.add_argument('--output', default=PSQT_2D_TUNED_FILE, help='tuned PSQT_2D module')
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--learning-rate', type=float, default=LEARNING_RATE)
+    parser.add_argument('--workers', type=int, default=None, help='processes extracting the features')
+    args = parser.parse_args()
+
+    # the features of an input are cached next to it
+    cache_path = os.path.splitext(args.input)[0] + '.features.npz'
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(args.input):
+        features = FeatureSet.load(cache_path)
+    else:
+        start_time = time.time()
+        features = build_feature_set(read_labelled_positions(args.input), args.workers)
+        features.save(cache_path)
+        print(f"Features of {len(features)} positions extracted in {time.time() - start_time:.1f} sec")
+
+    opening, endgame, scalars, k = tune(features, args.epochs, args.learning_rate)
+    write_psqt_2d(opening, endgame, args.output)
+    print(f"Tables written to {args.output}, evaluation weights for engine.py:")
+    for name, value in zip(WEIGHT_NAMES, scalars):
+        print(f"{name} = {round(value)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import sys
+import threading
+from src.chess.board import Board, STARTING_FEN
+from src.chess.engine import Engine, SearchLimits, TranspositionTable, is_mate_score, mate_in_moves
+from src.chess.lazy_smp import LazySMPSearch, ENTRY_SIZE
+from src.chess.notation import move_to_uci, uci_to_move
+from src.chess.search_info import SearchInfo, print_search_info
+
+'''
+UCI (Universal Chess Interface) front-end, so the engine can be used by chess GUIs and match runners.
+Run with: python -m src.chess.uci
+
+Supported commands: uci, isready, ucinewgame, setoption, position, go, stop, ponderhit, quit.
+Options: Hash (MB), Threads (more than 1 uses lazy SMP), MoveOverhead (ms), Ponder,
+MultiPV (number of best lines, single threaded search only),
+AnalysisCache (results of earlier sessions are reused, single threaded search only).
+'''
+
+ENGINE_NAME = 'ArcadeFSE'
+ENGINE_AUTHOR = 'Doomsy1'
+
+DEFAULT_HASH_MB = 64
+MAX_HASH_MB = 4096
+MAX_THREADS = 64
+DEFAULT_MOVE_OVERHEAD_MS = 50
+MAX_MOVE_OVERHEAD_MS = 5000
+MAX_MULTI_PV = 16
+
+TT_ENTRY_BYTES = 200 # rough memory use of an entry of the python transposition table
+
+# time management: the share of the remaining time used for one move
+DEFAULT_MOVES_TO_GO = 30
+MAX_TIME_SHARE = 4 # never more than a quarter of the remaining time
+INCREMENT_SHARE = 0.9
+MIN_TIME_MS = 10
+
+def format_score(info: SearchInfo, white_to_move):
+    '''UCI scores are from the point of view of the side to move, the engine's are from white's.'''
+    score = info.score if info.score is not None else 0
+    if not white_to_move:
+        score = -score
+    # tablebase wins are mate scores as well
+    if is_mate_score(score):
+        return f'mate {mate_in_moves(score)}'
+    return f'cp {round(score)}'
+
+
+class UCI:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.board = Board()
+        self.position_fen = STARTING_FEN
+        self.position_moves = []
+
+        self.hash_mb = DEFAULT_HASH_MB
+        self.threads = 1
+        self.move_overhead_ms = DEFAULT_MOVE_OVERHEAD_MS
+        self.multi_pv = 1
+        self.analysis_cache = False
+        self.search = None
+        self.create_search()
+
+        self.search_thread = None
+        self.searching_board = None # the position of the running search (for the score's point of view)
+        self.held_bestmove = None # ponder and infinite searches may not report the best move before stop or ponderhit
+        self.hold_bestmove = False
+        self.lock = threading.Lock()
+
+    def send(self, line):
+        self.output.write(line + '\n')
+        self.output.flush()
+
+    def create_search(self):
+        '''(Re)create the engine for the current Hash, Threads, MultiPV and AnalysisCache options.'''
+        if isinstance(self.search, LazySMPSearch):
+            self.search.close()
+        elif self.search is not None and self.search.analysis_cache is not None:
+            self.search.analysis_cache.close()
+
+        if self.threads > 1:
+            capacity = self.hash_mb * 1024 * 1024 // ENTRY_SIZE
+            self.search = LazySMPSearch(self.board, threads=self.threads, tt_capacity=capacity)
+        else:
+            self.search = Engine(self.board, multi_pv=self.multi_pv, use_analysis_cache=self.analysis_cache)
+            self.search.transposition_table = TranspositionTable(self.hash_mb * 1024 * 1024 // TT_ENTRY_BYTES)
+        self.search.search_info.unsubscribe(print_search_info)
+        self.search.search_info.subscribe(self.send_search_info)
+
+    def send_search_info(self, info: SearchInfo):
+        '''Search info subscriber: info lines while searching, then the best move.'''
+        if not info.final:
+            pv = ' '.join(move_to_uci(move) for move in info.pv)
+            self.send(f'info depth {info.depth} seldepth {info.seldepth} multipv {info.multipv} score {format_score(info, self.searching_board.white_to_move)} '
+                      f'nodes {info.nodes} nps {info.nps} hashfull {info.hashfull} time {info.time_ms} pv {pv}')
+            return
+
+        bestmove = f'bestmove {move_to_uci(info.best_move)}'
+        if info.ponder_move is not None:
+            bestmove += f' ponder {move_to_uci(info.ponder_move)}'
+        with self.lock:
+            if self.hold_bestmove:
+                self.held_bestmove = bestmove
+                return
+        self.send(bestmove)
+
+    def release_bestmove(self):
+        with self.lock:
+            self.hold_bestmove = False
+            bestmove, self.held_bestmove = self.held_bestmove, None
+        if bestmove is not None:
+            self.send(bestmove)
+
+    def wait_for_search(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    def handle_setoption(self, args):
+        # setoption name <name> [value <value>]
+        if 'name' not in args:
+            return
+        value_index = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:value_index]).lower()
+        value = ' '.join(args[value_index + 1:])
+
+        if name == 'hash':
+            self.hash_mb = max(1, min(int(value), MAX_HASH_MB))
+            self.create_search()
+        elif name == 'threads':
+            self.threads = max(1, min(int(value), MAX_THREADS))
+            self.create_search()
+        elif name == 'multipv':
+            self.multi_pv = max(1, min(int(value), MAX_MULTI_PV))
+            if isinstance(self.search, Engine):
+                self.search.multi_pv = self.multi_pv
+        elif name == 'analysiscache':
+            self.analysis_cache = value.lower() == 'true'
+            self.create_search()
+        elif name == 'moveoverhead':
+            self.move_overhead_ms = max(0, min(int(value), MAX_MOVE_OVERHEAD_MS))
+
+    def handle_position(self, args):
+        # position [startpos | fen <fen>] [moves <move> ...]
+        moves_index = args.index('moves') if 'moves' in args else len(args)
+        if args[0] == 'fen':
+            fen = ' '.join(args[1:moves_index])
+        else:
+            fen = STARTING_FEN
+
+        # a new board so the game history is in its state stack (for repetitions)
+        self.board = Board(fen)
+        self.position_fen = fen
+        self.position_moves = []
+        for text in args[moves_index + 1:]:
+            move = uci_to_move(self.board, text)
+            if move is None:
+                print(f'Illegal move: {text}', file=sys.stderr)
+                break
+            self.board.make_move(move)
+            self.position_moves.append(move)
+
+    def parse_limits(self, args):
+        '''SearchLimits of a go command.'''
+        values = {}
+        for name in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+            if name in args:
+                values[name] = int(args[args.index(name) + 1])
+        ponder = 'ponder' in args
+
+        time_ms = None
+        if 'movetime' in values:
+            time_ms = values['movetime'] - self.move_overhead_ms
+        else:
+            time_left = values.get('wtime' if self.board.white_to_move else 'btime')
+            if time_left is not None:
+                increment = values.get('winc' if self.board.white_to_move else 'binc', 0)
+                moves_to_go = values.get('movestogo', DEFAULT_MOVES_TO_GO)
+                time_ms = min(time_left // moves_to_go + increment * INCREMENT_SHARE, time_left // MAX_TIME_SHARE)
+                time_ms = int(time_ms) - self.move_overhead_ms
+        if time_ms is not None:
+            time_ms = max(time_ms, MIN_TIME_MS)
+
+        return SearchLimits(time_ms=time_ms, nodes=values.get('nodes'), depth=values.get('depth'), ponder=ponder)
+
+    def handle_go(self, args):
+        self.wait_for_search()
+        limits = self.parse_limits(args)
+
+        # only the moves played since the last position are made on the engine's board
+        self.search.set_position(self.position_fen, self.position_moves)
+        self.searching_board = self.board
+
+        with self.lock:
+            self.hold_bestmove = limits.ponder or 'infinite' in args
+            self.held_bestmove = None
+        self.search.prepare_search()
+        self.search_thread = threading.Thread(target=self.search.iterative_deepening, args=(limits,), daemon=True)
+        self.search_thread.start()
+
+    def handle_command(self, line):
+        '''Returns False on quit.'''
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == 'uci':
+            self.send(f'id name {ENGINE_NAME}')
+            self.send(f'id author {ENGINE_AUTHOR}')
+            self.send(f'option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}')
+            self.send(f'option name Threads type spin default 1 min 1 max {MAX_THREADS}')
+            self.send(f'option name MoveOverhead type spin default {DEFAULT_MOVE_OVERHEAD_MS} min 0 max {MAX_MOVE_OVERHEAD_MS}')
+            self.send('option name Ponder type check default false')
+            self.send(f'option name MultiPV type spin default 1 min 1 max {MAX_MULTI_PV}')
+            self.send('option name AnalysisCache type check default false')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.wait_for_search()
+            self.search.new_game()
+        elif command == 'setoption':
+            self.wait_for_search()
+            self.handle_setoption(args)
+        elif command == 'position' and args:
+            self.wait_for_search()
+            self.handle_position(args)
+        elif command == 'go':
+            self.handle_go(args)
+        elif command == 'stop':
+            self.search.stop()
+            self.release_bestmove()
+            self.wait_for_search()
+        elif command == 'ponderhit':
+            # the search continues on the clock of the last go command
+            self.search.ponderhit()
+            self.release_bestmove()
+        elif command == 'quit':
+            self.search.stop()
+            self.release_bestmove()
+            self.wait_for_search()
+            return False
+        return True
+
+    def close(self):
+        if isinstance(self.search, LazySMPSearch):
+            self.search.close()
+
+
+def main():
+    # the engine prints statistics, they go to stderr so stdout only has UCI output
+    output = sys.stdout
+    sys.stdout = sys.stderr
+    uci = UCI(output)
+
+    for line in sys.__stdin__:
+        if not uci.handle_command(line):
+            break
+    uci.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import random
+import sys
+import time
+import numpy as np
+from src.chess.board import Board
+from src.chess.engine import Engine, evaluate_psqt, evaluate_king_safety, evaluate_mobility, evaluate_pawn_structure
+from src.chess import batch_eval
+
+'''
+Checks that the batch evaluator matches Engine.evaluate term by term and compares the throughput of
+batch_eval.evaluate with Engine.evaluate called on every position.
+The positions come from random games. Exits with 1 if a term differs by more than TOLERANCE or if the batch
+is less than MIN_SPEEDUP times faster. Engine and batch runs alternate, REPEATS runs each, and the best run
+of each is compared, so that a slow phase of the machine doesn't favour one of them.
+Run with: python -m src.chess_tests.batch_eval_benchmark [positions]
+'''
+
+DEFAULT_POSITIONS = 20000
+MAX_GAME_PLIES = 120
+TOLERANCE = 1e-6
+SEED = 1
+REPEATS = 5 # the engine and batch times are the best of this many runs each
+MIN_SPEEDUP = 40
+
+def random_positions(count, seed=SEED):
+    '''Boards of random games (captures are preferred so that endgames are included).'''
+    random.seed(seed)
+    boards = []
+    while len(boards) < count:
+        board = Board()
+        for _ in range(MAX_GAME_PLIES):
+            moves = board.generate_legal_moves()
+            if not moves or board.is_insufficient_material():
+                break
+            captures = [move for move in moves if move[3]]
+            board.make_move(random.choice(captures) if captures and random.random() < 0.5 else random.choice(moves))
+            boards.append(Board(board.create_fen()))
+            if len(boards) == count:
+                break
+    return boards
+
+def create_engine():
+    engine = Engine(Board(), use_opening_book=False, use_tablebase=False)
+    engine.lazy_eval_margin = None
+    return engine
+
+def scalar_terms(boards):
+    '''Terms of Engine.evaluate of every board, one board at a time.'''
+    engine = create_engine()
+    terms = {'psqt': [], 'king_safety': [], 'mobility': [], 'pawn_structure': [], 'evaluation': []}
+    for board in boards:
+        terms['psqt'].append(evaluate_psqt(board.board))
+        terms['king_safety'].append(evaluate_king_safety(board))
+        terms['mobility'].append(evaluate_mobility(board))
+        terms['pawn_structure'].append(evaluate_pawn_structure(board))
+        engine.board = board
+        terms['evaluation'].append(engine.evaluate())
+    return {name: np.array(values, dtype=np.float64) for name, values in terms.items()}
+
+def scalar_evaluation_time(boards):
+    engine = create_engine()
+    start_time = time.perf_counter()
+    for board in boards:
+        engine.board = board
+        engine.evaluate()
+    return time.perf_counter() - start_time
+
+def batch_evaluation_time(batch):
+    start_time = time.perf_counter()
+    batch_eval.evaluate(batch)
+    return time.perf_counter() - start_time
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_POSITIONS
+    boards = random_positions(count)
+    batch = batch_eval.BoardBatch.from_boards(boards)
+
+    expected = scalar_terms(boards)
+    terms = batch_eval.evaluate_terms(batch)
+    terms['evaluation'] = batch_eval.evaluate(batch)
+
+    mismatches = 0
+    for name, values in expected.items():
+        difference = np.abs(terms[name] - values)
+        worst = int(np.argmax(difference))
+        status = 'ok' if difference[worst] <= TOLERANCE else 'MISMATCH'
+        if status != 'ok':
+            mismatches += 1
+            print(f"{name}: {boards[worst].create_fen()} batch {terms[name][worst]}, engine {values[worst]}")
+        print(f"{name:>15}: max difference {difference[worst]:.2e} {status}")
+
+    scalar_time = batch_time = float('inf')
+    for _ in range(REPEATS):
+        scalar_time = min(scalar_time, scalar_evaluation_time(boards))
+        batch_time = min(batch_time, batch_evaluation_time(batch))
+    speedup = scalar_time / batch_time
+    print(f"{count} positions: engine {count / scalar_time:.0f} positions/sec, batch {count / batch_time:.0f} positions/sec, "
+          f"speedup {speedup:.0f}x")
+    if speedup < MIN_SPEEDUP:
+        print(f"Speedup below {MIN_SPEEDUP}x")
+    sys.exit(1 if mismatches or speedup < MIN_SPEEDUP else 0)
+
+if __name__ == "__main__":
+    main()
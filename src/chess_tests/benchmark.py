@@ -0,0 +1,215 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from src.chess.board import Board, STARTING_FEN
+from src.chess.engine import Engine, SearchLimits
+from src.chess.search_info import print_search_info
+from src.chess_tests.perft import count_positions
+
+'''
+Repeatable speed benchmark of the chess engine: node limited searches on fixed positions, perft and evaluation loops.
+Every case runs several times, the median and the spread of its speed (and of the search's time to every depth)
+are reported. Results are stored in RESULTS_FILE keyed by the git commit (with '-dirty' for uncommitted changes)
+and compared with the last stored commit before this one (or --baseline): a case whose median speed dropped
+by more than the threshold is a slowdown and the run exits with 1.
+The node limited searches are deterministic, so their node counts (and depths) only change with the search itself.
+Run with: python -m src.chess_tests.benchmark [--repeat 5] [--cases search perft eval] [--baseline <commit>]
+'''
+
+RESULTS_FILE = 'src/chess_tests/benchmark_results.json'
+REPEATS = 5
+SLOWDOWN_THRESHOLD = 10 # percent of the baseline's median speed
+
+SEARCH_NODES = 3000
+SEARCH_POSITIONS = [
+    ('start', STARTING_FEN),
+    ('italian', 'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'),
+    ('middlegame', 'r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 10'),
+    ('endgame', '8/5pk1/6p1/3R4/7P/6P1/r4PK1/8 b - - 0 40'),
+]
+
+# (name, fen, depth)
+PERFT_POSITIONS = [
+    ('start', STARTING_FEN, 3),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 3),
+]
+
+EVAL_LOOPS = 1000 # evaluations of every search position per run
+
+def create_engine(fen):
+    engine = Engine(Board(fen), use_opening_book=False, use_tablebase=False)
+    engine.search_info.unsubscribe(print_search_info)
+    return engine
+
+def search_case(fen):
+    '''A node limited search: (nodes, seconds, {depth: ms to finish it}).'''
+    engine = create_engine(fen)
+    start_time = time.perf_counter()
+    # the search prints its statistics when it finishes
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.iterative_deepening(SearchLimits(nodes=SEARCH_NODES))
+    duration = time.perf_counter() - start_time
+    time_to_depth = {}
+    elapsed = 0
+    for depth in engine.stats.depths:
+        elapsed += depth['time_ms']
+        time_to_depth[depth['depth']] = elapsed
+    return engine.nodes, duration, time_to_depth
+
+def perft_case(fen, depth):
+    board = Board(fen)
+    start_time = time.perf_counter()
+    count = count_positions(board, depth, check=False)
+    return count, time.perf_counter() - start_time, None
+
+def eval_case():
+    '''Evaluations of the search positions without lazy evaluation (every term is computed).'''
+    # one engine per position, so the loop does not set up a game for every evaluation
+    engines = [create_engine(fen) for name, fen in SEARCH_POSITIONS]
+    for engine in engines:
+        engine.lazy_eval_margin = None
+    start_time = time.perf_counter()
+    for _ in range(EVAL_LOOPS):
+        for engine in engines:
+            engine.evaluate()
+    return EVAL_LOOPS * len(engines), time.perf_counter() - start_time, None
+
+def benchmark_cases():
+    '''{name: (unit, function)}, the function returns (count, seconds, time to depth or None).'''
+    cases = {}
+    for name, fen in SEARCH_POSITIONS:
+        cases[f'search/{name}'] = ('nps', lambda fen=fen: search_case(fen))
+    for name, fen, depth in PERFT_POSITIONS:
+        cases[f'perft/{name}/{depth}'] = ('positions/sec', lambda fen=fen, depth=depth: perft_case(fen, depth))
+    cases['eval/positions'] = ('evals/sec', eval_case)
+    return cases
+
+def run_case(function, repeats):
+    '''Median, min, max and spread (in percent of the median) of the speed over the runs.'''
+    speeds = []
+    depth_times = {}
+    count = None
+    for _ in range(repeats):
+        count, duration, time_to_depth = function()
+        speeds.append(count / duration)
+        for depth, ms in (time_to_depth or {}).items():
+            depth_times.setdefault(depth, []).append(ms)
+    median = statistics.median(speeds)
+    result = {
+        'count': count,
+        'median': round(median, 1),
+        'min': round(min(speeds), 1),
+        'max': round(max(speeds), 1),
+        'spread': round((max(speeds) - min(speeds)) / median * 100, 2),
+    }
+    if depth_times:
+        # only the depths every run finished
+        result['time_to_depth'] = {str(depth): round(statistics.median(times), 3)
+                                   for depth, times in sorted(depth_times.items()) if len(times) == repeats}
+    return result
+
+
+def git_commit():
+    '''Short hash of HEAD, with '-dirty' if the tree has uncommitted changes ('unknown' outside of git).'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if status.strip() else commit
+
+def load_results(path=RESULTS_FILE):
+    '''{commit: run} in the order the runs were stored.'''
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def store_result(commit, run, path=RESULTS_FILE):
+    '''Store the run of the commit as the latest one (replacing an earlier run of the same commit).
+    The cases of the earlier run that were not benchmarked again are kept.'''
+    results = load_results(path)
+    previous = results.pop(commit, None)
+    if previous is not None:
+        run['cases'] = {**previous['cases'], **run['cases']}
+    results[commit] = run
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=1)
+
+def find_baseline(results, commit, baseline=None):
+    '''(commit, run) to compare with: the given commit (a prefix is enough) or the latest other one.'''
+    if baseline is not None:
+        for key, run in results.items():
+            if key.startswith(baseline):
+                return key, run
+        return None, None
+    for key in reversed(list(results)):
+        if key != commit:
+            return key, results[key]
+    return None, None
+
+def compare(cases, baseline_cases, threshold=SLOWDOWN_THRESHOLD):
+    '''Print the change of every case's median speed, returns the names of the slowdowns.'''
+    slowdowns = []
+    for name, result in cases.items():
+        baseline = baseline_cases.get(name)
+        if baseline is None:
+            continue
+        change = (result['median'] / baseline['median'] - 1) * 100
+        slowdown = change < -threshold
+        if slowdown:
+            slowdowns.append(name)
+        note = ''
+        if baseline['count'] != result['count']:
+            note = f" (count {baseline['count']} -> {result['count']})"
+        print(f"{name:<24} {baseline['median']:>12.0f} -> {result['median']:>12.0f} ({change:+.1f}%, "
+              f"spread {baseline['spread']:.1f}% / {result['spread']:.1f}%){note}{' SLOWDOWN' if slowdown else ''}")
+    return slowdowns
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed benchmark of the chess engine, compared with an earlier commit')
+    parser.add_argument('--repeat', type=int, default=REPEATS, help='runs of every case')
+    parser.add_argument('--cases', nargs='*', default=None, help='prefixes of the cases to run (search, perft, eval)')
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=None, help='commit to compare with (default: the latest other stored commit)')
+    parser.add_argument('--threshold', type=float, default=SLOWDOWN_THRESHOLD, help='slowdown threshold in percent')
+    parser.add_argument('--no-store', action='store_true', help="don't store the results")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    cases = {}
+    for name, (unit, function) in benchmark_cases().items():
+        if args.cases and not any(name.startswith(prefix) for prefix in args.cases):
+            continue
+        result = cases[name] = run_case(function, args.repeat)
+        result['unit'] = unit
+        print(f"{name:<24} {result['median']:>12.0f} {unit:<14} (min {result['min']:.0f}, max {result['max']:.0f}, "
+              f"spread {result['spread']:.1f}%)")
+        if 'time_to_depth' in result:
+            print(' ' * 25 + ', '.join(f"depth {depth}: {ms:.0f} ms" for depth, ms in result['time_to_depth'].items()))
+
+    results = load_results(args.results)
+    baseline_commit, baseline = find_baseline(results, commit, args.baseline)
+    if not args.no_store:
+        store_result(commit, {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeats': args.repeat, 'cases': cases},
+                     args.results)
+        print(f"Results of {commit} stored in {args.results}")
+
+    if baseline is None:
+        print("No baseline to compare with")
+        return 0
+    print(f"Compared with {baseline_commit} ({baseline['timestamp']}):")
+    slowdowns = compare(cases, baseline['cases'], args.threshold)
+    if slowdowns:
+        print(f"{len(slowdowns)} slowdown(s) above {args.threshold}%: {', '.join(slowdowns)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,26 @@
+import argparse
 import cProfile
 import csv
 import io
 import pstats
 from src.chess.board import Board
-from src.chess.engine import Engine
+from src.chess.engine import Engine, SearchLimits
 
-def time_mate(engine: Engine, fen):
-    engine.board.load_fen(fen)
-    engine.iterative_deepening([])
+'''
+Profiles the engine on mate positions. The search statistics of every position (nodes, TT use, first move cutoffs,
+branching factor, time per depth and the split between move generation, ordering and evaluation) are appended to
+a JSON lines file and a CSV file, so runs can be compared; --label names the run (e.g. the change being measured).
+--cprofile also writes the cProfile function table (it slows the search down a lot).
+Run with: python -m src.chess_tests.engine_code_profile --depth 4 --label baseline
+'''
+
+STATS_JSON_FILE = 'engine_search_stats.jsonl'
+STATS_CSV_FILE = 'engine_search_stats.csv'
+CPROFILE_CSV_FILE = 'engine_profile.csv'
+
+def time_mate(engine: Engine, fen, limits=None):
+    engine.new_game(fen)
+    engine.iterative_deepening(limits)
 
 
 mates = [
@@ -23,30 +36,21 @@ mates = [
     '7k/1p4R1/3bp2p/3p3N/p2P4/4NQPP/PP5K/2r1q3 w - - 1 0'
 ]
 
-if __name__ == "__main__":
-    pr = cProfile.Profile()
-    b = Board()
-    engine = Engine(b)
-
-    pr.enable()
-    for mate in mates:
-        time_mate(engine, mate)
-    pr.disable()
-    
+def write_cprofile(profile, path=CPROFILE_CSV_FILE):
     s = io.StringIO()
-    ps = pstats.Stats(pr, stream=s)
+    ps = pstats.Stats(profile, stream=s)
     ps.sort_stats('cumulative')
     ps.print_stats()
-    
+
     # print total cumulative time
     print('Total cumulative time: ', ps.total_tt)
 
-    with open('engine_profile.csv', 'w', newline='') as csvfile:
+    with open(path, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Function', 'Calls', 'Total Time', 'Per Call', 'Cumulative Time', 'Per Call (cumulative)'])
-        
+
         sorted_stats = sorted(ps.stats.items(), key=lambda x: x[1][3], reverse=True)
-        
+
         for func, stats in sorted_stats:
             cc, nc, tt, ct, callers = stats
             per_call = tt / nc if nc else 0
@@ -54,4 +58,33 @@ if __name__ == "__main__":
             func_str = pstats.func_std_string(func)
             writer.writerow([func_str, nc, tt, per_call, ct, cum_per_call])
 
+def main():
+    parser = argparse.ArgumentParser(description='Search statistics of the engine on mate positions')
+    parser.add_argument('--depth', type=int, default=None, help='depth limit (default: the engine time limit)')
+    parser.add_argument('--time', type=int, default=None, help='time limit in ms')
+    parser.add_argument('--label', default=None, help='name of the run in the exported statistics')
+    parser.add_argument('--json', default=STATS_JSON_FILE)
+    parser.add_argument('--csv', default=STATS_CSV_FILE)
+    parser.add_argument('--cprofile', action='store_true', help=f'also write the cProfile table to {CPROFILE_CSV_FILE}')
+    args = parser.parse_args()
+
+    engine = Engine(Board())
+    limits = SearchLimits(time_ms=args.time, depth=args.depth) if args.depth or args.time else None
+
+    profile = cProfile.Profile() if args.cprofile else None
+    for index, mate in enumerate(mates):
+        if profile is not None:
+            profile.enable()
+        time_mate(engine, mate, limits)
+        if profile is not None:
+            profile.disable()
+        label = f'{args.label}:{index}' if args.label else str(index)
+        engine.stats.export_json(args.json, label)
+        engine.stats.export_csv(args.csv, label)
 
+    print(f"Search statistics appended to {args.json} and {args.csv}")
+    if profile is not None:
+        write_cprofile(profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import contextlib
+import os
+import time
+from src.chess.board import Board
+from src.chess.engine import Engine, SearchLimits
+from src.chess.search_info import print_search_info
+from src.chess_tests.search_depth_profile import quiet_positions
+
+'''
+Cost of multi-PV: every extra line is another root search (with the better moves excluded) on the shared
+transposition table. Every position is searched to a fixed depth with 1 to MAX_LINES lines.
+Run with: python -m src.chess_tests.multipv_benchmark
+'''
+
+DEPTH = 4
+MAX_LINES = 4
+
+def search(fen, lines, depth=DEPTH):
+    '''(time in sec, nodes) of a fixed depth search with the given number of lines.'''
+    engine = Engine(Board(fen), multi_pv=lines, use_opening_book=False, use_tablebase=False)
+    engine.search_info.unsubscribe(print_search_info)
+    # the engine prints statistics after every search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.time()
+        info = engine.iterative_deepening(SearchLimits(depth=depth))
+    return time.time() - start_time, info.nodes
+
+def main():
+    results = {} # lines -> (total time, total nodes)
+    for lines in range(1, MAX_LINES + 1):
+        total_time, total_nodes = 0, 0
+        for fen in quiet_positions:
+            duration, nodes = search(fen, lines)
+            total_time += duration
+            total_nodes += nodes
+        results[lines] = (total_time, total_nodes)
+
+    print(f"Multi-PV cost at depth {DEPTH} ({len(quiet_positions)} positions)")
+    base_time, base_nodes = results[1]
+    for lines, (total_time, total_nodes) in results.items():
+        extra = ''
+        if lines > 1:
+            extra_time = (total_time - base_time) / (lines - 1)
+            extra_nodes = (total_nodes - base_nodes) / (lines - 1)
+            extra = f", per extra line: +{extra_time / base_time:.0%} time, +{extra_nodes / base_nodes:.0%} nodes"
+        print(f"{lines} lines: {total_time:.2f} sec, {total_nodes} nodes{extra}")
+
+if __name__ == "__main__":
+    main()
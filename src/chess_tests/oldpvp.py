@@ -291,9 +291,7 @@ class PlayerVsPlayer:
 
         pygame.display.flip()
 
-        result_container = []
-        self.engine.iterative_deepening(result_container)
-        self.engine_suggestion = result_container[-1][0]
+        self.engine_suggestion = self.engine.iterative_deepening().best_move
     
     def draw_game_over(self):
         '''
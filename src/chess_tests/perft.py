@@ -1,38 +1,48 @@
+import argparse
+import sys
 import time
-import csv
 from src.chess.board import Board
-import cProfile
-import pstats
-import io
+from src.chess import instrumentation
 
-def count_positions(board: Board, depth):
+'''
+Perft: counts the positions reached from the start position, checking the legal moves against the known move generator.
+--instrument also reports the call counts and times of the hot functions and compares them with the 'perft' baseline
+(see src.chess.instrumentation), the run fails on a regression.
+Run with: python -m src.chess_tests.perft --depth 4 --instrument
+'''
+
+def count_positions(board: Board, depth, check=True):
+    '''Positions reached in depth plies. With check the legal moves are compared with the known move generator
+    (a difference is printed and waits for enter), without it only the move generator is timed.'''
     if depth == 0:
         return 1
     count = 0
 
     legal_moves = board.generate_legal_moves()
-    known_legal_moves = board.known_generate_legal_moves()
-    for move in known_legal_moves:
-        if move not in legal_moves:
-            print(board.create_fen())
-            print(move, "not in generated legal moves")
-            input()
-            print("ok")
+    if check:
+        known_legal_moves = board.known_generate_legal_moves()
+        for move in known_legal_moves:
+            if move not in legal_moves:
+                print(board.create_fen())
+                print(move, "not in generated legal moves")
+                input()
+                print("ok")
+        for move in legal_moves:
+            if move not in known_legal_moves:
+                print(board.create_fen())
+                print(move, "not in known legal moves")
+                input()
+                print("ok")
     for move in legal_moves:
-        if move not in known_legal_moves:
-            print(board.create_fen())
-            print(move, "not in known legal moves")
-            input()
-            print("ok")
         board.make_move(move)
-        count += count_positions(board, depth - 1)
+        count += count_positions(board, depth - 1, check)
         board.undo_move()
     return count
 
-def main():
+def main(max_depth=4):
     board = Board()
 
-    for depth in range(1, 5):
+    for depth in range(1, max_depth + 1):
         start_time = time.time()
         count = count_positions(board, depth)
         duration = time.time() - start_time
@@ -57,26 +67,14 @@ def gen_moves(count):
         board.generate_legal_moves()
 
 if __name__ == "__main__":
-    pr = cProfile.Profile()
-    pr.enable()
-    main()
-    # gen_moves(10000)
-    pr.disable()
-    
-    s = io.StringIO()
-    ps = pstats.Stats(pr, stream=s)
-    ps.sort_stats('cumulative')
-    ps.print_stats()
-    
-    with open('benchmark.csv', 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Function', 'Calls', 'Total Time', 'Per Call', 'Cumulative Time', 'Per Call (cumulative)'])
-        
-        sorted_stats = sorted(ps.stats.items(), key=lambda x: x[1][3], reverse=True)
-        
-        for func, stats in sorted_stats:
-            cc, nc, tt, ct, callers = stats
-            per_call = tt / nc if nc else 0
-            cum_per_call = ct / nc if nc else 0
-            func_str = pstats.func_std_string(func)
-            writer.writerow([func_str, nc, tt, per_call, ct, cum_per_call])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Perft of the start position')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--instrument', action='store_true', help='time the hot functions and compare with the baseline')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.instrument:
+        main(args.depth)
+    else:
+        report = instrumentation.profile(lambda: main(args.depth), args.repeat)
+        sys.exit(instrumentation.finish('perft', report, args))
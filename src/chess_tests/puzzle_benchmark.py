@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import csv
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from src.chess.batch_analysis import read_positions
+from src.chess.board import Board
+from src.chess.engine import Engine, SearchLimits, is_mate_score
+from src.chess.search_info import print_search_info
+
+'''
+Tactical strength per second: the mate puzzles of puzzles.txt are solved under several time and node budgets
+and the share of puzzles solved is printed for every budget (the solve rate curve).
+A puzzle is solved when the search finds a mate for the side to move; the time and nodes of the first
+depth that found it are recorded as time and nodes to solution.
+Run with: python -m src.chess_tests.puzzle_benchmark --times 250 1000 --nodes 2000 8000
+'''
+
+PUZZLES_FILE = 'src/chess/puzzles.txt'
+RESULTS_FILE = 'src/chess_tests/puzzle_benchmark.csv'
+
+DEFAULT_TIMES_MS = [250, 500, 1000, 2000]
+DEFAULT_NODES = [1000, 2000, 4000, 8000, 16000]
+CURVE_WIDTH = 40 # characters of a 100% bar
+
+MATE_SECTION = re.compile(r'mate in (\d+)', re.IGNORECASE)
+
+def read_puzzles(path=PUZZLES_FILE):
+    '''The positions of the "Mate in N" sections (the endgame sections are not puzzles with a known solution).'''
+    puzzles = []
+    for position in read_positions(path):
+        match = MATE_SECTION.search(position['section'] or '')
+        if match:
+            position['mate_in'] = int(match.group(1))
+            puzzles.append(position)
+    return puzzles
+
+
+# one engine per worker process
+engine = None
+
+def init_worker():
+    global engine
+    engine = Engine(Board(), use_opening_book=False)
+    engine.search_info.unsubscribe(print_search_info)
+
+def solve(puzzle, budget_type, budget):
+    '''Search the puzzle under one budget, returns (puzzle index, budget type, budget, time to solution, nodes to solution).
+    The time and nodes to solution are None if the puzzle was not solved.'''
+    engine.new_game(puzzle['fen'])
+    white_to_move = engine.board.white_to_move
+
+    solution = []
+    def record_solution(info):
+        if not solution and is_mate_score(info.score) and (info.score > 0) == white_to_move:
+            solution.append((info.time_ms, info.nodes))
+    engine.search_info.subscribe(record_solution)
+
+    limits = SearchLimits(time_ms=budget) if budget_type == 'time' else SearchLimits(nodes=budget)
+    # the engine prints statistics after every search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        engine.iterative_deepening(limits)
+    engine.search_info.unsubscribe(record_solution)
+
+    time_ms, nodes = solution[0] if solution else (None, None)
+    return puzzle['index'], budget_type, budget, time_ms, nodes
+
+def average(values):
+    return sum(values) / len(values) if values else 0
+
+def print_curve(budget_type, rows, total):
+    unit = 'ms' if budget_type == 'time' else 'nodes'
+    print(f"\nSolve rate by {budget_type} budget ({total} puzzles)")
+    for row in rows:
+        bar = '#' * round(row['solve_rate'] * CURVE_WIDTH)
+        print(f"{row['budget']:>8} {unit:<5} {bar:<{CURVE_WIDTH}} {row['solved']:>3}/{total} ({row['solve_rate']:.0%}), "
+              f"average to solution: {row['average_time_ms']:.0f} ms, {row['average_nodes']:.0f} nodes")
+
+def run_benchmark(times_ms, node_budgets, workers=None, results_path=RESULTS_FILE):
+    puzzles = read_puzzles()
+    tasks = [(puzzle, 'time', budget) for budget in times_ms for puzzle in puzzles]
+    tasks += [(puzzle, 'nodes', budget) for budget in node_budgets for puzzle in puzzles]
+    sections = {puzzle['index']: puzzle['section'] for puzzle in puzzles}
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        results = list(executor.map(solve, *zip(*tasks)))
+    print(f"{len(tasks)} searches of {len(puzzles)} puzzles in {time.time() - start_time:.1f} sec")
+
+    rows = []
+    for budget_type, budgets in (('time', times_ms), ('nodes', node_budgets)):
+        curve = []
+        for budget in budgets:
+            solved = [result for result in results if result[1] == budget_type and result[2] == budget and result[3] is not None]
+            row = {
+                'budget_type': budget_type,
+                'budget': budget,
+                'solved': len(solved),
+                'total': len(puzzles),
+                'solve_rate': round(len(solved) / len(puzzles), 3) if puzzles else 0,
+                'average_time_ms': round(average([result[3] for result in solved]), 1),
+                'average_nodes': round(average([result[4] for result in solved]), 1),
+            }
+            # solve rate of every section
+            for section in dict.fromkeys(sections.values()):
+                section_total = sum(1 for index in sections if sections[index] == section)
+                section_solved = sum(1 for result in solved if sections[result[0]] == section)
+                row[section] = f'{section_solved}/{section_total}'
+            curve.append(row)
+        if curve:
+            print_curve(budget_type, curve, len(puzzles))
+        rows.extend(curve)
+
+    if rows:
+        with open(results_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nResults written to {results_path}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve rate of the mate puzzles under time and node budgets')
+    parser.add_argument('--times', type=int, nargs='*', default=DEFAULT_TIMES_MS, help='time budgets in ms')
+    parser.add_argument('--nodes', type=int, nargs='*', default=DEFAULT_NODES, help='node budgets')
+    parser.add_argument('--workers', type=int, default=None, help='parallel searches (default: number of cores)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='CSV file of the curves')
+    args = parser.parse_args()
+    run_benchmark(args.times, args.nodes, args.workers, args.output)
+
+if __name__ == "__main__":
+    main()
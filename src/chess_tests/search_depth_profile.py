@@ -0,0 +1,63 @@
+import multiprocessing
+import time
+from src.chess.board import Board
+from src.chess.engine import Engine
+from src.chess.lazy_smp import LazySMPSearch
+from src.chess_tests.engine_code_profile import mates
+
+TIME_LIMIT_MS = 3000
+
+# the mates finish as soon as the mate is found, so quiet positions are included as well
+quiet_positions = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 10',
+    '8/5pk1/6p1/3R4/7P/6P1/r4PK1/8 b - - 0 40',
+]
+positions = mates + quiet_positions
+
+# engine settings to compare (name, Engine keyword arguments)
+configurations = [
+    ('no reductions', {'null_move_pruning': False, 'late_move_reduction': False}),
+    ('null move', {'null_move_pruning': True, 'late_move_reduction': False}),
+    ('lmr', {'null_move_pruning': False, 'late_move_reduction': True}),
+    ('null move + lmr', {'null_move_pruning': True, 'late_move_reduction': True}),
+]
+
+def depth_reached(fen, settings, time_limit_ms=TIME_LIMIT_MS):
+    '''Return the depth reached on the position within the time limit.'''
+    engine = Engine(Board(fen), time_limit_ms=time_limit_ms, use_opening_book=False, **settings)
+    engine.iterative_deepening()
+    return engine.depth_reached
+
+def lazy_smp_depths_reached(threads, time_limit_ms=TIME_LIMIT_MS):
+    '''Return the depth reached on every position with a lazy SMP search.'''
+    search = LazySMPSearch(Board(), threads=threads, time_limit_ms=time_limit_ms)
+    depths = []
+    for fen in positions:
+        search.new_game(fen)
+        search.prepare_search()
+        search.iterative_deepening()
+        depths.append(search.depth_reached)
+    search.close()
+    return depths
+
+def main():
+    results = {}
+    for name, settings in configurations:
+        start_time = time.time()
+        results[name] = [depth_reached(fen, settings) for fen in positions]
+        results[name].append(time.time() - start_time)
+
+    threads = multiprocessing.cpu_count()
+    if threads > 1:
+        start_time = time.time()
+        results[f'lazy smp ({threads})'] = lazy_smp_depths_reached(threads) + [time.time() - start_time]
+
+    print(f"Depth reached in {TIME_LIMIT_MS} ms per position")
+    for name, depths in results.items():
+        *depths, duration = depths
+        print(f"{name:>16}: {depths}, average: {sum(depths) / len(depths):.2f}, total time: {duration:.2f} sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import contextlib
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.chess.board import Board
+from src.chess.engine import Engine, SearchLimits
+from src.chess.search_info import print_search_info
+
+'''
+Headless match between two engine configurations. Every opening is played twice with the colours
+swapped, the games run in parallel in a process pool.
+Run with: python -m src.chess_tests.tournament --nodes 3000
+'''
+
+# the two configurations to compare (name, Engine keyword arguments), the results are from engine A's side
+ENGINE_A = ('null move + lmr', {'null_move_pruning': True, 'late_move_reduction': True})
+ENGINE_B = ('no reductions', {'null_move_pruning': False, 'late_move_reduction': False})
+
+DEFAULT_NODES = 3000
+MAX_GAME_PLIES = 300 # the board has no 50 move rule, longer games are adjudicated as draws
+
+# SPRT: H0 elo <= ELO0, H1 elo >= ELO1 with error rates ALPHA and BETA
+ELO0 = 0
+ELO1 = 10
+ALPHA = 0.05
+BETA = 0.05
+
+# balanced positions after a few opening moves
+openings = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3', # open game
+    'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2', # sicilian
+    'rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2', # french
+    'rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2', # caro-kann
+    'rnbqkbnr/ppp1pppp/8/3p4/2PP4/8/PP2PPPP/RNBQKBNR b KQkq - 0 2', # queen's gambit
+    'rnbqkb1r/pppppp1p/5np1/8/2PP4/8/PP2PPPP/RNBQKBNR w KQkq - 0 3', # king's indian
+    'rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1', # english
+]
+
+def create_engine(settings):
+    engine = Engine(Board(), use_opening_book=False, **settings)
+    engine.search_info.unsubscribe(print_search_info)
+    return engine
+
+def play_game(game_index, fen, a_is_white, settings_a, settings_b, limits: SearchLimits):
+    '''Play one game and return its result from engine A's point of view (1, 0.5 or 0) with search statistics.'''
+    engines = {True: create_engine(settings_a), False: create_engine(settings_b)}
+    if not a_is_white:
+        engines = {True: engines[False], False: engines[True]}
+
+    board = Board(fen)
+    for engine in engines.values():
+        engine.new_game(fen)
+    depths = {True: [], False: []}
+    nps = {True: [], False: []}
+
+    # the engine prints statistics after every search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        plies = 0
+        while not board.is_game_over() and plies < MAX_GAME_PLIES:
+            white_to_move = board.white_to_move
+            engine = engines[white_to_move]
+            info = engine.iterative_deepening(limits)
+            if info.best_move is None:
+                break
+            board.make_move(info.best_move)
+            # both engines follow the game (their boards have the game history for repetitions)
+            for player in engines.values():
+                player.play_move(info.best_move)
+            depths[white_to_move].append(info.depth)
+            nps[white_to_move].append(info.nps)
+            plies += 1
+
+    if board.is_checkmate():
+        white_score = 0 if board.white_to_move else 1
+        termination = 'checkmate'
+    else:
+        white_score = 0.5
+        termination = 'draw' if board.is_game_over() else 'adjudication'
+
+    a = a_is_white
+    return {
+        'game': game_index,
+        'score': white_score if a_is_white else 1 - white_score,
+        'termination': termination,
+        'plies': plies,
+        'depths': (depths[a], depths[not a]),
+        'nps': (nps[a], nps[not a]),
+    }
+
+
+def elo_from_score(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+def score_from_elo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def elo_with_error(wins, draws, losses):
+    '''Elo difference and its 95% confidence margin.'''
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return elo_from_score(score), (elo_from_score(score + margin) - elo_from_score(score - margin)) / 2
+
+def sprt_llr(wins, draws, losses, elo0=ELO0, elo1=ELO1):
+    '''Log likelihood ratio of H1 (elo1) against H0 (elo0), normal approximation of the trinomial model.'''
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score ** 2
+    if variance <= 0:
+        return 0.0
+    s0, s1 = score_from_elo(elo0), score_from_elo(elo1)
+    return (s1 - s0) * (2 * score - s0 - s1) / (2 * variance / games)
+
+def sprt_bounds(alpha=ALPHA, beta=BETA):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+def average(values):
+    return sum(values) / len(values) if values else 0
+
+
+def run_tournament(rounds, limits: SearchLimits, workers=None):
+    name_a, settings_a = ENGINE_A
+    name_b, settings_b = ENGINE_B
+
+    games = []
+    for _ in range(rounds):
+        for fen in openings:
+            for a_is_white in (True, False):
+                games.append((len(games), fen, a_is_white))
+
+    print(f"{name_a} vs {name_b}: {len(games)} games, {limits}")
+    wins = draws = losses = 0
+    depths = ([], [])
+    nps = ([], [])
+    lower, upper = sprt_bounds()
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_game, index, fen, a_is_white, settings_a, settings_b, limits) for index, fen, a_is_white in games]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['score'] == 1:
+                wins += 1
+            elif result['score'] == 0:
+                losses += 1
+            else:
+                draws += 1
+            for side in (0, 1):
+                depths[side].extend(result['depths'][side])
+                nps[side].extend(result['nps'][side])
+
+            llr = sprt_llr(wins, draws, losses)
+            print(f"game {result['game']}: {result['score']} ({result['termination']}, {result['plies']} plies), "
+                  f"W/D/L: {wins}/{draws}/{losses}, LLR: {llr:.2f} ({lower:.2f}, {upper:.2f})")
+
+    elo, margin = elo_with_error(wins, draws, losses)
+    llr = sprt_llr(wins, draws, losses)
+    if llr >= upper:
+        verdict = 'H1 accepted'
+    elif llr <= lower:
+        verdict = 'H0 accepted'
+    else:
+        verdict = 'inconclusive'
+
+    print(f"\n{name_a} vs {name_b} in {time.time() - start_time:.0f} sec")
+    print(f"W/D/L: {wins}/{draws}/{losses}, Elo: {elo:+.1f} +/- {margin:.1f}")
+    print(f"SPRT [{ELO0}, {ELO1}]: LLR {llr:.2f} ({lower:.2f}, {upper:.2f}), {verdict}")
+    for side, name in enumerate((name_a, name_b)):
+        print(f"{name:>16}: average depth {average(depths[side]):.2f}, average nps {average(nps[side]):.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Play engine A against engine B')
+    parser.add_argument('--rounds', type=int, default=1, help='times every opening is played with both colours')
+    parser.add_argument('--nodes', type=int, default=None, help='node limit per move')
+    parser.add_argument('--time', type=int, default=None, help='time limit per move in ms')
+    parser.add_argument('--workers', type=int, default=None, help='parallel games (default: number of cores)')
+    args = parser.parse_args()
+
+    nodes = args.nodes if args.nodes is not None or args.time is not None else DEFAULT_NODES
+    run_tournament(args.rounds, SearchLimits(time_ms=args.time, nodes=nodes), args.workers)
+
+if __name__ == "__main__":
+    main()